@@ -0,0 +1,250 @@
+import os
+import asyncio
+import logging
+import functools
+import threading
+import contextvars
+from concurrent.futures import Future, ThreadPoolExecutor, CancelledError
+from dotenv import load_dotenv
+import metrics
+
+# Загружаем переменные окружения
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Количество потоков для блокирующих вызовов из корутин (Telegram Bot API, загрузка карт)
+ASYNC_BLOCKING_WORKERS = int(os.getenv("ASYNC_BLOCKING_WORKERS", "32"))
+
+_loop = None
+_loop_lock = threading.Lock()
+
+_blocking_executor = ThreadPoolExecutor(max_workers=ASYNC_BLOCKING_WORKERS, thread_name_prefix="blocking")
+
+# Фоновые задачи: цикл событий хранит на них только слабые ссылки
+_tasks = set()
+
+# Очереди обработчиков по пользователям: ключ -> [замок, количество обработчиков в очереди]
+_handler_queues = {}
+
+def get_loop():
+    """
+    Возвращает общий цикл событий процесса, запуская его при первом вызове
+
+    Цикл работает в отдельном фоновом потоке; в нём выполняются все
+    обработчики бота и запросы к внешним API.
+
+    Returns:
+        asyncio.AbstractEventLoop: Цикл событий
+    """
+    global _loop
+    if _loop is not None:
+        return _loop
+
+    with _loop_lock:
+        if _loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="event-loop", daemon=True).start()
+            _loop = loop
+    return _loop
+
+def in_loop():
+    """Проверяет, выполняется ли код в общем цикле событий"""
+    try:
+        return asyncio.get_running_loop() is _loop
+    except RuntimeError:
+        return False
+
+def submit(coro):
+    """
+    Запускает корутину в общем цикле событий из любого потока
+
+    Корутина выполняется с копией контекста вызывающего потока, поэтому
+    сохраняет, например, класс приоритета запросов (upstream.priority).
+
+    Args:
+        coro: Корутина
+
+    Returns:
+        concurrent.futures.Future: Результат корутины
+    """
+    loop = get_loop()
+    future = Future()
+
+    def start():
+        if not future.set_running_or_notify_cancel():
+            coro.close()
+            return
+        task = loop.create_task(coro)
+        task.add_done_callback(functools.partial(_copy_result, future))
+
+    loop.call_soon_threadsafe(start, context=contextvars.copy_context())
+    return future
+
+def _copy_result(future, task):
+    """Переносит результат задачи цикла событий в Future вызывающего потока"""
+    if task.cancelled():
+        future.set_exception(CancelledError())
+    elif task.exception() is not None:
+        future.set_exception(task.exception())
+    else:
+        future.set_result(task.result())
+
+def run(coro, timeout=None):
+    """
+    Выполняет корутину в общем цикле событий и ждёт результата
+
+    Основа синхронных обёрток над асинхронными функциями модулей API.
+    Вызывать можно из любого потока, кроме потока цикла событий: там
+    корутину нужно ожидать через await.
+
+    Args:
+        coro: Корутина
+        timeout (float): Максимальное время ожидания в секундах
+
+    Returns:
+        Результат корутины (исключение пробрасывается)
+
+    Raises:
+        RuntimeError: Если вызвана из цикла событий
+    """
+    if in_loop():
+        coro.close()
+        raise RuntimeError("Синхронную обёртку нельзя вызывать в цикле событий, используйте await")
+    return submit(coro).result(timeout)
+
+async def to_thread(func, *args, **kwargs):
+    """
+    Выполняет блокирующую функцию в пуле потоков, не останавливая цикл событий
+
+    Args:
+        func (callable): Блокирующая функция (например, вызов Telegram Bot API)
+
+    Returns:
+        Результат функции
+    """
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(_blocking_executor, functools.partial(context.run, func, *args, **kwargs))
+
+def spawn(coro):
+    """
+    Запускает корутину в фоне (только из цикла событий)
+
+    Задача выполняется до конца, даже если её результат никто не ждёт;
+    исключения записываются в лог.
+
+    Args:
+        coro: Корутина
+
+    Returns:
+        asyncio.Task: Задача
+    """
+    task = asyncio.ensure_future(coro)
+    _tasks.add(task)
+    task.add_done_callback(_forget_task)
+    return task
+
+def _forget_task(task):
+    """Удаляет завершённую фоновую задачу и записывает её ошибку в лог"""
+    _tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("Ошибка фоновой задачи", exc_info=task.exception())
+
+def handler(func, state=None):
+    """
+    Превращает корутину-обработчик в обработчик python-telegram-bot
+
+    Обработчик только ставит корутину в очередь обновлений пользователя в
+    цикле событий и сразу возвращает управление диспетчеру, поэтому
+    ожидание ответов API не занимает его потоки. Обновления одного
+    пользователя обрабатываются по очереди и не теряются, пока
+    выполняется предыдущее.
+
+    ConversationHandler сразу переходит в состояние state, не дожидаясь
+    корутины: её результат не используется. Исключения передаются
+    обработчикам ошибок диспетчера.
+
+    Args:
+        func (callable): Корутина (update, context)
+        state: Следующее состояние беседы (None - не менять)
+
+    Returns:
+        callable: Обработчик (update, context)
+    """
+    @functools.wraps(func)
+    def callback(update, context):
+        submit(_run_handler(func, update, context))
+        return state
+
+    return callback
+
+async def _run_handler(func, update, context):
+    """Выполняет обработчик в очереди обновлений пользователя"""
+    key = _get_handler_key(update)
+    entry = _handler_queues.setdefault(key, [asyncio.Lock(), 0])
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            try:
+                await func(update, context)
+            except Exception as e:
+                await to_thread(context.dispatcher.dispatch_error, update, e)
+    finally:
+        entry[1] -= 1
+        if not entry[1]:
+            del _handler_queues[key]
+
+def _get_handler_key(update):
+    """Ключ очереди обработчиков: пользователь, чат или само обновление"""
+    if update.effective_user is not None:
+        return update.effective_user.id
+    if update.effective_chat is not None:
+        return update.effective_chat.id
+    return update.update_id
+
+def join(key, timeout=None):
+    """
+    Ждёт, пока будут обработаны все уже полученные обновления пользователя
+
+    Нужна, когда обновления передаются диспетчеру напрямую и требуется
+    дождаться ответа бота (например, в нагрузочном тесте).
+
+    Args:
+        key: Идентификатор пользователя
+        timeout (float): Максимальное время ожидания в секундах
+    """
+    run(_wait_handlers(key), timeout)
+
+async def _wait_handlers(key):
+    entry = _handler_queues.get(key)
+    if entry is not None:
+        async with entry[0]:
+            pass
+
+def drain(timeout=None):
+    """
+    Ждёт завершения всех обработчиков, уже поставленных в цикл событий
+
+    Вызывается при остановке бота после того, как диспетчер перестал
+    принимать обновления.
+
+    Args:
+        timeout (float): Максимальное время ожидания в секундах
+    """
+    run(_wait_all_handlers(), timeout)
+
+async def _wait_all_handlers():
+    while _handler_queues:
+        await asyncio.sleep(0.1)
+
+def _count_handlers():
+    return sum(entry[1] for entry in list(_handler_queues.values()))
+
+metrics.GaugeFunc(
+    "bot_handlers_in_flight", "Количество обновлений, которые обрабатываются или ждут своей очереди", _count_handlers
+)
+metrics.GaugeFunc(
+    "async_blocking_queue_depth", "Количество блокирующих вызовов, ожидающих свободного потока",
+    _blocking_executor._work_queue.qsize
+)
@@ -1,11 +1,31 @@
 import os
+import html
+import time
+import asyncio
 import logging
+import datetime
+import pytz
 from dotenv import load_dotenv
+from requests.exceptions import RequestException
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, KeyboardButton
 from telegram.ext import Updater, CommandHandler, MessageHandler, Filters, CallbackContext, CallbackQueryHandler, ConversationHandler
-from yandex_api import get_nearby_places, get_place_details, get_static_map_url, get_route_url
-from perplexity_api import get_place_description, get_excursion_info, get_place_reviews
-from geopy.distance import geodesic
+from yandex_api import get_nearby_places_async, get_place_details_async, get_route_url, get_tour_url
+from perplexity_api import (
+    get_place_description_async, get_excursion_info_async, get_place_reviews_async,
+    stream_excursion_info_async, is_error_response, warm_place_content, purge_expired_responses
+)
+from prefetch import PrefetchScheduler
+from session_store import Place, create_session_store, SESSION_IDLE_TTL
+from cache import TTLCache
+from media_cache import map_media
+from popularity import PopularityTracker
+from tour import plan_tour
+from geo import haversine, distances_from
+import metrics
+import upstream
+import webhook
+import async_runtime
+import outbox
 
 # Загружаем переменные окружения
 load_dotenv()
@@ -37,15 +57,104 @@ RADIUS_OPTIONS = {
     "1 километр": 1000
 }
 
+# Режим получения обновлений: polling (по умолчанию) или webhook
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+
 # Хранилище данных пользователей
-user_data_store = {}
+sessions = create_session_store()
+
+# Интервал записи метрик хранилища сессий в лог (в секундах)
+SESSION_STATS_INTERVAL = int(os.getenv("SESSION_STATS_INTERVAL", "300"))
+
+# Показывать карточку места до того, как готово описание
+PLACE_CARD_PROGRESSIVE = os.getenv("PLACE_CARD_PROGRESSIVE", "0") == "1"
+
+# Упреждающая генерация экскурсии и отзывов после открытия карточки места
+PREFETCH_ENABLED = os.getenv("PREFETCH_ENABLED", "1") == "1"
+prefetcher = PrefetchScheduler(workers=int(os.getenv("PREFETCH_WORKERS", "4")))
+
+# Готовые тексты упреждающих запросов хранятся не в сессии: обработчики сохраняют
+# свою копию сессии целиком и перезаписали бы их. Обновления одного пользователя
+# обрабатываются одним процессом, поэтому достаточно кэша в памяти
+PREFETCH_CACHE_SIZE = int(os.getenv("PREFETCH_CACHE_SIZE", "10000"))
+_prefetched = TTLCache(maxsize=PREFETCH_CACHE_SIZE, ttl=SESSION_IDLE_TTL)
+metrics.register_cache("prefetched", _prefetched)
+
+# Потоковый вывод экскурсии по мере генерации
+LLM_STREAMING = os.getenv("LLM_STREAMING", "1") == "1"
+
+# Минимальный интервал между правками одного сообщения (лимит Telegram - около 1 в секунду на чат)
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.5"))
+
+# Задержка первой правки, чтобы первая версия содержала хотя бы несколько слов
+STREAM_FIRST_EDIT_DELAY = float(os.getenv("STREAM_FIRST_EDIT_DELAY", "0.3"))
+
+# Максимальная длина текста сообщения в Telegram
+MESSAGE_LIMIT = 4096
+
+# Функции генерации текста для упреждающих запросов (в порядке приоритета)
+PREFETCH_KINDS = {
+    "excursion": get_excursion_info_async,
+    "reviews": get_place_reviews_async,
+}
+
+# Количество первых мест списка, карты которых заранее загружаются в Telegram
+MAP_WARMUP_PLACES = int(os.getenv("MAP_WARMUP_PLACES", "5"))
+
+# Прогрев кэша самыми популярными местами каждого района в часы низкой нагрузки
+CACHE_WARMUP_ENABLED = os.getenv("CACHE_WARMUP_ENABLED", "1") == "1"
+CACHE_WARMUP_TIME = os.getenv("CACHE_WARMUP_TIME", "04:00")
+CACHE_WARMUP_TZ = os.getenv("CACHE_WARMUP_TZ", "Europe/Moscow")
+CACHE_WARMUP_TOP = int(os.getenv("CACHE_WARMUP_TOP", "20"))
 
-def start(update: Update, context: CallbackContext) -> int:
+# Записи, которые истекут раньше чем через это время (в секундах), генерируются заново
+CACHE_WARMUP_REFRESH_BEFORE = int(os.getenv("CACHE_WARMUP_REFRESH_BEFORE", str(2 * 24 * 3600)))
+
+# Затухание счётчиков популярности после каждого прогрева
+CACHE_WARMUP_DECAY = float(os.getenv("CACHE_WARMUP_DECAY", "0.7"))
+
+# Время ежедневного удаления истёкших записей из постоянных кэшей (в часовом поясе прогрева)
+CACHE_PURGE_TIME = os.getenv("CACHE_PURGE_TIME", "03:30")
+
+# Количество мест на одной странице списка
+PLACES_PAGE_SIZE = int(os.getenv("PLACES_PAGE_SIZE", "5"))
+
+# Сколько мест загружается за один запрос при поиске и листании списка
+PLACES_BATCH_SIZE = int(os.getenv("PLACES_BATCH_SIZE", "20"))
+
+# Геопозиция в реальном времени: вокруг круга поиска заранее загружаются места
+# с запасом LIVE_AREA_MARGIN метров, а новая область запрашивается, только когда
+# пользователь отошёл от центра прежней больше чем на долю LIVE_REQUERY_FRACTION запаса
+LIVE_AREA_MARGIN = int(os.getenv("LIVE_AREA_MARGIN", "1000"))
+LIVE_REQUERY_FRACTION = float(os.getenv("LIVE_REQUERY_FRACTION", "0.7"))
+LIVE_CANDIDATES = int(os.getenv("LIVE_CANDIDATES", "100"))
+
+# Шаг расстояния (в метрах), при изменении на который обновляется список мест
+LIVE_DISTANCE_STEP = 50
+
+# Текст списка мест при трансляции геопозиции, когда в радиусе поиска пока пусто
+LIVE_EMPTY_TEXT = "Рядом пока нет интересных мест. Список обновится, когда вы подойдёте к ним."
+
+# Максимальное количество мест в маршруте по нескольким местам (кнопок в сообщении Telegram - не больше 100)
+TOUR_MAX_STOPS = int(os.getenv("TOUR_MAX_STOPS", "50"))
+
+# Статистика открытий мест
+popularity = PopularityTracker()
+
+# Метрики состояния, вычисляемые при каждом сборе
+metrics.GaugeFunc("bot_active_sessions", "Количество активных сессий пользователей", lambda: sessions.stats()["sessions"])
+metrics.GaugeFunc("bot_session_bytes", "Суммарный размер сессий в байтах", lambda: sessions.stats()["bytes"])
+metrics.GaugeFunc("bot_prefetch_queue_depth", "Количество задач в очереди упреждающих запросов", prefetcher.pending)
+
+@metrics.track_handler
+async def start(update: Update, context: CallbackContext) -> int:
     """Обработчик команды /start"""
     user = update.effective_user
-    update.message.reply_text(
+    await _reply(
+        update,
         f"Привет, {user.first_name}! Я бот-экскурсовод, который поможет вам найти интересные достопримечательности поблизости. "
-        f"Чтобы начать, отправьте мне свою геолокацию, нажав на кнопку ниже.",
+        f"Чтобы начать, отправьте мне свою геолокацию, нажав на кнопку ниже. "
+        f"Если поделиться геопозицией в реальном времени, список мест будет обновляться по мере движения.",
         reply_markup=ReplyKeyboardMarkup(
             [[KeyboardButton("Отправить местоположение", request_location=True)]],
             resize_keyboard=True,
@@ -54,41 +163,51 @@ def start(update: Update, context: CallbackContext) -> int:
     )
     return LOCATION
 
-def location_handler(update: Update, context: CallbackContext) -> int:
+@metrics.track_handler
+async def location_handler(update: Update, context: CallbackContext) -> int:
     """Обработчик получения геолокации"""
     user_id = update.effective_user.id
     user_location = update.message.location
     
     # Сохраняем данные пользователя
-    user_data_store[user_id] = {
+    await sessions.save_async(user_id, {
         "location": {
             "latitude": user_location.latitude,
             "longitude": user_location.longitude
-        }
-    }
+        },
+        # Трансляция геопозиции: дальнейшие координаты придут правками этого сообщения
+        "live": bool(user_location.live_period)
+    })
     
     # Предлагаем выбрать радиус поиска
     keyboard = []
     for radius_name in RADIUS_OPTIONS:
         keyboard.append([InlineKeyboardButton(radius_name, callback_data=f"radius_{RADIUS_OPTIONS[radius_name]}")])
     
-    update.message.reply_text(
+    await _reply(
+        update,
         "В каком радиусе искать достопримечательности?",
         reply_markup=InlineKeyboardMarkup(keyboard)
     )
     
     return RADIUS
 
-def radius_handler(update: Update, context: CallbackContext) -> int:
+@metrics.track_handler
+async def radius_handler(update: Update, context: CallbackContext) -> int:
     """Обработчик выбора радиуса"""
     query = update.callback_query
-    query.answer()
+    await async_runtime.to_thread(query.answer)
     
     user_id = query.from_user.id
     radius = int(query.data.split('_')[1])
+    user_data = await _get_session(query)
+    if user_data is None:
+        return ConversationHandler.END
     
-    # Сохраняем радиус поиска
-    user_data_store[user_id]["radius"] = radius
+    # Сохраняем радиус поиска и инициализируем список интересов
+    user_data["radius"] = radius
+    user_data["interests"] = []
+    await sessions.save_async(user_id, user_data)
     
     # Предлагаем выбрать категории интересов
     keyboard = []
@@ -96,320 +215,897 @@ def radius_handler(update: Update, context: CallbackContext) -> int:
         keyboard.append([InlineKeyboardButton(category, callback_data=f"interest_{category}")])
     keyboard.append([InlineKeyboardButton("Готово", callback_data="interest_done")])
     
-    query.edit_message_text(
+    await _edit_message(
+        query,
         "Какие типы достопримечательностей вас интересуют? Выберите один или несколько вариантов:",
         reply_markup=InlineKeyboardMarkup(keyboard)
     )
     
-    # Инициализируем список интересов
-    user_data_store[user_id]["interests"] = []
-    
     return INTERESTS
 
-def interest_handler(update: Update, context: CallbackContext) -> int:
+@metrics.track_handler
+async def interest_handler(update: Update, context: CallbackContext) -> int:
     """Обработчик выбора интересов"""
     query = update.callback_query
-    query.answer()
+    await async_runtime.to_thread(query.answer)
     
     user_id = query.from_user.id
     data = query.data
     
     if data == "interest_done":
         # Пользователь закончил выбор интересов
-        return search_places(update, context)
+        return await search_places(update, context)
     
     # Добавляем/удаляем интерес
     interest = data.split('_')[1]
+    user_data = await _get_session(query)
+    if user_data is None:
+        return ConversationHandler.END
     
-    if interest in user_data_store[user_id]["interests"]:
-        user_data_store[user_id]["interests"].remove(interest)
+    if interest in user_data["interests"]:
+        user_data["interests"].remove(interest)
     else:
-        user_data_store[user_id]["interests"].append(interest)
+        user_data["interests"].append(interest)
+    await sessions.save_async(user_id, user_data)
     
     # Обновляем клавиатуру с отметками выбранных интересов
     keyboard = []
     for category in INTEREST_CATEGORIES:
-        text = f"✅ {category}" if category in user_data_store[user_id]["interests"] else category
+        text = f"✅ {category}" if category in user_data["interests"] else category
         keyboard.append([InlineKeyboardButton(text, callback_data=f"interest_{category}")])
     keyboard.append([InlineKeyboardButton("Готово", callback_data="interest_done")])
     
-    query.edit_message_text(
+    await _edit_message(
+        query,
         "Какие типы достопримечательностей вас интересуют? Выберите один или несколько вариантов:",
         reply_markup=InlineKeyboardMarkup(keyboard)
     )
     
     return INTERESTS
 
-def search_places(update: Update, context: CallbackContext) -> int:
+@metrics.track_handler
+async def search_places(update: Update, context: CallbackContext) -> int:
     """Поиск достопримечательностей на основе выбранных параметров"""
     query = update.callback_query
     user_id = query.from_user.id
-    user_data = user_data_store[user_id]
-    
-    # Преобразуем интересы в типы мест для API
-    place_types = []
-    for interest in user_data["interests"]:
-        place_types.extend(INTEREST_CATEGORIES[interest])
+    user_data = await _get_session(query)
+    if user_data is None:
+        return ConversationHandler.END
     
-    # Если ничего не выбрано, используем все типы
-    if not place_types:
-        for categories in INTEREST_CATEGORIES.values():
-            place_types.extend(categories)
+    place_types = _get_place_types(user_data)
     
     # Поиск мест
-    query.edit_message_text("Ищу интересные места поблизости...")
+    _show_progress(query, "Ищу интересные места поблизости...")
     
-    places = get_nearby_places(
-        user_data["location"]["latitude"],
-        user_data["location"]["longitude"],
-        user_data["radius"],
-        place_types
-    )
+    if user_data.get("live"):
+        places = await _search_live_area(user_data, place_types)
+    else:
+        places = await get_nearby_places_async(
+            user_data["location"]["latitude"],
+            user_data["location"]["longitude"],
+            user_data["radius"],
+            place_types,
+            limit=PLACES_BATCH_SIZE,
+            expand_radii=RADIUS_OPTIONS.values()
+        )
+        places = [Place.from_record(place) for place in places]
     
-    if not places:
-        query.edit_message_text(
+    if not places and not user_data.get("live"):
+        await _edit_message(
+            query,
             "К сожалению, я не нашел интересных мест поблизости. Попробуйте увеличить радиус поиска или выбрать другие категории.",
             reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("Начать заново", callback_data="restart")]])
         )
         return ConversationHandler.END
     
-    # Сохраняем найденные места
+    text = "Я нашел несколько интересных мест поблизости. Выберите одно из них:"
+    if not places:
+        # При трансляции геопозиции список остаётся открытым и заполнится, когда пользователь подойдёт к местам
+        text = LIVE_EMPTY_TEXT
+    elif places[-1].distance > user_data["radius"]:
+        # В выбранном радиусе пусто, и поиск был расширен до ближайшего радиуса с местами
+        radius = min((r for r in RADIUS_OPTIONS.values() if r >= places[-1].distance), default=int(places[-1].distance) + 1)
+        text = (
+            f"В радиусе {user_data['radius']} метров ничего не нашлось, поэтому я расширил поиск "
+            f"до {radius} метров. Выберите одно из мест:"
+        )
+        user_data["radius"] = radius
+    
+    # Сохраняем найденные места в компактном виде
     user_data["places"] = places
+    user_data["places_page"] = 0
+    # Если API вернул меньше запрошенного, догружать при листании нечего;
+    # при трансляции геопозиции список строится из уже загруженной области
+    user_data["places_complete"] = user_data.get("live") or len(places) < PLACES_BATCH_SIZE
+    _remember_list_message(user_data, query)
+    await sessions.save_async(user_id, user_data)
+    _schedule_map_warmup(context, places)
     
     # Предлагаем выбрать место
-    keyboard = []
-    for i, place in enumerate(places[:5]):  # Ограничиваем список 5 местами
-        distance = geodesic(
-            (user_data["location"]["latitude"], user_data["location"]["longitude"]),
-            (place["geometry"]["location"]["lat"], place["geometry"]["location"]["lng"])
-        ).meters
-        
-        keyboard.append([
-            InlineKeyboardButton(
-                f"{place['name']} (~{int(distance)}м)",
-                callback_data=f"place_{i}"
-            )
-        ])
-    
-    query.edit_message_text(
-        "Я нашел несколько интересных мест поблизости. Выберите одно из них:",
-        reply_markup=InlineKeyboardMarkup(keyboard)
-    )
+    await _edit_message(query, text, reply_markup=_get_places_keyboard(user_data))
     
     return PLACE_SELECTION
 
-def place_selection_handler(update: Update, context: CallbackContext) -> int:
+@metrics.track_handler
+async def place_selection_handler(update: Update, context: CallbackContext) -> int:
     """Обработчик выбора места"""
     query = update.callback_query
-    query.answer()
+    await async_runtime.to_thread(query.answer)
     
     user_id = query.from_user.id
-    place_index = int(query.data.split('_')[1])
-    selected_place = user_data_store[user_id]["places"][place_index]
+    user_data = await _get_session(query)
+    if user_data is None:
+        return ConversationHandler.END
+    if query.data == "card":
+        # Возврат к открытой карточке: при трансляции геопозиции номер места в списке мог измениться
+        selected_place = user_data["selected_place"]
+    else:
+        place_index = int(query.data.split('_')[1])
+        if place_index >= len(user_data["places"]):
+            # Список обновился после перемещения пользователя, а кнопка осталась от прежнего
+            await _edit_message(query, "Выберите одно из мест:", reply_markup=_get_places_keyboard(user_data))
+            return PLACE_SELECTION
+        selected_place = user_data["places"][place_index]
+    
+    # Пользователь открыл другое место - упреждающие запросы для прежнего больше не нужны
+    prefetcher.cancel(user_id)
+    user_data.pop("list_message", None)
     
     # Получаем детальную информацию о месте
-    query.edit_message_text(f"Загружаю информацию о {selected_place['name']}...")
+    _show_progress(query, f"Загружаю информацию о {selected_place.name}...")
     
-    place_details = get_place_details(selected_place["place_id"])
-    user_data_store[user_id]["selected_place"] = place_details
+    # Детали, описание и карта не зависят друг от друга, поэтому загружаем их параллельно
+    details_future = asyncio.ensure_future(get_place_details_async(selected_place.place_id))
+    description_future = asyncio.ensure_future(get_place_description_async(
+        selected_place.name,
+        selected_place.address or "Адрес недоступен",
+        selected_place.coordinates
+    ))
+    map_future = asyncio.ensure_future(async_runtime.to_thread(map_media.get_photo, selected_place.lat, selected_place.lng))
     
-    # Формируем информацию о месте
-    user_location = user_data_store[user_id]["location"]
-    place_location = place_details["geometry"]["location"]
+    # Если детали получить не удалось, показываем данные из результатов поиска
+    place_details = await details_future
+    place = Place.from_record(place_details) if place_details else selected_place
+    # Расстояние вычислено при поиске
+    place.distance = selected_place.distance
     
-    distance = geodesic(
-        (user_location["latitude"], user_location["longitude"]),
-        (place_location["lat"], place_location["lng"])
-    ).meters
+    user_data["selected_place"] = place
+    await sessions.save_async(user_id, user_data)
     
-    address = place_details.get("formatted_address", "Адрес недоступен")
+    # Учитываем открытие места для ночного прогрева кэша, не задерживая ответ
+    async_runtime.spawn(async_runtime.to_thread(popularity.record, place))
     
-    # Получаем описание с помощью Perplexity API
-    place_description = get_place_description(place_details['name'], address)
-    
-    place_info = (
-        f"📍 <b>{place_details['name']}</b>\n\n"
-        f"📏 Расстояние: {int(distance)} метров\n"
-        f"🏠 Адрес: {address}\n\n"
-        f"{place_description}\n"
+    # Формируем информацию о месте
+    place_header = (
+        f"📍 <b>{html.escape(place.name)}</b>\n\n"
+        f"📏 Расстояние: {int(place.distance)} метров\n"
+        f"🏠 Адрес: {html.escape(place.address or 'Адрес недоступен')}\n\n"
     )
+    reply_markup = _get_place_keyboard()
     
-    if "photos" in place_details:
-        # Используем статическую карту Яндекса
-        photo_coords = place_details["photos"][0]["photo_reference"].split(",")
-        photo_url = get_static_map_url(photo_coords[0], photo_coords[1])
-        
-        # Отправляем фото и информацию
-        context.bot.send_photo(
-            chat_id=query.message.chat_id,
-            photo=photo_url,
-            caption=place_info,
-            parse_mode="HTML",
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("Проложить маршрут", callback_data=f"route_{place_index}")],
-                [InlineKeyboardButton("Мини-экскурсия", callback_data=f"excursion_{place_index}")],
-                [InlineKeyboardButton("Отзывы", callback_data=f"reviews_{place_index}")],
-                [InlineKeyboardButton("Выбрать другое место", callback_data="back_to_places")]
-            ])
+    if PLACE_CARD_PROGRESSIVE and not description_future.done():
+        # Показываем карточку сразу, а описание дописываем, когда оно будет готово
+        message = await _send_place_card(
+            query, context, selected_place, map_future,
+            place_header + "<i>Загружаю описание...</i>\n", reply_markup
         )
-    else:
-        # Отправляем только информацию
-        query.edit_message_text(
-            place_info,
-            parse_mode="HTML",
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("Проложить маршрут", callback_data=f"route_{place_index}")],
-                [InlineKeyboardButton("Мини-экскурсия", callback_data=f"excursion_{place_index}")],
-                [InlineKeyboardButton("Отзывы", callback_data=f"reviews_{place_index}")],
-                [InlineKeyboardButton("Выбрать другое место", callback_data="back_to_places")]
-            ])
+        place_info = place_header + f"{html.escape(await description_future, quote=False)}\n"
+        await outbox.send_async(
+            message.chat_id, message.edit_caption, target=message.message_id,
+            caption=place_info, parse_mode="HTML", reply_markup=reply_markup
         )
+    else:
+        place_info = place_header + f"{html.escape(await description_future, quote=False)}\n"
+        await _send_place_card(query, context, selected_place, map_future, place_info, reply_markup)
+    
+    _schedule_prefetch(user_id, place)
     
     return PLACE_SELECTION
 
-def route_handler(update: Update, context: CallbackContext) -> int:
+def _schedule_prefetch(user_id, place):
+    """
+    Запускает фоновую генерацию экскурсии и отзывов для открытого места
+    
+    Результаты сохраняются в кэше готовых текстов по пользователю и месту.
+    """
+    if not PREFETCH_ENABLED:
+        return
+    
+    async def prefetch(kind):
+        with upstream.priority(upstream.PREFETCH):
+            text = await PREFETCH_KINDS[kind](place.name, place.address, place.coordinates)
+        if not is_error_response(text):
+            _prefetched.set((user_id, _get_place_key(place), kind), text)
+        return text
+    
+    for priority, kind in enumerate(PREFETCH_KINDS):
+        prefetcher.submit(user_id, kind, prefetch, kind, priority=priority)
+
+def _get_prefetched(user_id, place, kind):
+    """
+    Возвращает заранее сгенерированный текст для открытого места
+    
+    Если фоновая задача ещё не начата, она отменяется: запрос выполнит
+    обработчик. Уже выполняющаяся генерация будет переиспользована через
+    объединение одинаковых запросов в perplexity_api.
+    
+    Returns:
+        str: Готовый текст или None
+    """
+    text = _prefetched.get((user_id, _get_place_key(place), kind))
+    if text is not None:
+        return text
+    
+    future = prefetcher.get(user_id, kind)
+    if future is not None:
+        future.cancel()
+    
+    return None
+
+async def _send_place_card(query, context: CallbackContext, place, map_future, place_info, reply_markup):
+    """
+    Отправляет карточку места: фото карты с подписью
+    
+    Карта берётся из результатов поиска, так как для этих координат она
+    загружалась параллельно с остальными данными и могла быть прогрета заранее.
+    
+    Returns:
+        telegram.Message: Отправленное сообщение
+    """
+    # Карта уже загружена в Telegram (file_id) или получена из Яндекса параллельно с остальными данными
+    return await outbox.send_async(
+        query.message.chat_id,
+        map_media.send_photo,
+        context.bot,
+        query.message.chat_id,
+        place.lat,
+        place.lng,
+        photo=await map_future,
+        caption=place_info,
+        parse_mode="HTML",
+        reply_markup=reply_markup
+    )
+
+def _schedule_map_warmup(context: CallbackContext, places):
+    """
+    Заранее загружает в Telegram карты первых мест списка, пока пользователь выбирает
+    
+    Карты загружаются в отдельной очереди служебного чата и не отменяются
+    при открытии карточки: file_id пригодится и другим пользователям.
+    """
+    for place in places[:MAP_WARMUP_PLACES]:
+        map_media.warm_up(context.bot, place.lat, place.lng)
+
+def _get_place_keyboard():
+    """
+    Клавиатура действий с выбранным местом
+    
+    Кнопки относятся к месту из user_data["selected_place"], а не к номеру
+    в списке: при трансляции геопозиции список пересортировывается.
+    """
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton("Проложить маршрут", callback_data="route")],
+        [InlineKeyboardButton("Мини-экскурсия", callback_data="excursion")],
+        [InlineKeyboardButton("Отзывы", callback_data="reviews")],
+        [InlineKeyboardButton("Выбрать другое место", callback_data="back_to_places")]
+    ])
+
+@metrics.track_handler
+async def route_handler(update: Update, context: CallbackContext) -> int:
     """Обработчик запроса на построение маршрута"""
     query = update.callback_query
-    query.answer()
+    await async_runtime.to_thread(query.answer)
     
-    user_id = query.from_user.id
-    place_index = int(query.data.split('_')[1])
-    selected_place = user_data_store[user_id]["places"][place_index]
+    user_data = await _get_session(query)
+    if user_data is None:
+        return ConversationHandler.END
+    selected_place = user_data["selected_place"]
     
-    user_location = user_data_store[user_id]["location"]
-    place_location = selected_place["geometry"]["location"]
+    user_location = user_data["location"]
     
     # Формируем ссылку на Яндекс Карты для маршрута
     maps_url = get_route_url(
         user_location["latitude"], 
         user_location["longitude"],
-        place_location["lat"], 
-        place_location["lng"]
+        selected_place.lat, 
+        selected_place.lng
     )
     
-    query.edit_message_text(
-        f"Маршрут до {selected_place['name']} построен! Нажмите на кнопку ниже, чтобы открыть его в Яндекс Картах:",
+    await _edit_message(
+        query,
+        f"Маршрут до {selected_place.name} построен! Нажмите на кнопку ниже, чтобы открыть его в Яндекс Картах:",
         reply_markup=InlineKeyboardMarkup([
             [InlineKeyboardButton("Открыть маршрут", url=maps_url)],
-            [InlineKeyboardButton("Назад", callback_data=f"place_{place_index}")]
+            [InlineKeyboardButton("Назад", callback_data="card")]
         ])
     )
     
     return PLACE_SELECTION
 
-def excursion_handler(update: Update, context: CallbackContext) -> int:
+@metrics.track_handler
+async def excursion_handler(update: Update, context: CallbackContext) -> int:
     """Обработчик запроса на мини-экскурсию"""
     query = update.callback_query
-    query.answer()
+    await async_runtime.to_thread(query.answer)
     
     user_id = query.from_user.id
-    place_index = int(query.data.split('_')[1])
-    selected_place = user_data_store[user_id]["selected_place"]
-    
-    # Получаем адрес места
-    address = selected_place.get("formatted_address", "")
-    
-    # Генерируем мини-экскурсию с помощью Perplexity API
-    query.edit_message_text("Генерирую мини-экскурсию, пожалуйста, подождите...")
-    excursion_text = get_excursion_info(selected_place['name'], address)
+    user_data = await _get_session(query)
+    if user_data is None:
+        return ConversationHandler.END
+    selected_place = user_data["selected_place"]
+    
+    header = f"<b>Мини-экскурсия по {html.escape(selected_place.name)}</b>\n\n"
+    
+    # Генерируем мини-экскурсию с помощью Perplexity API, если она не готова заранее
+    excursion_text = _get_prefetched(user_id, selected_place, "excursion")
+    if excursion_text is None:
+        _show_progress(query, "Генерирую мини-экскурсию, пожалуйста, подождите...")
+        if LLM_STREAMING:
+            # Показываем экскурсию по мере генерации
+            excursion_text = await _stream_to_message(
+                query, header,
+                stream_excursion_info_async(selected_place.name, selected_place.address, selected_place.coordinates)
+            )
+        else:
+            excursion_text = await get_excursion_info_async(selected_place.name, selected_place.address, selected_place.coordinates)
     
     # Формируем текст экскурсии
-    full_text = (
-        f"<b>Мини-экскурсия по {selected_place['name']}</b>\n\n"
-        f"{excursion_text}"
-    )
+    full_text = header + _truncate_html_text(excursion_text, MESSAGE_LIMIT - len(header))
     
-    query.edit_message_text(
+    await _edit_message(
+        query,
         full_text,
         parse_mode="HTML",
         reply_markup=InlineKeyboardMarkup([
-            [InlineKeyboardButton("Назад", callback_data=f"place_{place_index}")]
+            [InlineKeyboardButton("Назад", callback_data="card")]
         ])
     )
     
     return PLACE_SELECTION
 
-def reviews_handler(update: Update, context: CallbackContext) -> int:
+async def _stream_to_message(query, header, chunks):
+    """
+    Постепенно показывает генерируемый текст, редактируя сообщение
+    
+    Правки объединяются так, чтобы сообщение обновлялось не чаще раза в
+    STREAM_EDIT_INTERVAL секунд, а каждая промежуточная версия была
+    корректным HTML. Версия, которую не успели отправить до следующей,
+    отбрасывается в очереди исходящих сообщений.
+    
+    Args:
+        query: CallbackQuery, сообщение которого редактируется
+        header (str): HTML-заголовок сообщения
+        chunks: Асинхронный итератор с текстом, накопленным к текущему моменту
+        
+    Returns:
+        str: Итоговый текст
+    """
+    text = ""
+    next_edit = time.monotonic() + STREAM_FIRST_EDIT_DELAY
+    async for text in chunks:
+        now = time.monotonic()
+        if now < next_edit:
+            continue
+        
+        partial = header + _truncate_html_text(text, MESSAGE_LIMIT - len(header) - 2) + " ▌"
+        next_edit = now + STREAM_EDIT_INTERVAL
+        _show_progress(query, partial, delay=0, parse_mode="HTML")
+    
+    return text
+
+def _truncate_html_text(text, limit):
+    """
+    Экранирует текст для HTML-разметки и обрезает его до лимита сообщения
+    
+    Обрезка выполняется до экранирования, чтобы не разрезать HTML-сущности.
+    
+    Args:
+        text (str): Исходный текст
+        limit (int): Максимальная длина результата
+        
+    Returns:
+        str: Экранированный текст
+    """
+    escaped = html.escape(text, quote=False)
+    if len(escaped) <= limit:
+        return escaped
+    
+    # Набираем символы, пока экранированный текст и многоточие помещаются в лимит
+    parts = []
+    length = 1
+    for char in text:
+        escaped_char = html.escape(char, quote=False)
+        if length + len(escaped_char) > limit:
+            break
+        parts.append(escaped_char)
+        length += len(escaped_char)
+    return "".join(parts) + "…"
+
+@metrics.track_handler
+async def reviews_handler(update: Update, context: CallbackContext) -> int:
     """Обработчик запроса на отзывы о месте"""
     query = update.callback_query
-    query.answer()
+    await async_runtime.to_thread(query.answer)
     
     user_id = query.from_user.id
-    place_index = int(query.data.split('_')[1])
-    selected_place = user_data_store[user_id]["selected_place"]
-    
-    # Получаем адрес места
-    address = selected_place.get("formatted_address", "")
+    user_data = await _get_session(query)
+    if user_data is None:
+        return ConversationHandler.END
+    selected_place = user_data["selected_place"]
     
-    # Получаем обзор отзывов с помощью Perplexity API
-    query.edit_message_text("Собираю отзывы, пожалуйста, подождите...")
-    reviews_text = get_place_reviews(selected_place['name'], address)
+    # Получаем обзор отзывов с помощью Perplexity API, если он не готов заранее
+    reviews_text = _get_prefetched(user_id, selected_place, "reviews")
+    if reviews_text is None:
+        _show_progress(query, "Собираю отзывы, пожалуйста, подождите...")
+        reviews_text = await get_place_reviews_async(selected_place.name, selected_place.address, selected_place.coordinates)
     
     # Формируем текст с отзывами
     full_text = (
-        f"<b>Отзывы посетителей о {selected_place['name']}</b>\n\n"
-        f"{reviews_text}"
+        f"<b>Отзывы посетителей о {html.escape(selected_place.name)}</b>\n\n"
+        f"{html.escape(reviews_text, quote=False)}"
     )
     
-    query.edit_message_text(
+    await _edit_message(
+        query,
         full_text,
         parse_mode="HTML",
         reply_markup=InlineKeyboardMarkup([
-            [InlineKeyboardButton("Назад", callback_data=f"place_{place_index}")]
+            [InlineKeyboardButton("Назад", callback_data="card")]
+        ])
+    )
+    
+    return PLACE_SELECTION
+
+@metrics.track_handler
+async def tour_handler(update: Update, context: CallbackContext) -> int:
+    """Обработчик выбора мест и построения маршрута по нескольким местам"""
+    query = update.callback_query
+    
+    user_id = query.from_user.id
+    data = query.data
+    user_data = await _get_session(query)
+    if user_data is None:
+        await async_runtime.to_thread(query.answer)
+        return ConversationHandler.END
+    places = user_data["places"][:TOUR_MAX_STOPS]
+    user_data.pop("list_message", None)
+    
+    if data == "tour_build":
+        if not user_data.get("tour"):
+            await async_runtime.to_thread(query.answer, "Выберите хотя бы одно место")
+            return PLACE_SELECTION
+        await async_runtime.to_thread(query.answer)
+        return await _show_tour(query, user_data, places)
+    
+    await async_runtime.to_thread(query.answer)
+    if data == "tour":
+        # По умолчанию в маршрут попадают места страницы, показанной в списке
+        start = user_data.get("places_page", 0) * PLACES_PAGE_SIZE
+        if start >= len(places):
+            start = 0
+        user_data["tour"] = list(range(start, min(start + PLACES_PAGE_SIZE, len(places))))
+    elif data != "tour_edit":
+        # Добавляем/удаляем место
+        place_index = int(data.split('_')[1])
+        selected = user_data.setdefault("tour", [])
+        if place_index in selected:
+            selected.remove(place_index)
+        else:
+            selected.append(place_index)
+    await sessions.save_async(user_id, user_data)
+    
+    # Обновляем клавиатуру с отметками выбранных мест
+    keyboard = []
+    for i, place in enumerate(places):
+        text = f"✅ {place.name}" if i in user_data.get("tour", []) else place.name
+        keyboard.append([InlineKeyboardButton(text, callback_data=f"tour_{i}")])
+    keyboard.append([InlineKeyboardButton("Построить маршрут", callback_data="tour_build")])
+    keyboard.append([InlineKeyboardButton("Назад", callback_data="back_to_places")])
+    
+    await _edit_message(
+        query,
+        "Выберите места, которые хотите посетить:",
+        reply_markup=InlineKeyboardMarkup(keyboard)
+    )
+    
+    return PLACE_SELECTION
+
+async def _show_tour(query, user_data, places):
+    """Строит маршрут по выбранным местам и показывает порядок их обхода"""
+    stops = [places[i] for i in sorted(user_data["tour"])]
+    
+    # Порядок обхода считаем локально, без запросов маршрутов между каждой парой мест
+    user_location = user_data["location"]
+    start = (user_location["latitude"], user_location["longitude"])
+    order, length = plan_tour(start, [(place.lat, place.lng) for place in stops])
+    stops = [stops[i] for i in order]
+    
+    lines = [f"{number}. {html.escape(place.name)}" for number, place in enumerate(stops, 1)]
+    maps_url = get_tour_url([start] + [(place.lat, place.lng) for place in stops])
+    
+    await _edit_message(
+        query,
+        "🚶 <b>Маршрут по выбранным местам</b>\n\n" + "\n".join(lines) +
+        f"\n\n📏 Общая длина: ~{int(length)} метров по прямой",
+        parse_mode="HTML",
+        reply_markup=InlineKeyboardMarkup([
+            [InlineKeyboardButton("Открыть маршрут", url=maps_url)],
+            [InlineKeyboardButton("Изменить места", callback_data="tour_edit")],
+            [InlineKeyboardButton("Назад", callback_data="back_to_places")]
         ])
     )
     
     return PLACE_SELECTION
 
-def back_to_places(update: Update, context: CallbackContext) -> int:
+@metrics.track_handler
+async def back_to_places(update: Update, context: CallbackContext) -> int:
     """Возврат к списку мест"""
     query = update.callback_query
-    query.answer()
+    await async_runtime.to_thread(query.answer)
     
     user_id = query.from_user.id
-    user_data = user_data_store[user_id]
+    user_data = await _get_session(query)
+    if user_data is None:
+        return ConversationHandler.END
+    
+    # Пользователь ушёл с карточки места - отменяем ещё не начатые фоновые запросы
+    prefetcher.cancel(user_id)
+    _remember_list_message(user_data, query)
+    await sessions.save_async(user_id, user_data)
     
     # Предлагаем выбрать место
+    await _edit_message(
+        query,
+        "Выберите одно из мест:",
+        reply_markup=_get_places_keyboard(user_data)
+    )
+    
+    return PLACE_SELECTION
+
+@metrics.track_handler
+async def places_page_handler(update: Update, context: CallbackContext) -> int:
+    """Обработчик листания списка мест"""
+    query = update.callback_query
+    
+    user_id = query.from_user.id
+    page = int(query.data.split('_')[1])
+    user_data = await _get_session(query)
+    if user_data is None:
+        await async_runtime.to_thread(query.answer)
+        return ConversationHandler.END
+    
+    # Следующую порцию запрашиваем, только когда загруженные места закончились
+    if len(user_data["places"]) <= page * PLACES_PAGE_SIZE and not user_data.get("places_complete"):
+        await async_runtime.to_thread(query.answer, "Ищу ещё места...")
+        new_places = await _load_more_places(user_data)
+        _schedule_map_warmup(context, new_places)
+    else:
+        await async_runtime.to_thread(query.answer)
+    
+    if len(user_data["places"]) <= page * PLACES_PAGE_SIZE:
+        # Новых мест не нашлось - остаёмся на последней странице
+        page = max(0, (len(user_data["places"]) - 1) // PLACES_PAGE_SIZE)
+    user_data["places_page"] = page
+    _remember_list_message(user_data, query)
+    await sessions.save_async(user_id, user_data)
+    
+    await _edit_message(
+        query,
+        "Выберите одно из мест:",
+        reply_markup=_get_places_keyboard(user_data)
+    )
+    
+    return PLACE_SELECTION
+
+async def _load_more_places(user_data):
+    """
+    Догружает следующую порцию мест к списку в сессии
+    
+    Результаты поиска кэшируются по ячейкам, поэтому у API запрашивается
+    только продолжение выдачи, а уже показанные места отбрасываются.
+    
+    Returns:
+        list: Новые места
+    """
+    places = user_data["places"]
+    limit = len(places) + PLACES_BATCH_SIZE
+    records = await get_nearby_places_async(
+        user_data["location"]["latitude"],
+        user_data["location"]["longitude"],
+        user_data["radius"],
+        _get_place_types(user_data),
+        limit=limit,
+        fetch_more=True
+    )
+    
+    # Новые места могут оказаться ближе уже показанных, поэтому сравниваем не по позиции, а по месту
+    known = {_get_place_key(place) for place in places}
+    new_places = []
+    for record in records:
+        place = Place.from_record(record)
+        if _get_place_key(place) not in known:
+            new_places.append(place)
+    
+    places.extend(new_places)
+    user_data["places_complete"] = len(records) < limit or not new_places
+    return new_places
+
+def _get_place_types(user_data):
+    """
+    Преобразует интересы пользователя в типы мест для API
+    
+    Returns:
+        list: Типы мест или None, если ничего не выбрано - тогда ищем
+        достопримечательности любого типа одним запросом
+    """
+    place_types = []
+    for interest in user_data["interests"]:
+        place_types.extend(INTEREST_CATEGORIES[interest])
+    return place_types or None
+
+def _get_place_key(place):
+    """Ключ для сравнения мест: идентификатор или координаты с точностью около метра"""
+    return place.place_id or (round(place.lat, 5), round(place.lng, 5))
+
+def _get_places_keyboard(user_data):
+    """
+    Клавиатура с текущей страницей списка мест
+    
+    Расстояния уже вычислены при поиске и хранятся вместе со списком мест.
+    Кнопки строятся только для показываемой страницы.
+    """
+    places = user_data["places"]
+    page = user_data.get("places_page", 0)
+    start = page * PLACES_PAGE_SIZE
+    
     keyboard = []
-    for i, place in enumerate(user_data["places"][:5]):
-        distance = geodesic(
-            (user_data["location"]["latitude"], user_data["location"]["longitude"]),
-            (place["geometry"]["location"]["lat"], place["geometry"]["location"]["lng"])
-        ).meters
-        
+    for i in range(start, min(start + PLACES_PAGE_SIZE, len(places))):
         keyboard.append([
             InlineKeyboardButton(
-                f"{place['name']} (~{int(distance)}м)",
+                f"{places[i].name} (~{int(places[i].distance)}м)",
                 callback_data=f"place_{i}"
             )
         ])
     
-    query.edit_message_text(
-        "Выберите одно из мест:",
-        reply_markup=InlineKeyboardMarkup(keyboard)
+    navigation = []
+    if page > 0:
+        navigation.append(InlineKeyboardButton("⬅️ Назад", callback_data=f"page_{page - 1}"))
+    if start + PLACES_PAGE_SIZE < len(places) or not user_data.get("places_complete", True):
+        navigation.append(InlineKeyboardButton("Ещё места ➡️", callback_data=f"page_{page + 1}"))
+    if navigation:
+        keyboard.append(navigation)
+    if len(places) > 1:
+        keyboard.append([InlineKeyboardButton("🚶 Маршрут по нескольким местам", callback_data="tour")])
+    
+    return InlineKeyboardMarkup(keyboard)
+
+async def _get_session(query):
+    """
+    Возвращает сессию пользователя или сообщает, что она устарела
+    
+    Returns:
+        dict: Сессия или None, если она была удалена по времени простоя или лимиту памяти
+    """
+    user_data = await sessions.get_async(query.from_user.id)
+    if user_data is None:
+        await _edit_message(query, "Данные поиска устарели. Чтобы начать заново, отправьте /start.")
+    return user_data
+
+async def _edit_message(query, text, **kwargs):
+    """Заменяет текст сообщения, к которому относится нажатая кнопка"""
+    return await outbox.send_async(
+        query.message.chat_id, query.edit_message_text, text, target=query.message.message_id, **kwargs
     )
+
+def _show_progress(query, text, delay=outbox.TELEGRAM_INTERIM_DELAY, **kwargs):
+    """
+    Показывает промежуточный текст, пока готовится ответ
+    
+    Если ответ будет готов раньше, чем текст отправлен, текст не
+    отправляется вовсе.
+    """
+    outbox.send_interim(
+        query.message.chat_id, query.edit_message_text, text, target=query.message.message_id, delay=delay, **kwargs
+    )
+
+async def _reply(update, text, **kwargs):
+    """Отправляет ответ в чат, из которого пришло сообщение или нажатие кнопки"""
+    return await outbox.send_async(update.effective_chat.id, update.effective_message.reply_text, text, **kwargs)
+
+def _log_session_stats(context: CallbackContext) -> None:
+    """Записывает в лог метрики использования памяти хранилищем сессий"""
+    stats = sessions.stats()
+    logger.info(
+        "Сессий: %d, память: %d байт, в среднем %.0f байт на сессию",
+        stats["sessions"], stats["bytes"], stats["bytes_per_session"]
+    )
+
+@metrics.track_handler
+def _warm_up_popular_places(context: CallbackContext) -> None:
+    """
+    Заранее генерирует тексты о самых популярных местах
+    
+    Детали мест из Яндекса не прогреваются: они кэшируются только в памяти
+    одного процесса на час и к утру были бы потеряны.
+    
+    Запросы выполняются с низшим приоритетом, поэтому при исчерпании квоты
+    API они отбрасываются первыми и прогрев завершается до следующей ночи.
+    """
+    # В режиме webhook задача запланирована в каждом рабочем процессе, а выполняет её один
+    if not popularity.claim_run(f"warmup-{datetime.date.today().isoformat()}"):
+        return
     
-    return PLACE_SELECTION
+    places = popularity.top(CACHE_WARMUP_TOP)
+    generated = 0
+    started = time.monotonic()
+    with upstream.priority(upstream.WARMUP):
+        for _, name, address, lat, lng in places:
+            try:
+                generated += warm_place_content(name, address or "Адрес недоступен", (lat, lng), CACHE_WARMUP_REFRESH_BEFORE)
+            except upstream.UpstreamOverloaded as e:
+                logger.warning("Прогрев кэша остановлен: %s", e)
+                break
+            except RequestException as e:
+                logger.warning("Не удалось прогреть %s: %s", name, e)
+    
+    popularity.decay(CACHE_WARMUP_DECAY)
+    logger.info(
+        "Прогрев кэша: %d мест, сгенерировано разделов: %d, за %.0f с",
+        len(places), generated, time.monotonic() - started
+    )
+
+def _purge_expired_cache(context: CallbackContext) -> None:
+    """Удаляет из постоянных кэшей записи, которые уже нельзя показывать даже как устаревшие"""
+    removed = purge_expired_responses() + map_media.cache.purge_expired()
+    logger.info("Очистка кэшей: удалено записей: %d", removed)
 
-def restart(update: Update, context: CallbackContext) -> int:
+def _get_daily_time(value):
+    """Преобразует время вида ЧЧ:ММ в datetime.time в часовом поясе прогрева"""
+    hour, minute = (int(part) for part in value.split(":"))
+    return datetime.time(hour, minute, tzinfo=pytz.timezone(CACHE_WARMUP_TZ))
+
+@metrics.track_handler
+async def live_location_handler(update: Update, context: CallbackContext) -> None:
+    """
+    Обработчик обновлений геопозиции в реальном времени
+    
+    Места выбираются и сортируются локально из загруженной заранее области;
+    к API обращаемся, только когда пользователь вышел из неё.
+    """
+    user_id = update.effective_user.id
+    user_location = update.edited_message.location
+    user_data = await sessions.get_async(user_id)
+    if user_data is None or not user_data.get("live"):
+        return
+    
+    user_data["location"] = {
+        "latitude": user_location.latitude,
+        "longitude": user_location.longitude
+    }
+    if "live_candidates" not in user_data:
+        # Поиск ещё не выполнялся - достаточно запомнить новые координаты
+        await sessions.save_async(user_id, user_data)
+        return
+    
+    area = user_data.get("live_area")
+    if area is None or haversine(
+        area["latitude"], area["longitude"], user_location.latitude, user_location.longitude
+    ) > LIVE_AREA_MARGIN * LIVE_REQUERY_FRACTION:
+        places = await _search_live_area(user_data, _get_place_types(user_data))
+        _schedule_map_warmup(context, places)
+    else:
+        places = _rank_live_places(user_data)
+    
+    page = user_data.get("places_page", 0)
+    previous = _get_page_signature(user_data.get("places", []), page)
+    user_data["places"] = places
+    if _get_page_signature(places, page) == previous:
+        await sessions.save_async(user_id, user_data)
+        return
+    
+    # Номера мест изменились: выбор для маршрута больше не актуален, а страница могла опустеть
+    user_data.pop("tour", None)
+    user_data["places_page"] = min(page, max(0, (len(places) - 1) // PLACES_PAGE_SIZE))
+    await sessions.save_async(user_id, user_data)
+    
+    list_message = user_data.get("list_message")
+    if not list_message:
+        return
+    
+    # Более новое положение пользователя заменит правку, которую ещё не успели отправить
+    chat_id, message_id = list_message
+    outbox.send_interim(
+        chat_id,
+        context.bot.edit_message_text,
+        "Места рядом с вами:" if places else LIVE_EMPTY_TEXT,
+        target=message_id,
+        delay=0,
+        chat_id=chat_id,
+        message_id=message_id,
+        reply_markup=_get_places_keyboard(user_data)
+    )
+
+async def _search_live_area(user_data, place_types):
+    """
+    Загружает места области вокруг пользователя с запасом на перемещение
+    
+    Returns:
+        list: Места внутри радиуса поиска, от ближайшего к дальнему
+    """
+    location = user_data["location"]
+    records = await get_nearby_places_async(
+        location["latitude"],
+        location["longitude"],
+        user_data["radius"] + LIVE_AREA_MARGIN,
+        place_types,
+        limit=LIVE_CANDIDATES
+    )
+    user_data["live_candidates"] = [Place.from_record(record) for record in records]
+    # Пустую область (в том числе из-за ошибки API) запрашиваем снова при следующем обновлении
+    if records:
+        user_data["live_area"] = {"latitude": location["latitude"], "longitude": location["longitude"]}
+    else:
+        user_data.pop("live_area", None)
+    return _rank_live_places(user_data)
+
+def _rank_live_places(user_data):
+    """
+    Выбирает из загруженной области места внутри радиуса поиска
+    
+    Returns:
+        list: Места с расстоянием от текущей геопозиции, от ближайшего к дальнему
+    """
+    candidates = user_data["live_candidates"]
+    if not candidates:
+        return []
+    
+    location = user_data["location"]
+    distances = distances_from(
+        location["latitude"],
+        location["longitude"],
+        [place.lat for place in candidates],
+        [place.lng for place in candidates]
+    )
+    return [
+        Place(candidates[i].place_id, candidates[i].name, candidates[i].lat, candidates[i].lng,
+              candidates[i].address, float(distances[i]))
+        for i in distances.argsort(kind="stable") if distances[i] <= user_data["radius"]
+    ]
+
+def _get_page_signature(places, page):
+    """Места страницы и их расстояния с точностью LIVE_DISTANCE_STEP - для проверки, нужно ли обновлять список"""
+    start = page * PLACES_PAGE_SIZE
+    return [(place.place_id, int(place.distance // LIVE_DISTANCE_STEP)) for place in places[start:start + PLACES_PAGE_SIZE]]
+
+def _remember_list_message(user_data, query):
+    """Запоминает сообщение со списком мест, чтобы обновлять его при перемещении пользователя"""
+    if user_data.get("live"):
+        user_data["list_message"] = (query.message.chat_id, query.message.message_id)
+
+@metrics.track_handler
+async def restart(update: Update, context: CallbackContext) -> int:
     """Перезапуск бота"""
     query = update.callback_query
-    query.answer()
+    await async_runtime.to_thread(query.answer)
     
-    return start(update, context)
+    return await start(update, context)
 
-def cancel(update: Update, context: CallbackContext) -> int:
+@metrics.track_handler
+async def cancel(update: Update, context: CallbackContext) -> int:
     """Обработчик команды /cancel"""
-    update.message.reply_text(
+    await _reply(
+        update,
         "Поиск отменен. Чтобы начать заново, отправьте /start.",
         reply_markup=ReplyKeyboardMarkup([["/start"]], resize_keyboard=True)
     )
     
     return ConversationHandler.END
 
-def help_command(update: Update, context: CallbackContext) -> None:
+@metrics.track_handler
+async def help_command(update: Update, context: CallbackContext) -> None:
     """Обработчик команды /help"""
-    update.message.reply_text(
+    await _reply(
+        update,
         "Я бот-экскурсовод, который поможет вам найти интересные достопримечательности рядом с вами.\n\n"
         "Доступные команды:\n"
         "/start - Начать поиск достопримечательностей\n"
@@ -417,44 +1113,77 @@ def help_command(update: Update, context: CallbackContext) -> None:
         "/help - Показать эту справку"
     )
 
-def main() -> None:
-    """Запуск бота"""
-    # Получаем токен из переменных окружения
-    token = os.getenv("TELEGRAM_TOKEN")
-    if not token:
-        logger.error("Не указан токен бота. Проверьте файл .env")
-        return
-    
-    # Создаем Updater и передаем ему токен бота
-    updater = Updater(token)
-    
-    # Получаем диспетчер для регистрации обработчиков
-    dispatcher = updater.dispatcher
-    
+def setup_dispatcher(dispatcher) -> None:
+    """Регистрирует обработчики и периодические задачи в диспетчере"""
     # Создаем обработчик разговора
+    # Состояние беседы меняется сразу, а обработчики выполняются в цикле событий
+    # по очереди, поэтому следующее состояние указывается при регистрации.
+    # /start доступна в любом состоянии: например, после того как устарела сессия
     conv_handler = ConversationHandler(
-        entry_points=[CommandHandler("start", start)],
+        entry_points=[CommandHandler("start", async_runtime.handler(start, LOCATION))],
         states={
-            LOCATION: [MessageHandler(Filters.location, location_handler)],
-            RADIUS: [CallbackQueryHandler(radius_handler, pattern=r"^radius_")],
-            INTERESTS: [CallbackQueryHandler(interest_handler, pattern=r"^interest_")],
+            LOCATION: [MessageHandler(Filters.location & Filters.update.message, async_runtime.handler(location_handler, RADIUS))],
+            RADIUS: [CallbackQueryHandler(async_runtime.handler(radius_handler, INTERESTS), pattern=r"^radius_")],
+            INTERESTS: [
+                CallbackQueryHandler(async_runtime.handler(interest_handler, PLACE_SELECTION), pattern=r"^interest_done$"),
+                CallbackQueryHandler(async_runtime.handler(interest_handler, INTERESTS), pattern=r"^interest_"),
+            ],
             PLACE_SELECTION: [
-                CallbackQueryHandler(place_selection_handler, pattern=r"^place_"),
-                CallbackQueryHandler(route_handler, pattern=r"^route_"),
-                CallbackQueryHandler(excursion_handler, pattern=r"^excursion_"),
-                CallbackQueryHandler(reviews_handler, pattern=r"^reviews_"),
-                CallbackQueryHandler(back_to_places, pattern=r"^back_to_places$"),
-                CallbackQueryHandler(restart, pattern=r"^restart$"),
+                CallbackQueryHandler(async_runtime.handler(place_selection_handler, PLACE_SELECTION), pattern=r"^place_"),
+                CallbackQueryHandler(async_runtime.handler(place_selection_handler, PLACE_SELECTION), pattern=r"^card$"),
+                CallbackQueryHandler(async_runtime.handler(route_handler, PLACE_SELECTION), pattern=r"^route"),
+                CallbackQueryHandler(async_runtime.handler(excursion_handler, PLACE_SELECTION), pattern=r"^excursion"),
+                CallbackQueryHandler(async_runtime.handler(reviews_handler, PLACE_SELECTION), pattern=r"^reviews"),
+                CallbackQueryHandler(async_runtime.handler(places_page_handler, PLACE_SELECTION), pattern=r"^page_"),
+                CallbackQueryHandler(async_runtime.handler(tour_handler, PLACE_SELECTION), pattern=r"^tour"),
+                CallbackQueryHandler(async_runtime.handler(back_to_places, PLACE_SELECTION), pattern=r"^back_to_places$"),
+                CallbackQueryHandler(async_runtime.handler(restart, LOCATION), pattern=r"^restart$"),
             ],
         },
-        fallbacks=[CommandHandler("cancel", cancel)],
+        fallbacks=[CommandHandler("cancel", async_runtime.handler(cancel, ConversationHandler.END))],
+        allow_reentry=True,
     )
     
     # Регистрируем обработчик разговора
     dispatcher.add_handler(conv_handler)
     
+    # Обновления трансляции геопозиции приходят как правки сообщения с геопозицией
+    dispatcher.add_handler(MessageHandler(Filters.update.edited_message & Filters.location, async_runtime.handler(live_location_handler)))
+    
     # Регистрируем обработчик команды help
-    dispatcher.add_handler(CommandHandler("help", help_command))
+    dispatcher.add_handler(CommandHandler("help", async_runtime.handler(help_command)))
+    
+    # Периодически записываем метрики хранилища сессий
+    dispatcher.job_queue.run_repeating(_log_session_stats, interval=SESSION_STATS_INTERVAL)
+    
+    # Ежедневно прогреваем кэш популярными местами
+    if CACHE_WARMUP_ENABLED:
+        dispatcher.job_queue.run_daily(_warm_up_popular_places, time=_get_daily_time(CACHE_WARMUP_TIME))
+    
+    # Ежедневно удаляем истёкшие записи, чтобы файлы кэшей не росли без ограничений
+    dispatcher.job_queue.run_daily(_purge_expired_cache, time=_get_daily_time(CACHE_PURGE_TIME))
+
+def main() -> None:
+    """Запуск бота"""
+    # Получаем токен из переменных окружения
+    token = os.getenv("TELEGRAM_TOKEN")
+    if not token:
+        logger.error("Не указан токен бота. Проверьте файл .env")
+        return
+    
+    if BOT_MODE == "webhook":
+        # Обновления принимаются по HTTP и распределяются по рабочим процессам
+        webhook.run(token, setup_dispatcher)
+        return
+    
+    # Метрики в формате Prometheus (если задан METRICS_PORT)
+    metrics.start_server()
+    
+    # Создаем Updater и передаем ему токен бота
+    updater = Updater(token)
+    
+    # Регистрируем обработчики в диспетчере
+    setup_dispatcher(updater.dispatcher)
     
     # Запускаем бота
     updater.start_polling()
@@ -462,6 +1191,9 @@ def main() -> None:
     
     # Работаем до нажатия Ctrl-C
     updater.idle()
+    
+    # Дожидаемся ответов на уже полученные обновления
+    async_runtime.drain()
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
\ No newline at end of file
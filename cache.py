@@ -0,0 +1,339 @@
+import os
+import json
+import time
+import asyncio
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+from dotenv import load_dotenv
+import async_runtime
+
+# Загружаем переменные окружения
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Сколько секунд ждать, пока другой процесс освободит базу SQLite
+SQLITE_BUSY_TIMEOUT = float(os.getenv("SQLITE_BUSY_TIMEOUT", "5"))
+
+def connect_sqlite(path):
+    """
+    Открывает базу SQLite, общую для нескольких процессов бота
+
+    В режиме WAL чтение не ждёт записи другого процесса, а запись при
+    занятой базе ждёт до SQLITE_BUSY_TIMEOUT секунд, а не завершается
+    ошибкой "database is locked" сразу.
+
+    Args:
+        path (str): Путь к файлу базы данных
+
+    Returns:
+        sqlite3.Connection: Соединение, которое можно использовать из разных потоков
+    """
+    connection = sqlite3.connect(path, timeout=SQLITE_BUSY_TIMEOUT, check_same_thread=False)
+    connection.execute("PRAGMA journal_mode=WAL")
+    return connection
+
+class TTLCache:
+    """
+    Потокобезопасный кэш в памяти с вытеснением по LRU и сроком жизни записей
+
+    Устаревшие записи хранятся ещё stale_ttl секунд и доступны через get_stale,
+    чтобы их можно было показать, пока запись обновляется в фоне.
+    """
+
+    def __init__(self, maxsize=1024, ttl=600, stale_ttl=0):
+        """
+        Args:
+            maxsize (int): Максимальное количество записей
+            ttl (float): Время жизни записи в секундах
+            stale_ttl (float): Сколько секунд после истечения срока хранить устаревшую запись
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """
+        Возвращает значение из кэша
+
+        Args:
+            key: Ключ записи
+            default: Значение, возвращаемое при промахе
+
+        Returns:
+            Сохранённое значение или default, если записи нет или она устарела
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] <= now:
+                if entry is not None and entry[0] + self.stale_ttl <= now:
+                    del self._data[key]
+                self.misses += 1
+                return default
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def get_stale(self, key, default=None):
+        """
+        Возвращает значение из кэша, в том числе устаревшее не более чем на stale_ttl
+
+        Args:
+            key: Ключ записи
+            default: Значение, возвращаемое при промахе
+
+        Returns:
+            tuple: (сохранённое значение или default, True если запись устарела)
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] + self.stale_ttl <= now:
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return default, False
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            stale = entry[0] <= now
+            if stale:
+                self.stale_hits += 1
+            return entry[1], stale
+
+    def set(self, key, value, ttl=None):
+        """
+        Сохраняет значение в кэш
+
+        Args:
+            key: Ключ записи
+            value: Сохраняемое значение
+            ttl (float): Время жизни записи (по умолчанию - из настроек кэша)
+        """
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def ttl_left(self, key):
+        """
+        Возвращает оставшееся время жизни записи, не влияя на статистику попаданий
+
+        Returns:
+            float: Время в секундах или None, если записи нет или она устарела
+        """
+        with self._lock:
+            entry = self._data.get(key)
+        if entry is None or entry[0] <= time.monotonic():
+            return None
+        return entry[0] - time.monotonic()
+
+    def delete(self, key):
+        """Удаляет запись из кэша"""
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        """Очищает кэш"""
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+class SQLiteCache:
+    """
+    Постоянный кэш на диске в базе SQLite со сроком жизни записей
+
+    Устаревшие записи, как и в TTLCache, доступны через get_stale ещё stale_ttl секунд.
+    """
+
+    def __init__(self, path, ttl=86400, stale_ttl=0):
+        """
+        Args:
+            path (str): Путь к файлу базы данных
+            ttl (float): Время жизни записи в секундах
+            stale_ttl (float): Сколько секунд после истечения срока хранить устаревшую запись
+        """
+        self.path = path
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+        self._lock = threading.Lock()
+        self._connection = connect_sqlite(path)
+        with self._lock, self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+
+    def get(self, key, default=None):
+        """
+        Возвращает значение из кэша
+
+        Args:
+            key (str): Ключ записи
+            default: Значение, возвращаемое при промахе
+
+        Returns:
+            Сохранённое значение или default, если записи нет или она устарела
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT value, expires_at FROM cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or row[1] <= time.time():
+                self.misses += 1
+                return default
+
+            self.hits += 1
+            return json.loads(row[0])
+
+    def get_stale(self, key, default=None):
+        """
+        Возвращает значение из кэша, в том числе устаревшее не более чем на stale_ttl
+
+        Args:
+            key (str): Ключ записи
+            default: Значение, возвращаемое при промахе
+
+        Returns:
+            tuple: (сохранённое значение или default, True если запись устарела)
+        """
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT value, expires_at FROM cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or row[1] + self.stale_ttl <= now:
+                self.misses += 1
+                return default, False
+
+            self.hits += 1
+            stale = row[1] <= now
+            if stale:
+                self.stale_hits += 1
+            return json.loads(row[0]), stale
+
+    def set(self, key, value, ttl=None):
+        """
+        Сохраняет значение в кэш
+
+        Ошибка записи (например, база занята другим процессом дольше
+        SQLITE_BUSY_TIMEOUT) только записывается в лог: значение будет
+        получено заново при следующем промахе.
+
+        Args:
+            key (str): Ключ записи
+            value: Сохраняемое значение (должно сериализоваться в JSON)
+            ttl (float): Время жизни записи (по умолчанию - из настроек кэша)
+        """
+        expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        try:
+            with self._lock, self._connection:
+                self._connection.execute(
+                    "INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, json.dumps(value, ensure_ascii=False), expires_at)
+                )
+        except sqlite3.Error as e:
+            logger.warning("Не удалось сохранить запись кэша %s: %s", self.path, e)
+
+    def ttl_left(self, key):
+        """
+        Возвращает оставшееся время жизни записи, не влияя на статистику попаданий
+
+        Returns:
+            float: Время в секундах или None, если записи нет или она устарела
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT expires_at FROM cache WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None or row[0] <= time.time():
+            return None
+        return row[0] - time.time()
+
+    def delete(self, key):
+        """Удаляет запись из кэша (ошибка записи только записывается в лог)"""
+        try:
+            with self._lock, self._connection:
+                self._connection.execute("DELETE FROM cache WHERE key = ?", (key,))
+        except sqlite3.Error as e:
+            logger.warning("Не удалось удалить запись кэша %s: %s", self.path, e)
+
+    def purge_expired(self):
+        """
+        Удаляет из базы все устаревшие записи, которые уже нельзя показывать
+
+        Returns:
+            int: Количество удалённых записей (0, если база занята)
+        """
+        try:
+            with self._lock, self._connection:
+                cursor = self._connection.execute("DELETE FROM cache WHERE expires_at <= ?", (time.time() - self.stale_ttl,))
+                return cursor.rowcount
+        except sqlite3.Error as e:
+            logger.warning("Не удалось очистить кэш %s: %s", self.path, e)
+            return 0
+
+class Revalidator:
+    """
+    Обновляет устаревшие записи кэша в фоне
+
+    Обновления выполняются как корутины в общем цикле событий, не больше
+    workers одновременно. Для каждого ключа одновременно выполняется не
+    больше одного обновления, поэтому поток обращений к устаревшей записи
+    порождает один запрос к API.
+    """
+
+    def __init__(self, workers=2):
+        """
+        Args:
+            workers (int): Количество одновременных обновлений
+        """
+        self.workers = workers
+        self._pending = set()
+        self._semaphore = None
+
+    def submit(self, key, func, *args, **kwargs):
+        """
+        Запускает обновление записи, если оно ещё не выполняется (только из цикла событий)
+
+        Args:
+            key: Ключ обновляемой записи
+            func (callable): Корутина, которая запрашивает данные и сохраняет их в кэш
+
+        Returns:
+            bool: True, если обновление запущено
+        """
+        if key in self._pending:
+            return False
+        self._pending.add(key)
+
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.workers)
+        async_runtime.spawn(self._run(key, func, args, kwargs))
+        return True
+
+    async def _run(self, key, func, args, kwargs):
+        try:
+            async with self._semaphore:
+                await func(*args, **kwargs)
+        except Exception:
+            logger.exception("Не удалось обновить запись кэша %s", key)
+        finally:
+            self._pending.discard(key)
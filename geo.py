@@ -0,0 +1,167 @@
+import math
+import numpy as np
+
+# Средний радиус Земли в метрах
+EARTH_RADIUS = 6371008.8
+
+# Длина одного градуса широты в метрах
+METERS_PER_DEGREE = 111320.0
+
+# Алфавит base32, используемый в geohash
+_GEOHASH_ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+_GEOHASH_INDEX = {char: i for i, char in enumerate(_GEOHASH_ALPHABET)}
+
+def haversine(lat1, lng1, lat2, lng2):
+    """
+    Вычисляет расстояние между двумя точками по формуле гаверсинусов
+
+    Args:
+        lat1 (float): Широта первой точки
+        lng1 (float): Долгота первой точки
+        lat2 (float): Широта второй точки
+        lng2 (float): Долгота второй точки
+
+    Returns:
+        float: Расстояние в метрах
+    """
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    dphi = phi2 - phi1
+    dlmb = math.radians(lng2 - lng1)
+
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlmb / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(a)))
+
+def distances_from(latitude, longitude, latitudes, longitudes):
+    """
+    Вычисляет расстояния от одной точки до набора точек за одну векторную операцию
+
+    Args:
+        latitude (float): Широта исходной точки
+        longitude (float): Долгота исходной точки
+        latitudes (array-like): Широты точек
+        longitudes (array-like): Долготы точек
+
+    Returns:
+        numpy.ndarray: Расстояния в метрах
+    """
+    phi1 = np.radians(latitude)
+    phi2 = np.radians(np.asarray(latitudes, dtype=np.float64))
+    dphi = phi2 - phi1
+    dlmb = np.radians(np.asarray(longitudes, dtype=np.float64) - longitude)
+
+    a = np.sin(dphi / 2) ** 2 + np.cos(phi1) * np.cos(phi2) * np.sin(dlmb / 2) ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+def distance_matrix(latitudes, longitudes):
+    """
+    Вычисляет матрицу попарных расстояний между точками
+
+    Args:
+        latitudes (array-like): Широты точек
+        longitudes (array-like): Долготы точек
+
+    Returns:
+        numpy.ndarray: Матрица расстояний в метрах размером N x N
+    """
+    phi = np.radians(np.asarray(latitudes, dtype=np.float64))
+    lmb = np.radians(np.asarray(longitudes, dtype=np.float64))
+    dphi = phi[:, None] - phi[None, :]
+    dlmb = lmb[:, None] - lmb[None, :]
+
+    a = np.sin(dphi / 2) ** 2 + np.cos(phi)[:, None] * np.cos(phi)[None, :] * np.sin(dlmb / 2) ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+def meters_to_degrees(meters, latitude):
+    """
+    Переводит расстояние в метрах в градусы широты и долготы
+
+    Args:
+        meters (float): Расстояние в метрах
+        latitude (float): Широта, на которой выполняется перевод
+
+    Returns:
+        tuple: (градусы широты, градусы долготы)
+    """
+    lat_degrees = meters / METERS_PER_DEGREE
+    lng_degrees = meters / (METERS_PER_DEGREE * max(math.cos(math.radians(latitude)), 0.01))
+    return lat_degrees, lng_degrees
+
+def geohash_encode(latitude, longitude, precision=7):
+    """
+    Кодирует координаты в строку geohash
+
+    Args:
+        latitude (float): Широта
+        longitude (float): Долгота
+        precision (int): Длина geohash
+
+    Returns:
+        str: Geohash ячейки, в которую попадает точка
+    """
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    result = []
+    bits = 0
+    bit_count = 0
+    even = True
+
+    while len(result) < precision:
+        # Чётные биты кодируют долготу, нечётные - широту
+        value, rng = (longitude, lng_range) if even else (latitude, lat_range)
+        mid = (rng[0] + rng[1]) / 2
+        if value >= mid:
+            bits = (bits << 1) | 1
+            rng[0] = mid
+        else:
+            bits <<= 1
+            rng[1] = mid
+        even = not even
+        bit_count += 1
+
+        if bit_count == 5:
+            result.append(_GEOHASH_ALPHABET[bits])
+            bits = 0
+            bit_count = 0
+
+    return "".join(result)
+
+def geohash_bounds(geohash):
+    """
+    Возвращает границы ячейки geohash
+
+    Args:
+        geohash (str): Geohash ячейки
+
+    Returns:
+        tuple: (мин. широта, мин. долгота, макс. широта, макс. долгота)
+    """
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    even = True
+
+    for char in geohash:
+        bits = _GEOHASH_INDEX[char]
+        for shift in range(4, -1, -1):
+            rng = lng_range if even else lat_range
+            mid = (rng[0] + rng[1]) / 2
+            if (bits >> shift) & 1:
+                rng[0] = mid
+            else:
+                rng[1] = mid
+            even = not even
+
+    return lat_range[0], lng_range[0], lat_range[1], lng_range[1]
+
+def geohash_center(geohash):
+    """
+    Возвращает центр ячейки geohash
+
+    Args:
+        geohash (str): Geohash ячейки
+
+    Returns:
+        tuple: (широта, долгота)
+    """
+    min_lat, min_lng, max_lat, max_lng = geohash_bounds(geohash)
+    return (min_lat + max_lat) / 2, (min_lng + max_lng) / 2
@@ -0,0 +1,404 @@
+import os
+import json
+import time
+import atexit
+import random
+import asyncio
+import logging
+import aiohttp
+import requests
+from dotenv import load_dotenv
+import async_runtime
+import metrics
+import upstream
+
+# Загружаем переменные окружения
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Размер пула keep-alive соединений: всего и к одному хосту
+HTTP_POOL_LIMIT = int(os.getenv("HTTP_POOL_LIMIT", "100"))
+HTTP_POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", "32"))
+
+# Политика повторов
+HTTP_MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", "3"))
+HTTP_BACKOFF_BASE = float(os.getenv("HTTP_BACKOFF_BASE", "0.3"))
+HTTP_BACKOFF_MAX = float(os.getenv("HTTP_BACKOFF_MAX", "8"))
+
+# Коды ответа, при которых запрос повторяется
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+def _timeout_from_env(name, default):
+    """
+    Читает таймаут "подключение,чтение" из переменной окружения
+
+    Args:
+        name (str): Имя переменной окружения
+        default (tuple): Таймаут по умолчанию (подключение, чтение)
+
+    Returns:
+        tuple: Таймаут (подключение, чтение) в секундах
+    """
+    value = os.getenv(name)
+    if not value:
+        return default
+
+    parts = [float(part) for part in value.split(",")]
+    return (parts[0], parts[-1])
+
+# Таймауты (подключение, чтение) для каждого типа запросов
+TIMEOUTS = {
+    "default": _timeout_from_env("HTTP_TIMEOUT_DEFAULT", (3.05, 10)),
+    "yandex_search": _timeout_from_env("HTTP_TIMEOUT_YANDEX_SEARCH", (3.05, 5)),
+    "yandex_static": _timeout_from_env("HTTP_TIMEOUT_YANDEX_STATIC", (3.05, 5)),
+    "perplexity": _timeout_from_env("HTTP_TIMEOUT_PERPLEXITY", (3.05, 30)),
+}
+
+# Через сколько секунд без ответа отправлять второй такой же GET-запрос (0 - не отправлять)
+HEDGE_AFTER = {
+    "default": float(os.getenv("HTTP_HEDGE_AFTER_DEFAULT", "0")),
+    "yandex_search": float(os.getenv("HTTP_HEDGE_AFTER_YANDEX_SEARCH", "1")),
+    "yandex_static": float(os.getenv("HTTP_HEDGE_AFTER_YANDEX_STATIC", "1")),
+    "perplexity": float(os.getenv("HTTP_HEDGE_AFTER_PERPLEXITY", "0")),
+}
+
+_session = None
+
+# Одновременные одинаковые GET-запросы выполняются один раз
+_coalescer = upstream.Coalescer()
+
+class Response:
+    """
+    Ответ сервера с интерфейсом, как у requests.Response
+
+    Тело обычного ответа уже прочитано и соединение возвращено в пул.
+    Потоковый ответ читается через iter_lines и закрывается через close
+    или async with.
+    """
+
+    def __init__(self, response, content=None):
+        """
+        Args:
+            response (aiohttp.ClientResponse): Ответ aiohttp
+            content (bytes): Прочитанное тело ответа (None для потокового ответа)
+        """
+        self.status_code = response.status
+        self.headers = response.headers
+        self.url = str(response.url)
+        self.content = content
+        self._response = response
+
+    @property
+    def text(self):
+        """Тело ответа в виде строки"""
+        return self.content.decode(self._response.get_encoding())
+
+    def json(self):
+        """Разбирает тело ответа как JSON"""
+        return json.loads(self.content)
+
+    def raise_for_status(self):
+        """
+        Raises:
+            requests.exceptions.HTTPError: Если код ответа 4xx или 5xx
+        """
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(f"{self.status_code} Error for url: {self.url}", response=self)
+
+    async def iter_lines(self):
+        """
+        Читает потоковый ответ построчно
+
+        Yields:
+            str: Очередная строка без перевода строки
+
+        Raises:
+            requests.exceptions.RequestException: При обрыве соединения или таймауте чтения
+        """
+        try:
+            async for line in self._response.content:
+                yield line.decode("utf-8").rstrip("\r\n")
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise _translate_error(e, self.url) from e
+
+    def close(self):
+        """Возвращает соединение в пул"""
+        self._response.release()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+def get_session():
+    """
+    Возвращает общую сессию с пулом keep-alive соединений
+
+    Сессия создаётся при первом запросе и работает в общем цикле событий
+    (async_runtime), где выполняются все запросы процесса.
+
+    Returns:
+        aiohttp.ClientSession: Сессия
+    """
+    global _session
+    if _session is None:
+        connector = aiohttp.TCPConnector(limit=HTTP_POOL_LIMIT, limit_per_host=HTTP_POOL_MAXSIZE)
+        _session = aiohttp.ClientSession(connector=connector)
+    return _session
+
+@atexit.register
+def close():
+    """Закрывает общую сессию и её соединения (при завершении процесса)"""
+    global _session
+    if _session is not None and not _session.closed:
+        async_runtime.run(_session.close(), timeout=5)
+    _session = None
+
+async def request_async(method, url, endpoint="default", retries=None, operation=None, **kwargs):
+    """
+    Выполняет HTTP-запрос через общий пул соединений с таймаутами и повторами
+
+    Запросы повторяются при ответах 429/5xx и ошибках соединения с
+    экспоненциальной задержкой со случайным разбросом (full jitter).
+    Каждая попытка ждёт разрешения планировщика квот upstream с приоритетом
+    текущей задачи, а одновременные одинаковые GET-запросы объединяются.
+    Если API перестал отвечать, запросы сразу завершаются ошибкой (см.
+    upstream.CircuitBreaker), а GET-запрос, ответ на который задерживается
+    дольше HEDGE_AFTER, дублируется, и используется первый ответ.
+    Ошибки aiohttp преобразуются в исключения requests, поэтому вызывающий
+    код обрабатывает их так же, как раньше.
+
+    Args:
+        method (str): HTTP-метод
+        url (str): URL запроса
+        endpoint (str): Тип запроса, определяющий таймауты
+        retries (int): Количество повторов (по умолчанию HTTP_MAX_RETRIES)
+        operation (str): Название операции для метрик (по умолчанию - тип запроса)
+        **kwargs: Параметры запроса: params, headers, json, data, timeout
+            (подключение, чтение) и stream
+
+    Returns:
+        Response: Ответ сервера
+
+    Raises:
+        requests.exceptions.RequestException: Если все попытки завершились ошибкой соединения
+        upstream.UpstreamOverloaded: Если квота API не позволяет выполнить запрос вовремя
+        upstream.UpstreamUnavailable: Если цепь к API разомкнута
+    """
+    if method.upper() == "GET" and not kwargs.get("stream"):
+        key = requests.Request(method, url, params=kwargs.get("params")).prepare().url
+        return await _coalescer.do(key, _measure, method, url, endpoint, retries, operation, kwargs)
+
+    return await _measure(method, url, endpoint, retries, operation, kwargs)
+
+def request(method, url, endpoint="default", retries=None, operation=None, **kwargs):
+    """
+    Синхронная обёртка над request_async для вызова из потоков
+
+    Потоковые ответы читаются только в цикле событий, поэтому stream не поддерживается.
+
+    Returns:
+        Response: Ответ сервера с прочитанным телом
+    """
+    return async_runtime.run(request_async(method, url, endpoint, retries, operation, **kwargs))
+
+async def _measure(method, url, endpoint, retries, operation, kwargs):
+    """Выполняет запрос и записывает его длительность и результат в метрики"""
+    operation = operation or endpoint
+    started = time.perf_counter()
+    status = "error"
+    hedge_after = HEDGE_AFTER.get(endpoint, HEDGE_AFTER["default"])
+    try:
+        if hedge_after and method.upper() == "GET" and not kwargs.get("stream"):
+            response = await _perform_hedged(method, url, endpoint, retries, kwargs, hedge_after)
+        else:
+            response = await _perform(method, url, endpoint, retries, kwargs)
+        status = str(response.status_code)
+        return response
+    except upstream.UpstreamOverloaded:
+        status = "shed"
+        raise
+    except upstream.UpstreamUnavailable:
+        status = "unavailable"
+        raise
+    finally:
+        metrics.UPSTREAM_DURATION.observe(time.perf_counter() - started, endpoint, operation)
+        metrics.UPSTREAM_REQUESTS.inc(endpoint, operation, status)
+
+async def _perform(method, url, endpoint, retries, kwargs):
+    """Выполняет запрос с повторами (см. request_async)"""
+    retries = HTTP_MAX_RETRIES if retries is None else retries
+    kwargs.setdefault("timeout", TIMEOUTS.get(endpoint, TIMEOUTS["default"]))
+    breaker = upstream.get_breaker(endpoint)
+    # Таймаут чтения повторяем только для идемпотентных запросов
+    retry_exceptions = (requests.exceptions.ConnectionError,)
+    if method.upper() == "GET":
+        retry_exceptions += (requests.exceptions.Timeout,)
+
+    # Для размыкателя цепи запрос со всеми повторами - одна попытка: неудачей
+    # считается только исход последнего повтора. Повторы пробного запроса
+    # разрешение заново не запрашивают.
+    probe = False
+    for attempt in range(retries + 1):
+        if not probe:
+            probe = breaker.allow()
+        await upstream.acquire(endpoint)
+        try:
+            response = await _send(method, url, kwargs)
+        except requests.exceptions.RequestException as e:
+            if not isinstance(e, retry_exceptions) or attempt == retries:
+                breaker.record_failure(probe)
+                raise
+            delay = _get_backoff(attempt)
+            logger.warning("Ошибка соединения с %s (%s), повтор через %.2f с", endpoint, e, delay)
+        else:
+            final = response.status_code not in RETRY_STATUSES or attempt == retries
+            if response.status_code < 500:
+                breaker.record_success(probe)
+            elif final:
+                breaker.record_failure(probe)
+            if final:
+                return response
+            delay = _get_retry_after(response) or _get_backoff(attempt)
+            if response.status_code == 429:
+                # Квота исчерпана - остальные запросы к этому API тоже ждут
+                upstream.penalize(endpoint, delay)
+            logger.warning("Ответ %s от %s, повтор через %.2f с", response.status_code, endpoint, delay)
+            response.close()
+
+        await asyncio.sleep(delay)
+
+async def _send(method, url, kwargs):
+    """
+    Отправляет один запрос через общую сессию
+
+    Returns:
+        Response: Ответ сервера (для stream - с непрочитанным телом)
+
+    Raises:
+        requests.exceptions.RequestException: При ошибке соединения или таймауте
+    """
+    kwargs = dict(kwargs)
+    stream = kwargs.pop("stream", False)
+    connect_timeout, read_timeout = kwargs.pop("timeout")
+    if kwargs.get("params"):
+        # Как и requests, не передаём параметры без значения
+        kwargs["params"] = {key: value for key, value in kwargs["params"].items() if value is not None}
+
+    timeout = aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+    try:
+        response = await get_session().request(method, url, timeout=timeout, **kwargs)
+        if stream:
+            return Response(response)
+        try:
+            return Response(response, await response.read())
+        finally:
+            response.release()
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        raise _translate_error(e, url) from e
+
+def _translate_error(error, url):
+    """
+    Преобразует ошибку aiohttp в исключение requests того же смысла
+
+    Args:
+        error (Exception): Ошибка aiohttp или таймаут
+        url (str): URL запроса
+
+    Returns:
+        requests.exceptions.RequestException: Исключение для вызывающего кода
+    """
+    message = f"{type(error).__name__}: {error} ({url})"
+    if isinstance(error, aiohttp.ConnectionTimeoutError):
+        return requests.exceptions.ConnectTimeout(message)
+    if isinstance(error, asyncio.TimeoutError):
+        return requests.exceptions.ReadTimeout(message)
+    if isinstance(error, aiohttp.ClientConnectionError):
+        return requests.exceptions.ConnectionError(message)
+    if isinstance(error, aiohttp.ClientPayloadError):
+        return requests.exceptions.ChunkedEncodingError(message)
+    return requests.exceptions.RequestException(message)
+
+async def _perform_hedged(method, url, endpoint, retries, kwargs, hedge_after):
+    """
+    Выполняет запрос и дублирует его, если ответа нет дольше hedge_after секунд
+
+    Возвращается первый полученный ответ; второй запрос отменяется.
+    Дубль не отправляется, если цепь к API не замкнута.
+    """
+    tasks = [asyncio.ensure_future(_perform(method, url, endpoint, retries, dict(kwargs)))]
+    done, _ = await asyncio.wait(tasks, timeout=hedge_after)
+    if not done and upstream.get_breaker(endpoint).state == upstream.CircuitBreaker.CLOSED:
+        metrics.UPSTREAM_HEDGES.inc(endpoint)
+        tasks.append(asyncio.ensure_future(_perform(method, url, endpoint, retries, dict(kwargs))))
+
+    error = None
+    response = None
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            try:
+                response = await next_done
+                return response
+            except requests.exceptions.RequestException as e:
+                # Ждём второй запрос, если он ещё выполняется
+                error = error or e
+        raise error
+    finally:
+        for task in tasks:
+            _discard(task, response)
+
+def _discard(task, response):
+    """Отменяет ненужный запрос или закрывает полученный на него ответ, если это не response"""
+    if not task.done():
+        task.cancel()
+    elif not task.cancelled() and task.exception() is None and task.result() is not response:
+        task.result().close()
+
+async def get_async(url, endpoint="default", **kwargs):
+    """Выполняет GET-запрос через общий HTTP-клиент"""
+    return await request_async("GET", url, endpoint=endpoint, **kwargs)
+
+async def post_async(url, endpoint="default", **kwargs):
+    """Выполняет POST-запрос через общий HTTP-клиент"""
+    return await request_async("POST", url, endpoint=endpoint, **kwargs)
+
+def get(url, endpoint="default", **kwargs):
+    """Синхронная версия get_async"""
+    return request("GET", url, endpoint=endpoint, **kwargs)
+
+def post(url, endpoint="default", **kwargs):
+    """Синхронная версия post_async"""
+    return request("POST", url, endpoint=endpoint, **kwargs)
+
+def _get_backoff(attempt):
+    """
+    Вычисляет задержку перед повтором
+
+    Args:
+        attempt (int): Номер попытки, начиная с 0
+
+    Returns:
+        float: Задержка в секундах
+    """
+    return random.uniform(0, min(HTTP_BACKOFF_MAX, HTTP_BACKOFF_BASE * (2 ** attempt)))
+
+def _get_retry_after(response):
+    """
+    Читает задержку из заголовка Retry-After
+
+    Args:
+        response (Response): Ответ сервера
+
+    Returns:
+        float: Задержка в секундах или None, если заголовка нет
+    """
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+
+    try:
+        return min(float(value), HTTP_BACKOFF_MAX)
+    except ValueError:
+        return None
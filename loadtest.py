@@ -0,0 +1,520 @@
+"""
+Нагрузочное тестирование бота
+
+Запускает локальные заменители API Яндекс Карт, Perplexity и Telegram Bot
+API с заданными задержками и долей ошибок, проводит N пользователей через
+весь сценарий беседы (геолокация -> радиус -> интересы -> место -> экскурсия)
+и выводит пропускную способность и перцентили задержки каждого шага.
+
+Пример:
+    python loadtest.py --users 200 --concurrency 50 --perplexity-latency lognormal:2,0.5 --output before.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import tempfile
+import threading
+from urllib.parse import urlsplit, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+# Шаги сценария в порядке выполнения
+STEPS = ["start", "location", "radius", "interests", "search", "place", "excursion"]
+
+# Минимальное изображение PNG 1x1 для заменителя статических карт
+PNG_PIXEL = bytes.fromhex(
+    "89504e470d0a1a0a0000000d49484452000000010000000108060000001f15c489"
+    "0000000d49444154789c6360000002000001e221bc330000000049454e44ae426082"
+)
+
+class Latency:
+    """
+    Распределение задержки ответа заменителя API
+
+    Формат: "0.2" или "fixed:0.2", "uniform:мин,макс", "normal:среднее,отклонение",
+    "lognormal:медиана,sigma", "exp:среднее" (значения в секундах).
+    """
+
+    def __init__(self, spec):
+        kind, _, values = spec.partition(":") if ":" in spec else ("fixed", "", spec)
+        self.spec = spec
+        self.kind = kind
+        self.values = [float(value) for value in values.split(",")]
+        if kind not in ("fixed", "uniform", "normal", "lognormal", "exp"):
+            raise ValueError(f"Неизвестное распределение задержки: {spec}")
+
+    def sample(self):
+        """Возвращает случайную задержку в секундах"""
+        if self.kind == "uniform":
+            value = random.uniform(*self.values)
+        elif self.kind == "normal":
+            value = random.gauss(*self.values)
+        elif self.kind == "lognormal":
+            value = random.lognormvariate(np.log(self.values[0]), self.values[1])
+        elif self.kind == "exp":
+            value = random.expovariate(1 / self.values[0])
+        else:
+            value = self.values[0]
+        return max(value, 0.0)
+
+class FakeServer:
+    """
+    Заменитель внешнего API на локальном HTTP-сервере
+
+    Подклассы реализуют handle и отвечают через respond_json/respond_bytes.
+    """
+
+    name = "fake"
+
+    def __init__(self, latency, error_rate=0.0):
+        """
+        Args:
+            latency (Latency): Распределение задержки ответа
+            error_rate (float): Доля запросов, на которые сервер отвечает 503
+        """
+        self.latency = latency
+        self.error_rate = error_rate
+        self.requests = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+        server = self
+
+        class RequestHandler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                server._dispatch(self, None)
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                server._dispatch(self, body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), RequestHandler)
+        self.httpd.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def handle(self, request, body):
+        raise NotImplementedError
+
+    def stats(self):
+        """Возвращает количество обработанных запросов и ответов с ошибкой"""
+        return {"requests": self.requests, "errors": self.errors, "latency": self.latency.spec}
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def _dispatch(self, request, body):
+        with self._lock:
+            self.requests += 1
+            failed = random.random() < self.error_rate
+            if failed:
+                self.errors += 1
+
+        time.sleep(self.latency.sample())
+        if failed:
+            respond_bytes(request, b"Service Unavailable", "text/plain", status=503)
+        else:
+            self.handle(request, body)
+
+class FakeYandex(FakeServer):
+    """Заменитель поиска по организациям и статических карт Яндекса"""
+
+    name = "yandex"
+
+    def __init__(self, latency, error_rate=0.0, places=20):
+        """
+        Args:
+            places (int): Максимальное количество мест в ответе поиска
+        """
+        super().__init__(latency, error_rate)
+        self.places = places
+
+    def handle(self, request, body):
+        parts = urlsplit(request.path)
+        if parts.path.startswith("/static"):
+            respond_bytes(request, PNG_PIXEL, "image/png")
+            return
+
+        params = {key: values[0] for key, values in parse_qs(parts.query).items()}
+        lng, lat = (float(value) for value in params["ll"].split(","))
+        lng_span, lat_span = (float(value) for value in params["spn"].split(","))
+
+        # Одна и та же область всегда возвращает одни и те же места
+        rng = random.Random(f"{params['ll']}|{params['spn']}|{params.get('text')}")
+        skip = int(params.get("skip", 0))
+        features = []
+        for i in range(min(skip + int(params.get("results", 10)), self.places)):
+            place_lat = lat + rng.uniform(-lat_span / 2, lat_span / 2)
+            place_lng = lng + rng.uniform(-lng_span / 2, lng_span / 2)
+            if i < skip:
+                continue
+            features.append({
+                "type": "Feature",
+                "geometry": {"type": "Point", "coordinates": [place_lng, place_lat]},
+                "properties": {
+                    "name": f"Место {place_lat:.5f},{place_lng:.5f}",
+                    "CompanyMetaData": {
+                        "id": f"{place_lat:.6f},{place_lng:.6f}",
+                        "address": f"Улица {i + 1}",
+                    },
+                },
+            })
+
+        respond_json(request, {"type": "FeatureCollection", "features": features})
+
+class FakePerplexity(FakeServer):
+    """Заменитель Perplexity API с обычными и потоковыми ответами"""
+
+    name = "perplexity"
+
+    def __init__(self, latency, error_rate=0.0, chunks=10):
+        """
+        Args:
+            chunks (int): Количество фрагментов потокового ответа
+        """
+        super().__init__(latency, error_rate)
+        self.chunks = chunks
+
+    def handle(self, request, body):
+        payload = json.loads(body)
+        words = ["Текст"] + ["сгенерированного", "ответа"] * 100
+
+        if not payload.get("stream"):
+            content = " ".join(words)
+            if "JSON" in payload["messages"][-1]["content"]:
+                # Объединённый запрос: все разделы одним JSON-объектом
+                content = json.dumps({"description": content, "excursion": content, "reviews": content}, ensure_ascii=False)
+            respond_json(request, {"choices": [{"message": {"content": content}}]})
+            return
+
+        request.send_response(200)
+        request.send_header("Content-Type", "text/event-stream")
+        request.send_header("Connection", "close")
+        request.end_headers()
+        step = max(len(words) // self.chunks, 1)
+        for i in range(0, len(words), step):
+            chunk = {"choices": [{"delta": {"content": " ".join(words[i:i + step]) + " "}}]}
+            request.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            request.wfile.flush()
+            # Фрагменты приходят с интервалом в десятую часть задержки первого ответа
+            time.sleep(self.latency.sample() / 10)
+        request.wfile.write(b"data: [DONE]\n\n")
+        request.close_connection = True
+
+class FakeTelegram(FakeServer):
+    """Заменитель Telegram Bot API: принимает методы бота и возвращает правдоподобные сообщения"""
+
+    name = "telegram"
+
+    def __init__(self, latency, error_rate=0.0):
+        super().__init__(latency, error_rate)
+        self.methods = {}
+        self._message_ids = iter(range(1, sys.maxsize))
+
+    def stats(self):
+        stats = super().stats()
+        stats["methods"] = dict(self.methods)
+        return stats
+
+    def handle(self, request, body):
+        method = request.path.rsplit("/", 1)[-1]
+        with self._lock:
+            self.methods[method] = self.methods.get(method, 0) + 1
+            message_id = next(self._message_ids)
+
+        params = {}
+        if request.headers.get("Content-Type", "").startswith("application/json"):
+            params = json.loads(body or b"{}")
+
+        if method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "LoadTest", "username": "loadtest_bot"}
+        elif method in ("answerCallbackQuery", "deleteMessage", "sendChatAction"):
+            result = True
+        else:
+            chat_id = int(params.get("chat_id") or 1)
+            result = {
+                "message_id": int(params.get("message_id") or message_id),
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+            }
+            if method in ("sendPhoto", "editMessageCaption"):
+                result["photo"] = [{
+                    "file_id": f"photo-{message_id}",
+                    "file_unique_id": f"unique-{message_id}",
+                    "width": 600,
+                    "height": 450,
+                }]
+            else:
+                result["text"] = params.get("text", "")
+
+        respond_json(request, {"ok": True, "result": result})
+
+def respond_json(request, data, status=200):
+    """Отправляет ответ в формате JSON"""
+    respond_bytes(request, json.dumps(data, ensure_ascii=False).encode(), "application/json", status)
+
+def respond_bytes(request, body, content_type, status=200):
+    """Отправляет ответ с телом"""
+    request.send_response(status)
+    request.send_header("Content-Type", content_type)
+    request.send_header("Content-Length", str(len(body)))
+    request.end_headers()
+    request.wfile.write(body)
+
+class SimulatedUser:
+    """
+    Пользователь, который проходит сценарий беседы через диспетчер бота
+
+    Обновления создаются так же, как их присылает Telegram, и обрабатываются
+    синхронно в потоке пользователя, поэтому время шага - полное время
+    обработки обновления ботом.
+    """
+
+    _update_ids = iter(range(1, sys.maxsize))
+    _lock = threading.Lock()
+
+    def __init__(self, dispatcher, user_id, latitude, longitude, radius, interest, think_time):
+        self.dispatcher = dispatcher
+        self.user_id = user_id
+        self.latitude = latitude
+        self.longitude = longitude
+        self.radius = radius
+        self.interest = interest
+        self.think_time = think_time
+        self.timings = {}
+        self.failed_step = None
+
+    def run(self, sessions):
+        """
+        Проходит сценарий целиком
+
+        Args:
+            sessions: Хранилище сессий бота (по нему проверяется, что места найдены)
+
+        Returns:
+            SimulatedUser: Этот же пользователь с заполненными timings
+        """
+        self._step("start", self._message(text="/start", entities=[{"type": "bot_command", "offset": 0, "length": 6}]))
+        self._step("location", self._message(location={"latitude": self.latitude, "longitude": self.longitude}))
+        self._step("radius", self._callback(f"radius_{self.radius}"))
+        self._step("interests", self._callback(f"interest_{self.interest}"))
+        self._step("search", self._callback("interest_done"))
+
+        session = sessions.get(self.user_id)
+        if not session or not session.get("places"):
+            self.failed_step = "search"
+            return self
+
+        # Пользователь выбирает место из списка, а затем читает карточку
+        place_index = random.randrange(len(session["places"]))
+        self._step("place", self._callback(f"place_{place_index}"))
+        self._step("excursion", self._callback(f"excursion_{place_index}"))
+        return self
+
+    def _step(self, name, update):
+        import async_runtime
+        from telegram import Update
+
+        time.sleep(self.think_time.sample())
+        started = time.perf_counter()
+        self.dispatcher.process_update(Update.de_json(update, self.dispatcher.bot))
+        # Обработчик выполняется в цикле событий - ждём, пока он ответит
+        async_runtime.join(self.user_id)
+        self.timings[name] = time.perf_counter() - started
+
+    def _message(self, **fields):
+        update_id = self._next_update_id()
+        message = {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": self.user_id, "type": "private"},
+            "from": {"id": self.user_id, "is_bot": False, "first_name": "Пользователь"},
+        }
+        message.update(fields)
+        return {"update_id": update_id, "message": message}
+
+    def _callback(self, data):
+        update_id = self._next_update_id()
+        return {
+            "update_id": update_id,
+            "callback_query": {
+                "id": str(update_id),
+                "from": {"id": self.user_id, "is_bot": False, "first_name": "Пользователь"},
+                "chat_instance": str(self.user_id),
+                "data": data,
+                "message": {
+                    "message_id": update_id,
+                    "date": int(time.time()),
+                    "chat": {"id": self.user_id, "type": "private"},
+                    "text": "",
+                },
+            },
+        }
+
+    @classmethod
+    def _next_update_id(cls):
+        with cls._lock:
+            return next(cls._update_ids)
+
+def summarize(users, errors, elapsed, servers, args):
+    """
+    Собирает результаты прогона
+
+    Returns:
+        dict: Параметры прогона, пропускная способность, перцентили по шагам и статистика заменителей
+    """
+    steps = {}
+    for step in STEPS:
+        values = np.array([user.timings[step] for user in users if step in user.timings])
+        if not len(values):
+            continue
+        p50, p95, p99 = np.percentile(values, [50, 95, 99])
+        steps[step] = {
+            "count": int(len(values)),
+            "mean": float(values.mean()),
+            "p50": float(p50),
+            "p95": float(p95),
+            "p99": float(p99),
+            "max": float(values.max()),
+        }
+
+    completed = sum(1 for user in users if user.failed_step is None)
+    updates = sum(len(user.timings) for user in users)
+    return {
+        "params": {key: value for key, value in vars(args).items() if key != "output"},
+        "elapsed": elapsed,
+        "users": len(users),
+        "completed": completed,
+        "failed": {step: sum(1 for user in users if user.failed_step == step) for step in STEPS if any(user.failed_step == step for user in users)},
+        "handler_errors": errors,
+        "throughput": {
+            "flows_per_second": completed / elapsed if elapsed else 0.0,
+            "updates_per_second": updates / elapsed if elapsed else 0.0,
+        },
+        "steps": steps,
+        "servers": {server.name: server.stats() for server in servers},
+    }
+
+def print_report(report):
+    """Выводит результаты прогона в виде таблицы"""
+    print(f"\nПользователей: {report['users']}, завершили сценарий: {report['completed']}, время: {report['elapsed']:.1f} с")
+    print(
+        f"Пропускная способность: {report['throughput']['flows_per_second']:.2f} сценариев/с, "
+        f"{report['throughput']['updates_per_second']:.2f} обновлений/с"
+    )
+    if report["failed"] or report["handler_errors"]:
+        print(f"Не завершили: {report['failed']}, ошибок в обработчиках: {report['handler_errors']}")
+
+    print(f"\n{'Шаг':<12}{'p50, мс':>10}{'p95, мс':>10}{'p99, мс':>10}{'макс, мс':>10}")
+    for step, stats in report["steps"].items():
+        print(
+            f"{step:<12}{stats['p50'] * 1000:>10.0f}{stats['p95'] * 1000:>10.0f}"
+            f"{stats['p99'] * 1000:>10.0f}{stats['max'] * 1000:>10.0f}"
+        )
+
+    print()
+    for name, stats in report["servers"].items():
+        print(f"{name}: запросов {stats['requests']}, ошибок {stats['errors']}")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Нагрузочное тестирование бота на локальных заменителях API")
+    parser.add_argument("--users", type=int, default=100, help="Количество пользователей")
+    parser.add_argument("--concurrency", type=int, default=20, help="Количество одновременно активных пользователей")
+    parser.add_argument("--think-time", default="0", help="Пауза пользователя перед каждым шагом")
+    parser.add_argument("--radius", type=int, default=500, help="Радиус поиска в метрах")
+    parser.add_argument("--interest", default="Исторические", help="Выбираемая категория интересов")
+    parser.add_argument("--center", default="55.7522,37.6156", help="Центр области, где находятся пользователи")
+    parser.add_argument("--spread", type=float, default=5000, help="Разброс положения пользователей в метрах")
+    parser.add_argument("--yandex-latency", default="lognormal:0.15,0.4", help="Задержка API Яндекс Карт")
+    parser.add_argument("--yandex-errors", type=float, default=0.0, help="Доля ошибок API Яндекс Карт")
+    parser.add_argument("--perplexity-latency", default="lognormal:1.5,0.5", help="Задержка первого ответа Perplexity")
+    parser.add_argument("--perplexity-errors", type=float, default=0.0, help="Доля ошибок Perplexity")
+    parser.add_argument("--telegram-latency", default="lognormal:0.05,0.3", help="Задержка Telegram Bot API")
+    parser.add_argument("--telegram-errors", type=float, default=0.0, help="Доля ошибок Telegram Bot API")
+    parser.add_argument("--seed", type=int, default=None, help="Начальное значение генератора случайных чисел")
+    parser.add_argument("--output", help="Файл для сохранения результатов в формате JSON")
+    parser.add_argument("--verbose", action="store_true", help="Показывать журнал бота")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    random.seed(args.seed)
+
+    yandex = FakeYandex(Latency(args.yandex_latency), args.yandex_errors)
+    perplexity = FakePerplexity(Latency(args.perplexity_latency), args.perplexity_errors)
+    telegram = FakeTelegram(Latency(args.telegram_latency), args.telegram_errors)
+    servers = [yandex, perplexity, telegram]
+
+    # Модули бота читают адреса API и пути кэшей при импорте, поэтому настраиваем их заранее;
+    # кэши создаются во временном каталоге, чтобы каждый прогон начинался с пустых кэшей
+    workdir = tempfile.mkdtemp(prefix="loadtest-")
+    os.environ.update({
+        "YANDEX_SEARCH_URL": f"{yandex.url}/search/",
+        "YANDEX_STATIC_MAPS_URL": f"{yandex.url}/static/",
+        "PERPLEXITY_API_URL": f"{perplexity.url}/chat/completions",
+        "LLM_CACHE_PATH": os.path.join(workdir, "perplexity_cache.sqlite3"),
+        "MEDIA_CACHE_PATH": os.path.join(workdir, "media_cache.sqlite3"),
+        "SESSION_SQLITE_PATH": os.path.join(workdir, "sessions.sqlite3"),
+        "POPULARITY_PATH": os.path.join(workdir, "popularity.sqlite3"),
+    })
+
+    import bot
+    from telegram import Bot
+    from telegram.ext import Dispatcher, JobQueue
+    from telegram.utils.request import Request
+    from geo import meters_to_degrees
+
+    logging.getLogger().setLevel(logging.INFO if args.verbose else logging.ERROR)
+
+    telegram_bot = Bot("123456:" + "A" * 35, base_url=f"{telegram.url}/bot", request=Request(con_pool_size=args.concurrency + 4))
+    job_queue = JobQueue()
+    dispatcher = Dispatcher(telegram_bot, None, job_queue=job_queue)
+    job_queue.set_dispatcher(dispatcher)
+    bot.setup_dispatcher(dispatcher)
+
+    errors = []
+    dispatcher.add_error_handler(lambda update, context: errors.append(repr(context.error)))
+
+    center_lat, center_lng = (float(value) for value in args.center.split(","))
+    lat_spread, lng_spread = meters_to_degrees(args.spread, center_lat)
+    think_time = Latency(args.think_time)
+    users = [
+        SimulatedUser(
+            dispatcher, 1000 + i,
+            center_lat + random.uniform(-lat_spread, lat_spread),
+            center_lng + random.uniform(-lng_spread, lng_spread),
+            args.radius, args.interest, think_time
+        )
+        for i in range(args.users)
+    ]
+
+    print(f"Запуск: {args.users} пользователей, одновременно {args.concurrency}")
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        users = list(pool.map(lambda user: user.run(bot.sessions), users))
+    elapsed = time.perf_counter() - started
+
+    report = summarize(users, len(errors), elapsed, servers, args)
+    print_report(report)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\nРезультаты сохранены в {args.output}")
+
+    for server in servers:
+        server.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+import os
+import logging
+from collections import deque
+from concurrent.futures import Future
+from dotenv import load_dotenv
+from telegram.error import BadRequest, TelegramError
+from cache import SQLiteCache
+import async_runtime
+import metrics
+import outbox
+import upstream
+from yandex_api import get_static_map, get_static_map_async, get_static_map_url
+
+# Загружаем переменные окружения
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Настройки кэша идентификаторов файлов Telegram
+MEDIA_CACHE_PATH = os.getenv("MEDIA_CACHE_PATH", "media_cache.sqlite3")
+MEDIA_CACHE_TTL = int(os.getenv("MEDIA_CACHE_TTL", str(30 * 24 * 3600)))
+
+# Служебный чат, в который заранее загружаются карты (без него прогрев отключён)
+MEDIA_CACHE_CHAT_ID = os.getenv("MEDIA_CACHE_CHAT_ID")
+
+# Сколько карт может ждать загрузки в служебный чат; остальные не прогреваются
+MEDIA_WARMUP_QUEUE = int(os.getenv("MEDIA_WARMUP_QUEUE", "50"))
+
+# Точность округления координат в ключе (5 знаков - около метра, метка на карте не смещается)
+MAP_COORDINATES_PRECISION = 5
+
+class MapMediaCache:
+    """
+    Кэш идентификаторов file_id статических карт, загруженных в Telegram
+
+    После первой отправки карта хранится на серверах Telegram, и повторные
+    отправки по file_id не требуют ни загрузки изображения из Яндекса, ни
+    его передачи в Telegram.
+
+    Прогрев идёт в отдельной очереди: служебный чат ограничен лимитом
+    Telegram для одного чата (около сообщения в секунду), поэтому карты
+    загружаются по одной и не занимают общие обработчики и упреждающие
+    запросы.
+    """
+
+    def __init__(self, cache, chat_id=None, max_queued=MEDIA_WARMUP_QUEUE):
+        """
+        Args:
+            cache: Хранилище вида SQLiteCache
+            chat_id: Служебный чат для прогрева кэша
+            max_queued (int): Сколько карт может ждать загрузки
+        """
+        self.cache = cache
+        self.chat_id = chat_id
+        self.max_queued = max_queued
+        self._queue = deque()
+        self._queued = set()
+        self._uploading = {}
+        self._worker = None
+
+    def get_photo(self, latitude, longitude, zoom=16):
+        """
+        Возвращает карту для отправки через send_photo
+
+        Если карта для этих координат уже загружается в служебный чат,
+        дожидается загрузки и использует её результат.
+
+        Args:
+            latitude (float): Широта
+            longitude (float): Долгота
+            zoom (int): Уровень приближения
+
+        Returns:
+            str или bytes: file_id, изображение карты или её URL, если изображение загрузить не удалось
+        """
+        key = self._get_key(latitude, longitude, zoom)
+        upload = self._uploading.get(key)
+        if upload is not None:
+            try:
+                upload.result()
+            except Exception:
+                # Прогрев не удался - загружаем карту сами
+                pass
+
+        file_id = self.cache.get(key)
+        if file_id is not None:
+            return file_id
+
+        return get_static_map(latitude, longitude, zoom) or get_static_map_url(latitude, longitude, zoom)
+
+    def send_photo(self, bot, chat_id, latitude, longitude, zoom=16, photo=None, **kwargs):
+        """
+        Отправляет карту и запоминает file_id загруженного изображения
+
+        Args:
+            bot (telegram.Bot): Бот
+            chat_id (int): Чат получателя
+            latitude (float): Широта
+            longitude (float): Долгота
+            zoom (int): Уровень приближения
+            photo: Результат get_photo, если он уже получен
+            **kwargs: Остальные параметры send_photo (подпись, клавиатура)
+
+        Returns:
+            telegram.Message: Отправленное сообщение
+        """
+        key = self._get_key(latitude, longitude, zoom)
+        if photo is None:
+            photo = self.get_photo(latitude, longitude, zoom)
+
+        try:
+            message = bot.send_photo(chat_id=chat_id, photo=photo, **kwargs)
+        except BadRequest:
+            if not isinstance(photo, str) or photo.startswith("http"):
+                raise
+            # Сохранённый file_id больше не действителен - загружаем карту заново
+            logger.warning("Недействительный file_id карты %s", key)
+            self.cache.delete(key)
+            photo = get_static_map(latitude, longitude, zoom) or get_static_map_url(latitude, longitude, zoom)
+            message = bot.send_photo(chat_id=chat_id, photo=photo, **kwargs)
+
+        self._remember(key, message)
+        return message
+
+    def warm_up(self, bot, latitude, longitude, zoom=16):
+        """
+        Ставит карту в очередь загрузки в служебный чат, чтобы получить её file_id (только из цикла событий)
+
+        Если очередь заполнена, карта не прогревается: её загрузит первая
+        отправка пользователю.
+
+        Args:
+            bot (telegram.Bot): Бот
+            latitude (float): Широта
+            longitude (float): Долгота
+            zoom (int): Уровень приближения
+
+        Returns:
+            bool: True, если карта поставлена в очередь или уже загружается
+        """
+        if not self.chat_id:
+            return False
+
+        key = self._get_key(latitude, longitude, zoom)
+        if key in self._queued or key in self._uploading:
+            return True
+        if len(self._queue) >= self.max_queued:
+            return False
+
+        self._queue.append((bot, key, latitude, longitude, zoom))
+        self._queued.add(key)
+        if self._worker is None:
+            self._worker = async_runtime.spawn(self._run_uploads())
+        return True
+
+    def pending(self):
+        """Возвращает количество карт в очереди загрузки"""
+        return len(self._queue)
+
+    async def _run_uploads(self):
+        """Загружает карты из очереди по одной, пока она не опустеет"""
+        try:
+            with upstream.priority(upstream.WARMUP):
+                while self._queue:
+                    bot, key, latitude, longitude, zoom = self._queue.popleft()
+                    self._queued.discard(key)
+                    upload = self._uploading[key] = Future()
+                    try:
+                        upload.set_result(await self._upload(bot, key, latitude, longitude, zoom))
+                    except Exception as e:
+                        logger.debug("Не удалось прогреть карту %s: %s", key, e)
+                        upload.set_exception(e)
+                    finally:
+                        del self._uploading[key]
+        finally:
+            self._worker = None
+
+    async def _upload(self, bot, key, latitude, longitude, zoom):
+        """Загружает карту в служебный чат и удаляет сообщение после получения file_id"""
+        if await async_runtime.to_thread(self.cache.get, key) is not None:
+            return True
+
+        image = await get_static_map_async(latitude, longitude, zoom)
+        if image is None:
+            return False
+
+        # Загрузка идёт через общую очередь сообщений, чтобы не превысить лимиты Telegram
+        message = await outbox.send_async(self.chat_id, bot.send_photo, chat_id=self.chat_id, photo=image, disable_notification=True)
+        await async_runtime.to_thread(self._remember, key, message)
+        try:
+            await async_runtime.to_thread(message.delete)
+        except TelegramError as e:
+            # file_id остаётся действительным, даже если сообщение не удалось удалить
+            logger.debug("Не удалось удалить служебное сообщение: %s", e)
+        return True
+
+    def _remember(self, key, message):
+        """Сохраняет file_id самого крупного размера изображения из сообщения"""
+        if message is not None and message.photo:
+            self.cache.set(key, message.photo[-1].file_id)
+
+    def _get_key(self, latitude, longitude, zoom):
+        """Формирует ключ кэша по округлённым координатам и уровню приближения"""
+        return (
+            f"map|{round(latitude, MAP_COORDINATES_PRECISION)},"
+            f"{round(longitude, MAP_COORDINATES_PRECISION)}|{zoom}"
+        )
+
+map_media = MapMediaCache(SQLiteCache(MEDIA_CACHE_PATH, ttl=MEDIA_CACHE_TTL), MEDIA_CACHE_CHAT_ID)
+metrics.register_cache("map_file_ids", map_media.cache)
+metrics.GaugeFunc("map_warmup_queue_depth", "Количество карт, ожидающих загрузки в служебный чат", map_media.pending)
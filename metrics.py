@@ -0,0 +1,356 @@
+import os
+import time
+import asyncio
+import bisect
+import logging
+import functools
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from dotenv import load_dotenv
+
+# Загружаем переменные окружения
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Адрес HTTP-сервера метрик (порт 0 - сервер не запускается)
+METRICS_HOST = os.getenv("METRICS_HOST", "0.0.0.0")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+
+# Границы интервалов гистограмм задержки (в секундах)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_registry = []
+_registry_lock = threading.Lock()
+
+# Кэши, счётчики попаданий которых публикуются (имя -> кэш)
+_caches = {}
+
+class _Metric:
+    """Базовый класс метрики с набором меток"""
+
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        """
+        Args:
+            name (str): Имя метрики
+            documentation (str): Описание метрики
+            labelnames (tuple): Имена меток
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        with _registry_lock:
+            _registry.append(self)
+
+    def labels(self, *values):
+        """
+        Возвращает метрику для конкретных значений меток
+
+        Args:
+            *values: Значения меток в порядке labelnames
+
+        Returns:
+            Дочерняя метрика, которую удобно сохранить и переиспользовать
+        """
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._create_child())
+        return child
+
+    def collect(self):
+        """Возвращает строки в текстовом формате Prometheus"""
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        for values, child in list(self._children.items()):
+            lines.extend(child.collect(self.name, _format_labels(self.labelnames, values)))
+        return lines
+
+    def _create_child(self):
+        raise NotImplementedError
+
+class Counter(_Metric):
+    """Монотонно растущий счётчик"""
+
+    type = "counter"
+
+    def inc(self, *values, amount=1):
+        """Увеличивает счётчик для значений меток"""
+        self.labels(*values).inc(amount)
+
+    def _create_child(self):
+        return _CounterChild()
+
+class _CounterChild:
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def collect(self, name, labels):
+        return [f"{name}{labels} {self.value}"]
+
+class Histogram(_Metric):
+    """Гистограмма значений (например, задержек) с фиксированными интервалами"""
+
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        """
+        Args:
+            buckets (tuple): Верхние границы интервалов по возрастанию
+        """
+        self.buckets = tuple(buckets)
+        super().__init__(name, documentation, labelnames)
+
+    def observe(self, value, *values):
+        """Добавляет наблюдение для значений меток"""
+        self.labels(*values).observe(value)
+
+    @contextmanager
+    def time(self, *values):
+        """Измеряет время выполнения блока"""
+        child = self.labels(*values)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            child.observe(time.perf_counter() - started)
+
+    def _create_child(self):
+        return _HistogramChild(self.buckets)
+
+class _HistogramChild:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def collect(self, name, labels):
+        with self._lock:
+            counts = list(self.counts)
+            total = self.sum
+
+        lines = []
+        cumulative = 0
+        prefix = labels[:-1] + "," if labels else "{"
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            lines.append(f'{name}_bucket{prefix}le="{le}"}} {cumulative}')
+        lines.append(f"{name}_sum{labels} {total}")
+        lines.append(f"{name}_count{labels} {cumulative}")
+        return lines
+
+class GaugeFunc(_Metric):
+    """
+    Метрика, значение которой вычисляется в момент сбора
+
+    Подходит для размеров очередей, количества сессий и счётчиков,
+    которые уже ведутся в других модулях: они не замедляют обработку запросов.
+    """
+
+    def __init__(self, name, documentation, func, labelnames=(), type="gauge"):
+        """
+        Args:
+            func (callable): Возвращает число или словарь {кортеж значений меток: число}
+            type (str): Тип метрики в Prometheus (gauge или counter)
+        """
+        self.func = func
+        self.type = type
+        super().__init__(name, documentation, labelnames)
+
+    def collect(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        try:
+            values = self.func()
+        except Exception as e:
+            logger.warning("Не удалось получить метрику %s: %s", self.name, e)
+            return lines
+
+        if not isinstance(values, dict):
+            values = {(): values}
+        for label_values, value in values.items():
+            lines.append(f"{self.name}{_format_labels(self.labelnames, label_values)} {value}")
+        return lines
+
+def _format_labels(labelnames, values):
+    """Форматирует метки в виде {name="value",...}"""
+    if not labelnames:
+        return ""
+    pairs = []
+    for name, value in zip(labelnames, values):
+        value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+def render():
+    """
+    Возвращает все метрики в текстовом формате Prometheus
+
+    Returns:
+        str: Текст для ответа на запрос /metrics
+    """
+    with _registry_lock:
+        metrics = list(_registry)
+
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.collect())
+    return "\n".join(lines) + "\n"
+
+def register_cache(name, cache):
+    """
+    Публикует счётчики попаданий и промахов кэша
+
+    Args:
+        name (str): Имя кэша в метках
+        cache: Кэш с атрибутами hits, misses и stale_hits (cache.TTLCache, cache.SQLiteCache)
+    """
+    _caches[name] = cache
+
+def _get_cache_stats(attribute):
+    return {(name,): getattr(cache, attribute) for name, cache in list(_caches.items())}
+
+def _get_cache_ratios():
+    ratios = {}
+    for name, cache in list(_caches.items()):
+        total = cache.hits + cache.misses
+        ratios[(name,)] = cache.hits / total if total else 0.0
+    return ratios
+
+def track_handler(func):
+    """
+    Декоратор обработчика бота: записывает время обработки и ошибки
+
+    Поддерживает как обычные функции, так и корутины.
+
+    Args:
+        func (callable): Обработчик (update, context)
+
+    Returns:
+        callable: Обработчик с измерением времени
+    """
+    duration = HANDLER_DURATION.labels(func.__name__)
+    errors = HANDLER_ERRORS.labels(func.__name__)
+
+    if asyncio.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            except Exception:
+                errors.inc()
+                raise
+            finally:
+                duration.observe(time.perf_counter() - started)
+
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        except Exception:
+            errors.inc()
+            raise
+        finally:
+            duration.observe(time.perf_counter() - started)
+
+    return wrapper
+
+def start_server(port=METRICS_PORT, host=METRICS_HOST):
+    """
+    Запускает HTTP-сервер с метриками по адресу /metrics в фоновом потоке
+
+    Args:
+        port (int): Порт (0 - сервер не запускается)
+        host (str): Адрес
+
+    Returns:
+        ThreadingHTTPServer: Запущенный сервер или None
+    """
+    if not port:
+        return None
+
+    class MetricsRequestHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_response(404)
+                self.end_headers()
+                return
+
+            body = render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsRequestHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    logger.info("Метрики доступны на порту %d", port)
+    return server
+
+# Метрики обработчиков бота
+HANDLER_DURATION = Histogram(
+    "bot_handler_duration_seconds", "Время обработки обновления обработчиком", ["handler"]
+)
+HANDLER_ERRORS = Counter(
+    "bot_handler_errors_total", "Количество исключений в обработчиках", ["handler"]
+)
+
+# Метрики запросов к внешним API
+UPSTREAM_DURATION = Histogram(
+    "upstream_request_duration_seconds",
+    "Время запроса к внешнему API с учётом ожидания квоты и повторов", ["endpoint", "operation"]
+)
+UPSTREAM_REQUESTS = Counter(
+    "upstream_requests_total", "Количество запросов к внешним API по результату", ["endpoint", "operation", "status"]
+)
+UPSTREAM_HEDGES = Counter(
+    "upstream_hedged_requests_total", "Количество запросов, продублированных из-за долгого ответа", ["endpoint"]
+)
+
+# Метрики отправки сообщений в Telegram
+TELEGRAM_MESSAGES = Counter(
+    "telegram_messages_total", "Количество исходящих сообщений по результату (sent, dropped, failed)", ["result"]
+)
+TELEGRAM_RETRY_AFTER = Counter(
+    "telegram_retry_after_total", "Количество ответов RetryAfter от Telegram"
+)
+
+# Метрики кэшей
+CACHE_HITS = GaugeFunc(
+    "cache_hits_total", "Количество попаданий в кэш", lambda: _get_cache_stats("hits"), ["cache"], type="counter"
+)
+CACHE_MISSES = GaugeFunc(
+    "cache_misses_total", "Количество промахов кэша", lambda: _get_cache_stats("misses"), ["cache"], type="counter"
+)
+CACHE_STALE_HITS = GaugeFunc(
+    "cache_stale_hits_total", "Количество устаревших записей, показанных на время обновления",
+    lambda: _get_cache_stats("stale_hits"), ["cache"], type="counter"
+)
+CACHE_HIT_RATIO = GaugeFunc(
+    "cache_hit_ratio", "Доля попаданий в кэш с момента запуска", _get_cache_ratios, ["cache"]
+)
@@ -0,0 +1,207 @@
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+from dotenv import load_dotenv
+from telegram.error import RetryAfter, TelegramError
+import async_runtime
+import metrics
+import upstream
+
+# Загружаем переменные окружения
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Лимит Telegram для одного чата - около сообщения в секунду с небольшими пачками
+# (общий лимит около 30 сообщений в секунду задаётся квотой UPSTREAM_RATE_TELEGRAM)
+TELEGRAM_CHAT_RATE = float(os.getenv("TELEGRAM_CHAT_RATE", "1"))
+TELEGRAM_CHAT_BURST = max(float(os.getenv("TELEGRAM_CHAT_BURST", "3")), 1.0)
+
+# Сколько секунд промежуточное сообщение ("Ищу места...") ждёт отправки:
+# если за это время готов итоговый текст, промежуточный не отправляется вовсе
+TELEGRAM_INTERIM_DELAY = float(os.getenv("TELEGRAM_INTERIM_DELAY", "0.5"))
+
+# Сколько раз повторять сообщение после ответа RetryAfter
+TELEGRAM_SEND_RETRIES = int(os.getenv("TELEGRAM_SEND_RETRIES", "3"))
+
+# Очереди исходящих сообщений по чатам
+_chats = {}
+
+class _Message:
+    """Исходящее сообщение в очереди чата"""
+
+    __slots__ = ("func", "args", "kwargs", "target", "interim", "ready_at", "priority", "future", "attempts")
+
+    def __init__(self, func, args, kwargs, target, interim, delay, future):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.target = target
+        self.interim = interim
+        self.ready_at = time.monotonic() + delay
+        self.priority = upstream.get_priority()
+        self.future = future
+        self.attempts = 0
+
+class _Chat:
+    """Очередь и ограничитель частоты сообщений одного чата"""
+
+    def __init__(self, chat_id):
+        self.chat_id = chat_id
+        self.queue = deque()
+        self.tokens = TELEGRAM_CHAT_BURST
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.wakeup = asyncio.Event()
+        self.worker = None
+
+    def refill(self, now):
+        """Начисляет токены за прошедшее время"""
+        if TELEGRAM_CHAT_RATE <= 0:
+            self.tokens = TELEGRAM_CHAT_BURST
+        else:
+            self.tokens = min(TELEGRAM_CHAT_BURST, self.tokens + (now - self.updated) * TELEGRAM_CHAT_RATE)
+        self.updated = now
+
+    def pause(self, delay):
+        """Приостанавливает отправку в чат после ответа RetryAfter"""
+        self.tokens = 0.0
+        self.paused_until = max(self.paused_until, time.monotonic() + delay)
+
+async def send_async(chat_id, func, /, *args, target=None, **kwargs):
+    """
+    Отправляет сообщение в чат с учётом лимитов Telegram
+
+    Сообщения одного чата отправляются по очереди и не чаще
+    TELEGRAM_CHAT_RATE в секунду, всех чатов - в пределах квоты telegram
+    (upstream). После ответа RetryAfter сообщение повторяется, когда
+    истечёт пауза. Промежуточные сообщения чата, стоящие в очереди перед
+    этим, отправляются без задержки, а с тем же target - отбрасываются.
+
+    Args:
+        chat_id (int): Чат получателя
+        func (callable): Блокирующий вызов Bot API (например, query.edit_message_text)
+        target (int): Идентификатор редактируемого сообщения (None - новое сообщение)
+        *args, **kwargs: Аргументы func
+
+    Returns:
+        Результат func
+
+    Raises:
+        telegram.error.TelegramError: При ошибке Bot API
+        upstream.UpstreamOverloaded: Если общая квота не позволила отправить сообщение вовремя
+    """
+    future = asyncio.get_running_loop().create_future()
+    _enqueue(chat_id, _Message(func, args, kwargs, target, False, 0, future))
+    return await future
+
+def send(chat_id, func, /, *args, target=None, **kwargs):
+    """Синхронная версия send_async для вызова из потоков"""
+    return async_runtime.run(send_async(chat_id, func, *args, target=target, **kwargs))
+
+def send_interim(chat_id, func, /, *args, target, delay=TELEGRAM_INTERIM_DELAY, **kwargs):
+    """
+    Ставит в очередь промежуточную правку сообщения (только из цикла событий)
+
+    Правка отправляется не раньше чем через delay секунд и отбрасывается,
+    если до отправки в очередь встанет новая правка того же сообщения.
+    Результата не ждёт; ошибки записываются в лог.
+
+    Args:
+        chat_id (int): Чат получателя
+        func (callable): Блокирующий вызов Bot API
+        target (int): Идентификатор редактируемого сообщения
+        delay (float): Задержка отправки в секундах
+        *args, **kwargs: Аргументы func
+    """
+    _enqueue(chat_id, _Message(func, args, kwargs, target, True, delay, None))
+
+def _enqueue(chat_id, message):
+    """Добавляет сообщение в очередь чата и запускает её обработку"""
+    chat = _chats.get(chat_id)
+    if chat is None:
+        chat = _chats[chat_id] = _Chat(chat_id)
+
+    for other in list(chat.queue):
+        if other.interim and message.target is not None and other.target == message.target:
+            # Новый текст того же сообщения готов раньше, чем отправлен прежний промежуточный
+            chat.queue.remove(other)
+            metrics.TELEGRAM_MESSAGES.inc("dropped")
+        elif not message.interim:
+            other.ready_at = min(other.ready_at, message.ready_at)
+
+    chat.queue.append(message)
+    chat.wakeup.set()
+    if chat.worker is None:
+        chat.worker = async_runtime.spawn(_run_chat(chat))
+
+async def _run_chat(chat):
+    """Отправляет сообщения чата по очереди; завершается, когда очередь пуста и лимит восстановлен"""
+    while True:
+        now = time.monotonic()
+        chat.refill(now)
+        if chat.queue:
+            message = chat.queue[0]
+            timeout = max(message.ready_at - now, chat.paused_until - now)
+            if chat.tokens < 1:
+                timeout = max(timeout, (1 - chat.tokens) / TELEGRAM_CHAT_RATE)
+            if timeout <= 0:
+                chat.queue.popleft()
+                chat.tokens -= 1
+                await _deliver(chat, message)
+                continue
+        elif chat.tokens >= TELEGRAM_CHAT_BURST:
+            # Лимит чата восстановлен - состояние больше не нужно
+            del _chats[chat.chat_id]
+            return
+        else:
+            timeout = (TELEGRAM_CHAT_BURST - chat.tokens) / TELEGRAM_CHAT_RATE
+
+        chat.wakeup.clear()
+        try:
+            await asyncio.wait_for(chat.wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+async def _deliver(chat, message):
+    """Выполняет вызов Bot API и передаёт результат отправителю"""
+    try:
+        with upstream.priority(message.priority):
+            await upstream.acquire("telegram")
+        result = await async_runtime.to_thread(message.func, *message.args, **message.kwargs)
+    except RetryAfter as e:
+        metrics.TELEGRAM_RETRY_AFTER.inc()
+        chat.pause(e.retry_after)
+        message.attempts += 1
+        if message.attempts <= TELEGRAM_SEND_RETRIES:
+            logger.warning("Превышен лимит Telegram в чате %s, повтор через %s с", chat.chat_id, e.retry_after)
+            chat.queue.appendleft(message)
+            return
+        _fail(message, e)
+    except Exception as e:
+        _fail(message, e)
+    else:
+        metrics.TELEGRAM_MESSAGES.inc("sent")
+        if message.future is not None and not message.future.done():
+            message.future.set_result(result)
+
+def _fail(message, error):
+    """Сообщает отправителю об ошибке; ошибку промежуточного сообщения только записывает в лог"""
+    metrics.TELEGRAM_MESSAGES.inc("failed")
+    if message.future is None:
+        # Например, "message is not modified", если текст не изменился
+        if isinstance(error, (TelegramError, upstream.UpstreamOverloaded)):
+            logger.debug("Не удалось отправить промежуточное сообщение: %s", error)
+        else:
+            logger.error("Ошибка отправки промежуточного сообщения", exc_info=error)
+    elif not message.future.done():
+        message.future.set_exception(error)
+
+def _count_queued():
+    return sum(len(chat.queue) for chat in list(_chats.values()))
+
+metrics.GaugeFunc(
+    "telegram_send_queue_depth", "Количество сообщений, ожидающих отправки в Telegram", _count_queued
+)
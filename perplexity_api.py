@@ -1,6 +1,13 @@
 import os
+import json
 import requests
+import async_runtime
+import http_client
 from dotenv import load_dotenv
+from cache import SQLiteCache, Revalidator
+import upstream
+from upstream import Coalescer
+import metrics
 
 # Загружаем переменные окружения
 load_dotenv()
@@ -9,63 +16,538 @@ load_dotenv()
 API_KEY = os.getenv("PERPLEXITY_API_KEY")
 
 # URL для API-запросов
-API_URL = "https://api.perplexity.ai/chat/completions"
+API_URL = os.getenv("PERPLEXITY_API_URL", "https://api.perplexity.ai/chat/completions")
 
-def get_place_description(place_name, location):
+# Настройки постоянного кэша ответов
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "perplexity_cache.sqlite3")
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600)))
+# Сколько секунд после истечения срока показывать устаревший ответ, пока он генерируется заново
+LLM_CACHE_STALE_TTL = int(os.getenv("LLM_CACHE_STALE_TTL", str(7 * 24 * 3600)))
+
+# Точность округления координат в ключе кэша (4 знака - около 10 метров)
+CACHE_COORDINATES_PRECISION = 4
+
+# Тексты, которые возвращаются вместо ответа при ошибке
+UNAVAILABLE_TEXT = "Не удалось получить информацию."
+CONNECTION_ERROR_TEXT = "Не удалось получить информацию из-за ошибки соединения."
+
+# Приписка к тексту, поток которого оборвался на середине
+INTERRUPTED_TEXT = "\n\n(Текст прервался из-за ошибки соединения.)"
+
+# Шаблоны запросов для каждого типа текста
+PROMPTS = {
+    "description": "Опиши достопримечательность '{place_name}' по адресу {location}. Напиши интересную информацию об истории и значимости этого места. Ответ на русском языке, до 200 слов.",
+    "excursion": "Проведи мини-экскурсию по достопримечательности '{place_name}' по адресу {location}. Расскажи о истории создания, архитектурных особенностях, интересных фактах и культурной значимости. Ответ должен быть информативным и увлекательным, в стиле профессионального экскурсовода. Текст на русском языке, 250-300 слов.",
+    "reviews": "Предоставь краткий обзор отзывов о достопримечательности '{place_name}' по адресу {location}. Что обычно отмечают посетители как плюсы и минусы? Какие советы дают для посещения? Ответ на русском языке, до 150 слов.",
+}
+
+# Получать описание, экскурсию и отзывы одним запросом
+LLM_COMBINED = os.getenv("LLM_COMBINED", "1") == "1"
+
+# Разделы, которые генерируются одним запросом
+COMBINED_KINDS = ("description", "excursion", "reviews")
+
+# Шаблон объединённого запроса: ответ - JSON с текстом для каждого раздела
+COMBINED_PROMPT = (
+    "Подготовь материалы о достопримечательности '{place_name}' по адресу {location}. "
+    "Верни только JSON-объект без пояснений и разметки со строковыми полями:\n"
+    "\"description\" - интересная информация об истории и значимости места, до 200 слов;\n"
+    "\"excursion\" - мини-экскурсия в стиле профессионального экскурсовода: история создания, "
+    "архитектурные особенности, интересные факты и культурная значимость, 250-300 слов;\n"
+    "\"reviews\" - краткий обзор отзывов: что посетители отмечают как плюсы и минусы, "
+    "какие советы дают для посещения, до 150 слов.\n"
+    "Все тексты на русском языке."
+)
+
+# Ограничение длины ответа (в токенах) для одного раздела и для объединённого запроса
+MAX_TOKENS = 500
+COMBINED_MAX_TOKENS = 2000
+
+# Системное сообщение для всех запросов
+SYSTEM_PROMPT = "Ты - информативный ассистент по туризму и достопримечательностям. Отвечай детально и точно о местах, их истории и культурном значении. Отвечай только на русском языке."
+
+_response_cache = SQLiteCache(LLM_CACHE_PATH, ttl=LLM_CACHE_TTL, stale_ttl=LLM_CACHE_STALE_TTL)
+metrics.register_cache("llm_responses", _response_cache)
+_in_flight = Coalescer()
+_revalidator = Revalidator(workers=int(os.getenv("LLM_REVALIDATE_WORKERS", "2")))
+
+async def get_place_description_async(place_name, location, coordinates=None):
     """
     Получает описание места с помощью Perplexity API
     
     Args:
         place_name (str): Название места
         location (str): Местоположение/адрес
+        coordinates (tuple): Координаты места (широта, долгота)
         
     Returns:
         str: Описание места
     """
-    prompt = f"Опиши достопримечательность '{place_name}' по адресу {location}. Напиши интересную информацию об истории и значимости этого места. Ответ на русском языке, до 200 слов."
-    
-    return _make_api_request(prompt)
+    return await _get_section("description", place_name, location, coordinates)
 
-def get_excursion_info(place_name, location):
+async def get_excursion_info_async(place_name, location, coordinates=None):
     """
     Генерирует мини-экскурсию по месту с помощью Perplexity API
     
     Args:
         place_name (str): Название места
         location (str): Местоположение/адрес
+        coordinates (tuple): Координаты места (широта, долгота)
         
     Returns:
         str: Текст экскурсии
     """
-    prompt = f"Проведи мини-экскурсию по достопримечательности '{place_name}' по адресу {location}. Расскажи о истории создания, архитектурных особенностях, интересных фактах и культурной значимости. Ответ должен быть информативным и увлекательным, в стиле профессионального экскурсовода. Текст на русском языке, 250-300 слов."
-    
-    return _make_api_request(prompt)
+    return await _get_section("excursion", place_name, location, coordinates)
 
-def get_place_reviews(place_name, location):
+async def get_place_reviews_async(place_name, location, coordinates=None):
     """
     Получает обзор отзывов о месте с помощью Perplexity API
     
     Args:
         place_name (str): Название места
         location (str): Местоположение/адрес
+        coordinates (tuple): Координаты места (широта, долгота)
         
     Returns:
         str: Обзор отзывов
     """
-    prompt = f"Предоставь краткий обзор отзывов о достопримечательности '{place_name}' по адресу {location}. Что обычно отмечают посетители как плюсы и минусы? Какие советы дают для посещения? Ответ на русском языке, до 150 слов."
+    return await _get_section("reviews", place_name, location, coordinates)
+
+async def stream_excursion_info_async(place_name, location, coordinates=None):
+    """
+    Генерирует мини-экскурсию, отдавая текст по мере генерации
+    
+    Если экскурсия уже есть в кэше или генерируется по другому запросу
+    (в том числе вместе с остальными разделами), текст возвращается
+    целиком одним фрагментом.
+    
+    Args:
+        place_name (str): Название места
+        location (str): Местоположение/адрес
+        coordinates (tuple): Координаты места (широта, долгота)
+        
+    Yields:
+        str: Текст экскурсии, накопленный к текущему моменту
+    """
+    if LLM_COMBINED and _in_flight.in_flight(_get_cache_key("combined", place_name, location, coordinates)):
+        yield await get_excursion_info_async(place_name, location, coordinates)
+        return
+    
+    cache_key = _get_cache_key("excursion", place_name, location, coordinates)
+    content, stale = await async_runtime.to_thread(_response_cache.get_stale, cache_key)
+    if stale:
+        _revalidate(place_name, location, coordinates)
+        yield content
+        return
+    
+    prompt = PROMPTS["excursion"].format(place_name=place_name, location=location)
+    
+    async for text in _stream_api_request(prompt, cache_key):
+        yield text
+
+async def warm_place_content_async(place_name, location, coordinates=None, refresh_before=0):
+    """
+    Заранее генерирует все разделы о месте и сохраняет их в кэш
+    
+    Разделы, которые есть в кэше и проживут дольше refresh_before секунд,
+    не запрашиваются; остальные генерируются заново, причём старые записи
+    остаются доступны пользователям до замены.
+    
+    Args:
+        place_name (str): Название места
+        location (str): Местоположение/адрес
+        coordinates (tuple): Координаты места (широта, долгота)
+        refresh_before (float): За сколько секунд до истечения срока обновлять запись
+        
+    Returns:
+        int: Количество сгенерированных разделов
+        
+    Raises:
+        requests.exceptions.RequestException: При ошибке соединения или исчерпании квоты
+    """
+    stale = [
+        kind for kind in COMBINED_KINDS
+        if not await _is_fresh(_get_cache_key(kind, place_name, location, coordinates), refresh_before)
+    ]
+    if not stale:
+        return 0
+    
+    if LLM_COMBINED and await _in_flight.do(
+        _get_cache_key("combined", place_name, location, coordinates),
+        _request_combined, place_name, location, coordinates, refresh_before
+    ):
+        return len(stale)
+    
+    generated = 0
+    for kind in stale:
+        prompt = PROMPTS[kind].format(place_name=place_name, location=location)
+        cache_key = _get_cache_key(kind, place_name, location, coordinates)
+        if await _in_flight.do(cache_key, _request_and_cache, prompt, cache_key, refresh_before) is not None:
+            generated += 1
+    
+    return generated
+
+def get_place_description(place_name, location, coordinates=None):
+    """Синхронная версия get_place_description_async для вызова из потоков"""
+    return async_runtime.run(get_place_description_async(place_name, location, coordinates))
+
+def get_excursion_info(place_name, location, coordinates=None):
+    """Синхронная версия get_excursion_info_async для вызова из потоков"""
+    return async_runtime.run(get_excursion_info_async(place_name, location, coordinates))
+
+def get_place_reviews(place_name, location, coordinates=None):
+    """Синхронная версия get_place_reviews_async для вызова из потоков"""
+    return async_runtime.run(get_place_reviews_async(place_name, location, coordinates))
+
+def warm_place_content(place_name, location, coordinates=None, refresh_before=0):
+    """Синхронная версия warm_place_content_async для вызова из потоков"""
+    return async_runtime.run(warm_place_content_async(place_name, location, coordinates, refresh_before))
+
+def purge_expired_responses():
+    """
+    Удаляет из кэша ответы, которые уже нельзя показывать даже как устаревшие
+    
+    Returns:
+        int: Количество удалённых записей
+    """
+    return _response_cache.purge_expired()
+
+def is_error_response(text):
+    """
+    Проверяет, является ли текст сообщением об ошибке вместо ответа API
+    
+    Args:
+        text (str): Текст, полученный от функций модуля
+        
+    Returns:
+        bool: True, если ответ получить не удалось
+    """
+    return text in (UNAVAILABLE_TEXT, CONNECTION_ERROR_TEXT)
+
+def _get_cache_key(kind, place_name, location, coordinates=None):
+    """
+    Формирует ключ кэша из типа запроса и нормализованных данных о месте
+    
+    Args:
+        kind (str): Тип запроса (description, excursion, reviews)
+        place_name (str): Название места
+        location (str): Местоположение/адрес
+        coordinates (tuple): Координаты места (широта, долгота)
+        
+    Returns:
+        str: Ключ кэша
+    """
+    name = " ".join((place_name or "").lower().split())
+    address = " ".join((location or "").lower().split())
+    coords = ""
+    if coordinates:
+        lat, lng = coordinates
+        coords = f"{float(lat):.{CACHE_COORDINATES_PRECISION}f},{float(lng):.{CACHE_COORDINATES_PRECISION}f}"
+    
+    return f"{kind}|{name}|{address}|{coords}"
+
+async def _is_fresh(cache_key, refresh_before=0):
+    """Проверяет, что запись есть в кэше и проживёт дольше refresh_before секунд"""
+    ttl_left = await async_runtime.to_thread(_response_cache.ttl_left, cache_key)
+    return ttl_left is not None and ttl_left > refresh_before
+
+def _get_kind(cache_key):
+    """Возвращает тип запроса (description, excursion, reviews) из ключа кэша"""
+    return cache_key.split("|", 1)[0]
+
+async def _get_section(kind, place_name, location, coordinates=None):
+    """
+    Возвращает текст раздела о месте из кэша или генерирует его
+    
+    В объединённом режиме при промахе кэша упреждающие запросы и прогрев
+    запрашивают все разделы одним вызовом API; если его ответ не удалось
+    разобрать, раздел запрашивается отдельным запросом. Запрос
+    пользователя, который ждёт ответа, не начинает объединённый вызов (он
+    выполняется в несколько раз дольше отдельного), а только дожидается
+    уже начатого. Устаревший текст возвращается сразу, а разделы
+    генерируются заново в фоне.
+    
+    Args:
+        kind (str): Тип раздела (description, excursion, reviews)
+        place_name (str): Название места
+        location (str): Местоположение/адрес
+        coordinates (tuple): Координаты места (широта, долгота)
+        
+    Returns:
+        str: Текст раздела
+    """
+    prompt = PROMPTS[kind].format(place_name=place_name, location=location)
+    cache_key = _get_cache_key(kind, place_name, location, coordinates)
+    
+    content, stale = await async_runtime.to_thread(_response_cache.get_stale, cache_key)
+    if content is not None:
+        if stale:
+            _revalidate(place_name, location, coordinates)
+        return content
+    
+    combined_key = _get_cache_key("combined", place_name, location, coordinates)
+    if LLM_COMBINED and (upstream.get_priority() != upstream.INTERACTIVE or _in_flight.in_flight(combined_key)):
+        try:
+            await _in_flight.do(combined_key, _request_combined, place_name, location, coordinates)
+        except requests.exceptions.RequestException as e:
+            # Отдельный запрос раздела упрётся в ту же ошибку, поэтому не повторяем его
+            print(f"Ошибка при запросе к API: {e}")
+            return CONNECTION_ERROR_TEXT
+    
+    return await _make_api_request(prompt, cache_key)
+
+def _revalidate(place_name, location, coordinates):
+    """Генерирует устаревшие разделы о месте заново в фоне (через Revalidator)"""
+    async def refresh():
+        try:
+            with upstream.priority(upstream.PREFETCH):
+                await warm_place_content_async(place_name, location, coordinates)
+        except requests.exceptions.RequestException as e:
+            print(f"Ошибка при обновлении устаревшего ответа: {e}")
+    
+    _revalidator.submit(_get_cache_key("combined", place_name, location, coordinates), refresh)
+
+async def _request_combined(place_name, location, coordinates, refresh_before=0):
+    """
+    Запрашивает все разделы о месте одним вызовом API и сохраняет их в кэш
+    
+    Args:
+        place_name (str): Название места
+        location (str): Местоположение/адрес
+        coordinates (tuple): Координаты места (широта, долгота)
+        refresh_before (float): За сколько секунд до истечения срока обновлять записи
+        
+    Returns:
+        bool: True, если все разделы сохранены в кэш
+    """
+    cache_keys = {kind: _get_cache_key(kind, place_name, location, coordinates) for kind in COMBINED_KINDS}
+    # Пока ожидали своей очереди, разделы могли появиться в кэше
+    for cache_key in cache_keys.values():
+        if not await _is_fresh(cache_key, refresh_before):
+            break
+    else:
+        return True
+    
+    prompt = COMBINED_PROMPT.format(place_name=place_name, location=location)
+    content = await _request_completion(prompt, "combined", max_tokens=COMBINED_MAX_TOKENS)
+    sections = _parse_combined(content) if content is not None else None
+    if sections is None:
+        print("Ошибка API: Ответ объединённого запроса не удалось разобрать, разделы будут запрошены отдельно")
+        return False
+    
+    for kind, cache_key in cache_keys.items():
+        await async_runtime.to_thread(_response_cache.set, cache_key, sections[kind])
+    
+    return True
+
+def _parse_combined(content):
+    """
+    Разбирает ответ объединённого запроса
+    
+    Модель может обернуть JSON в блок кода или добавить текст вокруг него,
+    в том числе с фигурными скобками, поэтому JSON-объект ищется с каждой
+    открывающей скобки по очереди, пока не найдётся объект со всеми
+    разделами.
+    
+    Args:
+        content (str): Ответ API
+        
+    Returns:
+        dict: Тексты разделов или None, если ответ не соответствует формату
+    """
+    decoder = json.JSONDecoder()
+    start = content.find("{")
+    while start != -1:
+        try:
+            data, _ = decoder.raw_decode(content, start)
+        except ValueError:
+            data = None
+        sections = _get_sections(data)
+        if sections is not None:
+            return sections
+        start = content.find("{", start + 1)
     
-    return _make_api_request(prompt)
+    return None
 
-def _make_api_request(prompt):
+def _get_sections(data):
+    """Возвращает тексты разделов из разобранного JSON или None, если какого-то раздела нет"""
+    if not isinstance(data, dict):
+        return None
+    
+    sections = {}
+    for kind in COMBINED_KINDS:
+        text = data.get(kind)
+        if not isinstance(text, str) or not text.strip():
+            return None
+        sections[kind] = text.strip()
+    
+    return sections
+
+async def _make_api_request(prompt, cache_key=None):
     """
     Отправляет запрос к Perplexity API
     
+    Если указан ключ кэша, ответ сначала ищется в постоянном кэше, а
+    одновременные запросы с одинаковым ключом объединяются в один вызов API.
+    
     Args:
         prompt (str): Текст запроса
+        cache_key (str): Ключ кэша ответа
         
     Returns:
         str: Ответ от API
     """
+    try:
+        if cache_key is None:
+            content = await _request_completion(prompt)
+        else:
+            content = await async_runtime.to_thread(_response_cache.get, cache_key)
+            if content is None:
+                content = await _in_flight.do(cache_key, _request_and_cache, prompt, cache_key)
+    except requests.exceptions.RequestException as e:
+        print(f"Ошибка при запросе к API: {e}")
+        return CONNECTION_ERROR_TEXT
+    
+    if content is None:
+        return UNAVAILABLE_TEXT
+    
+    return content
+
+async def _stream_api_request(prompt, cache_key):
+    """
+    Отправляет потоковый запрос к Perplexity API и сохраняет полный ответ в кэш
+    
+    Если поток оборвался на середине, последним отдаётся полученный текст
+    с припиской INTERRUPTED_TEXT, а в кэш он не сохраняется.
+    
+    Args:
+        prompt (str): Текст запроса
+        cache_key (str): Ключ кэша ответа
+        
+    Yields:
+        str: Ответ, накопленный к текущему моменту
+    """
+    content = await async_runtime.to_thread(_response_cache.get, cache_key)
+    if content is None and _in_flight.in_flight(cache_key):
+        # Этот же текст уже генерируется - дожидаемся его, а не запускаем второй запрос
+        content = await _make_api_request(prompt, cache_key)
+    if content is not None:
+        yield content
+        return
+    
+    text = ""
+    try:
+        async for delta in _stream_completion(prompt, _get_kind(cache_key) + "_stream"):
+            text += delta
+            yield text
+    except requests.exceptions.RequestException as e:
+        print(f"Ошибка при запросе к API: {e}")
+        yield text + INTERRUPTED_TEXT if text else CONNECTION_ERROR_TEXT
+        return
+    
+    if text:
+        await async_runtime.to_thread(_response_cache.set, cache_key, text)
+    else:
+        yield UNAVAILABLE_TEXT
+
+async def _request_and_cache(prompt, cache_key, refresh_before=0):
+    """
+    Запрашивает ответ у API и сохраняет его в кэш
+    
+    Args:
+        prompt (str): Текст запроса
+        cache_key (str): Ключ кэша ответа
+        refresh_before (float): За сколько секунд до истечения срока обновлять запись
+        
+    Returns:
+        str: Ответ от API или None, если ответ не удалось разобрать
+    """
+    # Пока ожидали своей очереди, ответ мог появиться в кэше
+    if await _is_fresh(cache_key, refresh_before):
+        content = await async_runtime.to_thread(_response_cache.get, cache_key)
+        if content is not None:
+            return content
+    
+    content = await _request_completion(prompt, _get_kind(cache_key))
+    if content is not None:
+        await async_runtime.to_thread(_response_cache.set, cache_key, content)
+    
+    return content
+
+async def _request_completion(prompt, operation="completion", max_tokens=MAX_TOKENS):
+    """
+    Выполняет запрос к Perplexity API
+    
+    Args:
+        prompt (str): Текст запроса
+        operation (str): Тип запроса для метрик
+        max_tokens (int): Ограничение длины ответа
+        
+    Returns:
+        str: Ответ от API или None, если ответ не удалось разобрать
+        
+    Raises:
+        requests.exceptions.RequestException: При ошибке соединения
+    """
+    response = await http_client.post_async(API_URL, endpoint="perplexity", operation=operation, **_build_request(prompt, max_tokens=max_tokens))
+    response.raise_for_status()
+    result = response.json()
+    
+    if "choices" in result and len(result["choices"]) > 0:
+        return result["choices"][0]["message"]["content"]
+    
+    print("Ошибка API: Неожиданный формат ответа")
+    return None
+
+async def _stream_completion(prompt, operation="completion_stream"):
+    """
+    Выполняет потоковый запрос к Perplexity API
+    
+    Args:
+        prompt (str): Текст запроса
+        operation (str): Тип запроса для метрик
+        
+    Yields:
+        str: Очередные фрагменты ответа
+        
+    Raises:
+        requests.exceptions.RequestException: При ошибке соединения
+    """
+    response = await http_client.post_async(API_URL, endpoint="perplexity", operation=operation, stream=True, **_build_request(prompt, stream=True))
+    async with response:
+        response.raise_for_status()
+        
+        # Ответ приходит в формате server-sent events: строки "data: {...}"
+        async for line in response.iter_lines():
+            if not line or not line.startswith("data:"):
+                continue
+            
+            payload = line[len("data:"):].strip()
+            if payload == "[DONE]":
+                break
+            
+            try:
+                choices = json.loads(payload).get("choices") or [{}]
+            except ValueError:
+                print("Ошибка API: Неожиданный формат фрагмента ответа")
+                continue
+            
+            delta = choices[0].get("delta", {}).get("content")
+            if delta:
+                yield delta
+
+def _build_request(prompt, stream=False, max_tokens=MAX_TOKENS):
+    """
+    Формирует заголовки и тело запроса к Perplexity API
+    
+    Args:
+        prompt (str): Текст запроса
+        stream (bool): Получать ответ по частям
+        max_tokens (int): Ограничение длины ответа
+        
+    Returns:
+        dict: Параметры headers и json для HTTP-запроса
+    """
     headers = {
         "Authorization": f"Bearer {API_KEY}",
         "Content-Type": "application/json"
@@ -74,23 +556,12 @@ def _make_api_request(prompt):
     data = {
         "model": "pplx-7b-online",
         "messages": [
-            {"role": "system", "content": "Ты - информативный ассистент по туризму и достопримечательностям. Отвечай детально и точно о местах, их истории и культурном значении. Отвечай только на русском языке."},
+            {"role": "system", "content": SYSTEM_PROMPT},
             {"role": "user", "content": prompt}
         ],
-        "max_tokens": 500
+        "max_tokens": max_tokens
     }
+    if stream:
+        data["stream"] = True
     
-    try:
-        response = requests.post(API_URL, headers=headers, json=data)
-        response.raise_for_status()
-        result = response.json()
-        
-        if "choices" in result and len(result["choices"]) > 0:
-            return result["choices"][0]["message"]["content"]
-        else:
-            print("Ошибка API: Неожиданный формат ответа")
-            return "Не удалось получить информацию."
-            
-    except requests.exceptions.RequestException as e:
-        print(f"Ошибка при запросе к API: {e}")
-        return "Не удалось получить информацию из-за ошибки соединения." 
\ No newline at end of file
+    return {"headers": headers, "json": data}
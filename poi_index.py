@@ -0,0 +1,222 @@
+import csv
+import json
+import math
+import logging
+from collections import Counter
+import numpy as np
+from geo import geohash_encode, geohash_bounds, distances_from, meters_to_degrees
+
+logger = logging.getLogger(__name__)
+
+# Точность ячеек индекса (6 - ячейка около 1.2x0.6 км)
+INDEX_PRECISION = 6
+
+# Собственный бит в маске получают самые частые типы; остальные отмечаются
+# общим битом и хранятся у записи отдельным множеством (маска - int64)
+MAX_TYPE_BITS = 62
+OTHER_TYPES_BIT = 1 << MAX_TYPE_BITS
+
+class POIIndex:
+    """
+    Локальный пространственный индекс достопримечательностей
+
+    Точки раскладываются по ячейкам geohash и хранятся в плотных массивах,
+    отсортированных по ячейке: для каждой ячейки известен срез массивов,
+    поэтому запрос читает только несколько соседних срезов.
+    """
+
+    def __init__(self, records, precision=INDEX_PRECISION):
+        """
+        Args:
+            records (list): Записи вида {"id", "name", "lat", "lng", "address", "types"}
+            precision (int): Точность ячеек geohash
+        """
+        self.precision = precision
+
+        cells = [geohash_encode(record["lat"], record["lng"], precision) for record in records]
+        order = sorted(range(len(records)), key=cells.__getitem__)
+
+        # Словарь типов: у каждой записи битовая маска типов вместо списка строк
+        type_counts = Counter(place_type for record in records for place_type in set(record["types"]))
+        self._type_bits = {
+            place_type: 1 << bit for bit, (place_type, _) in enumerate(type_counts.most_common(MAX_TYPE_BITS))
+        }
+
+        self._lats = np.array([records[i]["lat"] for i in order], dtype=np.float64)
+        self._lngs = np.array([records[i]["lng"] for i in order], dtype=np.float64)
+        self._masks = np.array([self._get_record_mask(records[i]["types"]) for i in order], dtype=np.int64)
+        # Типы без собственного бита (None, если у записи таких нет)
+        self._other_types = [self._get_other_types(records[i]["types"]) for i in order]
+        self._ids = [records[i]["id"] for i in order]
+        self._names = [records[i]["name"] for i in order]
+        self._addresses = [records[i]["address"] for i in order]
+
+        # Срезы массивов для каждой ячейки
+        self._buckets = {}
+        for position, i in enumerate(order):
+            start, _ = self._buckets.get(cells[i], (position, position))
+            self._buckets[cells[i]] = (start, position + 1)
+
+        # Размер ячейки в градусах (одинаков для всех ячеек одной точности)
+        min_lat, min_lng, max_lat, max_lng = geohash_bounds(geohash_encode(0, 0, precision))
+        self._cell_size = (max_lat - min_lat, max_lng - min_lng)
+
+    def __len__(self):
+        return len(self._ids)
+
+    @classmethod
+    def load(cls, path, precision=INDEX_PRECISION):
+        """
+        Загружает индекс из выгрузки в формате JSONL или CSV
+
+        Поддерживаются поля id, name, lat, lng (или lon), address и types
+        (список или строка с типами через ";").
+
+        Args:
+            path (str): Путь к файлу выгрузки
+            precision (int): Точность ячеек geohash
+
+        Returns:
+            POIIndex: Построенный индекс
+        """
+        with open(path, encoding="utf-8", newline="") as f:
+            if path.endswith(".csv"):
+                rows = list(csv.DictReader(f))
+            else:
+                rows = [json.loads(line) for line in f if line.strip()]
+
+        records = []
+        for row in rows:
+            try:
+                records.append(_normalize_record(row))
+            except (KeyError, TypeError, ValueError) as e:
+                logger.warning("Пропущена некорректная запись %s: %s", row.get("id"), e)
+
+        logger.info("Загружено %d мест из %s", len(records), path)
+        return cls(records, precision)
+
+    def covers(self, latitude, longitude, radius):
+        """
+        Проверяет, что все ячейки, пересекающие круг поиска, есть в индексе
+
+        Args:
+            latitude (float): Широта центра круга
+            longitude (float): Долгота центра круга
+            radius (int): Радиус в метрах
+
+        Returns:
+            bool: True, если запрос можно обслужить из индекса
+        """
+        return all(cell in self._buckets for cell in self._get_cells(latitude, longitude, radius))
+
+    def query(self, latitude, longitude, radius, types=None, limit=20):
+        """
+        Находит места внутри круга
+
+        Args:
+            latitude (float): Широта центра круга
+            longitude (float): Долгота центра круга
+            radius (int): Радиус в метрах
+            types (list): Типы мест (записи без типов подходят под любой запрос)
+            limit (int): Максимальное количество результатов
+
+        Returns:
+            list: Места в формате yandex_api, от ближайшего к дальнему
+        """
+        slices = [self._buckets[cell] for cell in self._get_cells(latitude, longitude, radius) if cell in self._buckets]
+        if not slices:
+            return []
+
+        positions = np.concatenate([np.arange(start, end) for start, end in slices])
+        if types:
+            mask = self._get_mask(types)
+            record_masks = self._masks[positions]
+            matches = (record_masks == 0) | ((record_masks & mask) != 0)
+            other_types = self._get_other_types(types)
+            if other_types:
+                # Редкие типы проверяем по множествам только у записей с общим битом
+                for i in np.flatnonzero(~matches & ((record_masks & OTHER_TYPES_BIT) != 0)):
+                    matches[i] = not self._other_types[positions[i]].isdisjoint(other_types)
+            positions = positions[matches]
+
+        distances = distances_from(latitude, longitude, self._lats[positions], self._lngs[positions])
+        inside = distances <= radius
+        positions = positions[inside]
+        distances = distances[inside]
+
+        places = []
+        for i in np.argsort(distances, kind="stable")[:limit]:
+            position = positions[i]
+            place = {
+                "place_id": self._ids[position],
+                "name": self._names[position],
+                "geometry": {
+                    "location": {
+                        "lat": float(self._lats[position]),
+                        "lng": float(self._lngs[position])
+                    }
+                },
+                "distance": float(distances[i])
+            }
+            if self._addresses[position]:
+                place["vicinity"] = self._addresses[position]
+            places.append(place)
+
+        return places
+
+    def _get_cells(self, latitude, longitude, radius):
+        """Возвращает ячейки geohash, пересекающие описанный вокруг круга квадрат"""
+        lat_margin, lng_margin = meters_to_degrees(radius, latitude)
+        cell_lat, cell_lng = self._cell_size
+        lat_steps = math.ceil(2 * lat_margin / cell_lat) + 1
+        lng_steps = math.ceil(2 * lng_margin / cell_lng) + 1
+
+        cells = set()
+        for i in range(lat_steps + 1):
+            lat = min(latitude - lat_margin + i * cell_lat, latitude + lat_margin)
+            for j in range(lng_steps + 1):
+                lng = min(longitude - lng_margin + j * cell_lng, longitude + lng_margin)
+                cells.add(geohash_encode(lat, lng, self.precision))
+        return cells
+
+    def _get_mask(self, types):
+        """Переводит список типов в битовую маску (типы без собственного бита не учитываются)"""
+        mask = 0
+        for place_type in types:
+            mask |= self._type_bits.get(place_type, 0)
+        return mask
+
+    def _get_record_mask(self, types):
+        """Битовая маска типов записи: редкие типы отмечаются общим битом"""
+        mask = 0
+        for place_type in types:
+            mask |= self._type_bits.get(place_type, OTHER_TYPES_BIT)
+        return mask
+
+    def _get_other_types(self, types):
+        """Возвращает типы без собственного бита или None"""
+        other_types = frozenset(place_type for place_type in types if place_type not in self._type_bits)
+        return other_types or None
+
+def _normalize_record(row):
+    """
+    Приводит строку выгрузки к единому формату
+
+    Args:
+        row (dict): Строка JSONL или CSV
+
+    Returns:
+        dict: Запись с полями id, name, lat, lng, address, types
+    """
+    types = row.get("types") or []
+    if isinstance(types, str):
+        types = [place_type.strip() for place_type in types.split(";") if place_type.strip()]
+
+    return {
+        "id": str(row["id"]),
+        "name": row["name"],
+        "lat": float(row["lat"]),
+        "lng": float(row["lng"] if "lng" in row else row["lon"]),
+        "address": row.get("address") or "",
+        "types": list(types),
+    }
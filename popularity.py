@@ -0,0 +1,111 @@
+import os
+import time
+import logging
+import threading
+from dotenv import load_dotenv
+from cache import connect_sqlite
+from geo import geohash_encode
+
+# Загружаем переменные окружения
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Файл статистики открытий мест
+POPULARITY_PATH = os.getenv("POPULARITY_PATH", "popularity.sqlite3")
+
+# Точность ячейки geohash, задающей район (5 - около 5x5 км)
+AREA_PRECISION = 5
+
+class PopularityTracker:
+    """
+    Статистика открытий карточек мест по районам
+
+    Счётчики затухают при каждом вызове decay, поэтому в топ попадают
+    места, популярные в последние дни, а не за всё время. Данные хранятся
+    в SQLite и общие для всех процессов бота.
+    """
+
+    def __init__(self, path=POPULARITY_PATH):
+        """
+        Args:
+            path (str): Путь к файлу базы данных
+        """
+        self._lock = threading.Lock()
+        self._connection = connect_sqlite(path)
+        with self._lock, self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS places ("
+                "place_id TEXT PRIMARY KEY, name TEXT NOT NULL, address TEXT NOT NULL, "
+                "lat REAL NOT NULL, lng REAL NOT NULL, area TEXT NOT NULL, "
+                "opens REAL NOT NULL, last_opened REAL NOT NULL)"
+            )
+            self._connection.execute("CREATE INDEX IF NOT EXISTS places_area ON places (area, opens)")
+            self._connection.execute("CREATE TABLE IF NOT EXISTS runs (name TEXT PRIMARY KEY)")
+
+    def record(self, place):
+        """
+        Учитывает открытие карточки места
+
+        Args:
+            place (session_store.Place): Открытое место
+        """
+        if not place.place_id:
+            return
+
+        area = geohash_encode(place.lat, place.lng, AREA_PRECISION)
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT INTO places (place_id, name, address, lat, lng, area, opens, last_opened) "
+                "VALUES (?, ?, ?, ?, ?, ?, 1, ?) "
+                "ON CONFLICT (place_id) DO UPDATE SET "
+                "name = excluded.name, address = excluded.address, lat = excluded.lat, lng = excluded.lng, "
+                "area = excluded.area, opens = opens + 1, last_opened = excluded.last_opened",
+                (place.place_id, place.name, place.address, place.lat, place.lng, area, time.time())
+            )
+
+    def top(self, per_area, min_opens=0):
+        """
+        Возвращает самые популярные места каждого района
+
+        Args:
+            per_area (int): Количество мест на район
+            min_opens (float): Минимальный счётчик открытий
+
+        Returns:
+            list: Записи (place_id, name, address, lat, lng) от самых популярных
+        """
+        with self._lock:
+            return self._connection.execute(
+                "SELECT place_id, name, address, lat, lng FROM ("
+                "SELECT *, ROW_NUMBER() OVER (PARTITION BY area ORDER BY opens DESC) AS position "
+                "FROM places WHERE opens >= ?"
+                ") WHERE position <= ? ORDER BY opens DESC",
+                (min_opens, per_area)
+            ).fetchall()
+
+    def decay(self, factor, min_opens=0.05):
+        """
+        Уменьшает счётчики и удаляет давно не открывавшиеся места
+
+        Args:
+            factor (float): Множитель счётчиков (например, 0.5 - половина за период)
+            min_opens (float): Места с меньшим счётчиком удаляются
+        """
+        with self._lock, self._connection:
+            self._connection.execute("UPDATE places SET opens = opens * ?", (factor,))
+            self._connection.execute("DELETE FROM places WHERE opens < ?", (min_opens,))
+
+    def claim_run(self, name):
+        """
+        Отмечает запуск периодической задачи, чтобы её не выполнили другие процессы
+
+        Args:
+            name (str): Уникальное имя запуска (например, с датой)
+
+        Returns:
+            bool: True, если запуск ещё не был отмечен
+        """
+        with self._lock, self._connection:
+            cursor = self._connection.execute("INSERT OR IGNORE INTO runs (name) VALUES (?)", (name,))
+            return cursor.rowcount == 1
@@ -0,0 +1,100 @@
+import heapq
+import logging
+import itertools
+from concurrent.futures import Future
+import async_runtime
+
+logger = logging.getLogger(__name__)
+
+class PrefetchScheduler:
+    """
+    Фоновый планировщик упреждающих запросов с приоритетами
+
+    Задачи - корутины, которые выполняются в общем цикле событий не больше
+    workers одновременно. Задачи группируются (например, по пользователю),
+    чтобы их можно было отменить, когда пользователь перешёл к другому
+    месту. Меньшее значение приоритета означает более раннее выполнение.
+
+    Все методы, кроме pending, вызываются только из цикла событий.
+    """
+
+    def __init__(self, workers=2):
+        """
+        Args:
+            workers (int): Количество одновременно выполняемых задач
+        """
+        self.workers = workers
+        self._heap = []
+        self._counter = itertools.count()
+        self._groups = {}
+        self._running = 0
+
+    def submit(self, group, key, func, *args, priority=10, **kwargs):
+        """
+        Ставит задачу в очередь
+
+        Args:
+            group: Группа задачи (например, идентификатор пользователя)
+            key: Ключ задачи внутри группы
+            func (callable): Выполняемая корутина
+            priority (int): Приоритет (меньше - раньше)
+
+        Returns:
+            concurrent.futures.Future: Результат задачи
+        """
+        future = Future()
+        self._groups.setdefault(group, {})[key] = future
+        heapq.heappush(self._heap, (priority, next(self._counter), group, key, future, func, args, kwargs))
+        if self._running < self.workers:
+            self._running += 1
+            async_runtime.spawn(self._worker())
+        return future
+
+    def get(self, group, key):
+        """
+        Возвращает задачу группы по ключу
+
+        Returns:
+            concurrent.futures.Future: Результат задачи или None, если задачи нет
+        """
+        return self._groups.get(group, {}).get(key)
+
+    def cancel(self, group):
+        """
+        Отменяет все ещё не начатые задачи группы
+
+        Уже выполняющиеся задачи доводятся до конца: их результат
+        остаётся в кэшах и может пригодиться позже.
+
+        Args:
+            group: Группа задач
+        """
+        futures = self._groups.pop(group, {})
+        for future in futures.values():
+            future.cancel()
+
+    def pending(self):
+        """Возвращает количество задач в очереди"""
+        return len(self._heap)
+
+    async def _worker(self):
+        """Выполняет задачи в порядке приоритета, пока очередь не опустеет"""
+        try:
+            while self._heap:
+                _, _, group, key, future, func, args, kwargs = heapq.heappop(self._heap)
+                if not future.set_running_or_notify_cancel():
+                    continue
+
+                try:
+                    future.set_result(await func(*args, **kwargs))
+                except Exception as e:
+                    logger.warning("Ошибка фоновой задачи %s: %s", key, e)
+                    future.set_exception(e)
+                finally:
+                    tasks = self._groups.get(group)
+                    if tasks is not None and tasks.get(key) is future:
+                        del tasks[key]
+                        if not tasks:
+                            del self._groups[group]
+        finally:
+            self._running -= 1
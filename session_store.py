@@ -0,0 +1,353 @@
+import os
+import time
+import pickle
+import logging
+import threading
+from collections import OrderedDict
+from dotenv import load_dotenv
+import async_runtime
+from cache import connect_sqlite
+
+# Загружаем переменные окружения
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Настройки хранилища сессий
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "memory")
+SESSION_IDLE_TTL = int(os.getenv("SESSION_IDLE_TTL", "3600"))
+SESSION_MAX_BYTES = int(os.getenv("SESSION_MAX_BYTES", str(64 * 1024 * 1024)))
+SESSION_SQLITE_PATH = os.getenv("SESSION_SQLITE_PATH", "sessions.sqlite3")
+SESSION_REDIS_URL = os.getenv("SESSION_REDIS_URL", "redis://localhost:6379/0")
+
+class Place:
+    """
+    Компактная запись о найденном месте
+
+    Вместо вложенных словарей хранит только поля, нужные боту, и
+    сериализуется в кортеж.
+    """
+
+    __slots__ = ("place_id", "name", "lat", "lng", "address", "distance")
+
+    def __init__(self, place_id, name, lat, lng, address="", distance=0.0):
+        self.place_id = place_id
+        self.name = name
+        self.lat = lat
+        self.lng = lng
+        self.address = address
+        self.distance = distance
+
+    @classmethod
+    def from_record(cls, record):
+        """
+        Создаёт запись из места в формате yandex_api
+
+        Args:
+            record (dict): Место из get_nearby_places или get_place_details
+
+        Returns:
+            Place: Компактная запись
+        """
+        location = record["geometry"]["location"]
+        return cls(
+            record.get("place_id", ""),
+            record["name"],
+            location["lat"],
+            location["lng"],
+            record.get("formatted_address") or record.get("vicinity", ""),
+            record.get("distance", 0.0)
+        )
+
+    @property
+    def coordinates(self):
+        """Координаты места (широта, долгота)"""
+        return (self.lat, self.lng)
+
+    def __reduce__(self):
+        return (Place, (self.place_id, self.name, self.lat, self.lng, self.address, self.distance))
+
+    def __repr__(self):
+        return f"Place({self.place_id!r}, {self.name!r})"
+
+class MemoryBackend:
+    """
+    Хранилище сессий в памяти процесса с вытеснением по LRU при превышении лимита памяти
+    """
+
+    # Обращения не блокируют поток надолго, и их можно выполнять прямо в цикле событий
+    blocking = False
+
+    def __init__(self, max_bytes=SESSION_MAX_BYTES):
+        """
+        Args:
+            max_bytes (int): Лимит суммарного размера сериализованных сессий
+        """
+        self.max_bytes = max_bytes
+        self._data = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def load(self, user_id, idle_ttl):
+        with self._lock:
+            entry = self._data.get(user_id)
+            if entry is None:
+                return None
+            if entry[0] + idle_ttl <= time.monotonic():
+                self._remove(user_id)
+                return None
+            # Чтение продлевает сессию, как и запись: порядок словаря совпадает с порядком времени обращения
+            self._data[user_id] = (time.monotonic(), entry[1])
+            self._data.move_to_end(user_id)
+            return entry[1]
+
+    def store(self, user_id, data, idle_ttl):
+        with self._lock:
+            self._remove(user_id)
+            self._data[user_id] = (time.monotonic(), data)
+            self._bytes += len(data)
+            self._evict(idle_ttl)
+
+    def delete(self, user_id):
+        with self._lock:
+            self._remove(user_id)
+
+    def stats(self):
+        with self._lock:
+            return len(self._data), self._bytes
+
+    def _remove(self, user_id):
+        entry = self._data.pop(user_id, None)
+        if entry is not None:
+            self._bytes -= len(entry[1])
+
+    def _evict(self, idle_ttl):
+        """Удаляет простаивающие сессии и самые давние при превышении лимита памяти"""
+        deadline = time.monotonic() - idle_ttl
+        while self._data:
+            user_id, (touched, _) = next(iter(self._data.items()))
+            if touched > deadline and self._bytes <= self.max_bytes:
+                break
+            self._remove(user_id)
+
+class SQLiteBackend:
+    """
+    Хранилище сессий в базе SQLite, общее для перезапусков процесса
+    """
+
+    blocking = True
+
+    def __init__(self, path=SESSION_SQLITE_PATH, max_bytes=SESSION_MAX_BYTES):
+        """
+        Args:
+            path (str): Путь к файлу базы данных
+            max_bytes (int): Лимит суммарного размера сериализованных сессий
+        """
+        self.max_bytes = max_bytes
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._connection = connect_sqlite(path)
+        with self._lock, self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "user_id INTEGER PRIMARY KEY, data BLOB NOT NULL, touched REAL NOT NULL)"
+            )
+            self._connection.execute("CREATE INDEX IF NOT EXISTS sessions_touched ON sessions (touched)")
+
+    def load(self, user_id, idle_ttl):
+        with self._lock, self._connection:
+            row = self._connection.execute(
+                "SELECT data FROM sessions WHERE user_id = ? AND touched > ?",
+                (user_id, time.time() - idle_ttl)
+            ).fetchone()
+            if row is None:
+                return None
+            self._connection.execute("UPDATE sessions SET touched = ? WHERE user_id = ?", (time.time(), user_id))
+            return row[0]
+
+    def store(self, user_id, data, idle_ttl):
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO sessions (user_id, data, touched) VALUES (?, ?, ?)",
+                (user_id, data, time.time())
+            )
+            # Очистку выполняем не на каждой записи, чтобы не замедлять обработчики
+            self._writes += 1
+            if self._writes % 100 == 0:
+                self._evict(idle_ttl)
+
+    def delete(self, user_id):
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM sessions WHERE user_id = ?", (user_id,))
+
+    def stats(self):
+        with self._lock:
+            count, total = self._connection.execute(
+                "SELECT COUNT(*), COALESCE(SUM(LENGTH(data)), 0) FROM sessions"
+            ).fetchone()
+            return count, total
+
+    def _evict(self, idle_ttl):
+        """Удаляет простаивающие сессии и самые давние при превышении лимита"""
+        self._connection.execute("DELETE FROM sessions WHERE touched <= ?", (time.time() - idle_ttl,))
+        total = self._connection.execute("SELECT COALESCE(SUM(LENGTH(data)), 0) FROM sessions").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        excess = total - self.max_bytes
+        for user_id, size in self._connection.execute(
+            "SELECT user_id, LENGTH(data) FROM sessions ORDER BY touched"
+        ).fetchall():
+            if excess <= 0:
+                break
+            self._connection.execute("DELETE FROM sessions WHERE user_id = ?", (user_id,))
+            excess -= size
+
+class RedisBackend:
+    """
+    Хранилище сессий в Redis или совместимом с ним сервере
+
+    Время простоя задаётся через EXPIRE, а лимит памяти - настройками
+    самого сервера (maxmemory и maxmemory-policy allkeys-lru).
+    """
+
+    blocking = True
+
+    def __init__(self, url=SESSION_REDIS_URL, prefix="session:"):
+        """
+        Args:
+            url (str): Адрес сервера
+            prefix (str): Префикс ключей сессий
+        """
+        try:
+            import redis
+        except ImportError:
+            raise ImportError("Для SESSION_BACKEND=redis установите пакет redis")
+
+        self.prefix = prefix
+        self._client = redis.Redis.from_url(url)
+
+    def load(self, user_id, idle_ttl):
+        key = f"{self.prefix}{user_id}"
+        pipeline = self._client.pipeline()
+        pipeline.get(key)
+        pipeline.expire(key, idle_ttl)
+        data, _ = pipeline.execute()
+        return data
+
+    def store(self, user_id, data, idle_ttl):
+        self._client.set(f"{self.prefix}{user_id}", data, ex=idle_ttl)
+
+    def delete(self, user_id):
+        self._client.delete(f"{self.prefix}{user_id}")
+
+    def stats(self):
+        count = 0
+        total = 0
+        for key in self._client.scan_iter(f"{self.prefix}*"):
+            count += 1
+            total += self._client.strlen(key)
+        return count, total
+
+class SessionStore:
+    """
+    Хранилище сессий пользователей с ограничением времени простоя
+
+    Сессия - словарь, который сериализуется при сохранении, поэтому
+    после изменения её нужно явно сохранить методом save.
+    """
+
+    def __init__(self, backend, idle_ttl=SESSION_IDLE_TTL):
+        """
+        Args:
+            backend: Хранилище сериализованных сессий
+            idle_ttl (int): Время простоя в секундах, после которого сессия удаляется
+        """
+        self.backend = backend
+        self.idle_ttl = idle_ttl
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        """
+        Возвращает сессию пользователя
+
+        Returns:
+            dict: Сессия или None, если её нет или она устарела
+        """
+        data = self.backend.load(user_id, self.idle_ttl)
+        return pickle.loads(data) if data is not None else None
+
+    def save(self, user_id, session):
+        """Сохраняет сессию пользователя"""
+        self.backend.store(user_id, pickle.dumps(session, pickle.HIGHEST_PROTOCOL), self.idle_ttl)
+
+    async def get_async(self, user_id):
+        """
+        Асинхронная версия get для обработчиков в цикле событий
+
+        Обращение к базе данных или серверу выполняется в пуле потоков,
+        чтобы не останавливать цикл событий.
+        """
+        if not self.backend.blocking:
+            return self.get(user_id)
+        return await async_runtime.to_thread(self.get, user_id)
+
+    async def save_async(self, user_id, session):
+        """Асинхронная версия save для обработчиков в цикле событий"""
+        if not self.backend.blocking:
+            return self.save(user_id, session)
+        return await async_runtime.to_thread(self.save, user_id, session)
+
+    def update(self, user_id, func):
+        """
+        Атомарно (в пределах процесса) изменяет сессию
+
+        Args:
+            user_id (int): Идентификатор пользователя
+            func (callable): Функция, изменяющая словарь сессии
+
+        Returns:
+            bool: False, если сессии нет
+        """
+        with self._lock:
+            session = self.get(user_id)
+            if session is None:
+                return False
+            func(session)
+            self.save(user_id, session)
+            return True
+
+    def delete(self, user_id):
+        """Удаляет сессию пользователя"""
+        self.backend.delete(user_id)
+
+    def stats(self):
+        """
+        Возвращает метрики использования памяти
+
+        Returns:
+            dict: Количество сессий, суммарный и средний размер в байтах
+        """
+        count, total = self.backend.stats()
+        return {
+            "sessions": count,
+            "bytes": total,
+            "bytes_per_session": total / count if count else 0,
+        }
+
+def create_session_store():
+    """
+    Создаёт хранилище сессий по настройкам из переменных окружения
+
+    Returns:
+        SessionStore: Хранилище сессий
+    """
+    if SESSION_BACKEND == "sqlite":
+        backend = SQLiteBackend()
+    elif SESSION_BACKEND == "redis":
+        backend = RedisBackend()
+    else:
+        backend = MemoryBackend()
+
+    logger.info("Хранилище сессий: %s", SESSION_BACKEND)
+    return SessionStore(backend)
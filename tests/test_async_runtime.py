@@ -0,0 +1,67 @@
+import time
+import asyncio
+import async_runtime
+
+class FakeUser:
+    def __init__(self, user_id):
+        self.id = user_id
+
+class FakeUpdate:
+    def __init__(self, user_id, number, delay):
+        self.effective_user = FakeUser(user_id)
+        self.effective_chat = None
+        self.update_id = number
+        self.number = number
+        self.delay = delay
+
+class FakeDispatcher:
+    def __init__(self):
+        self.errors = []
+
+    def dispatch_error(self, update, error):
+        self.errors.append((update.number, error))
+
+class FakeContext:
+    def __init__(self):
+        self.dispatcher = FakeDispatcher()
+
+def test_handlers_serialized_per_user():
+    events = []
+
+    async def handle(update, context):
+        events.append(("start", update.number, time.monotonic()))
+        await asyncio.sleep(update.delay)
+        events.append(("end", update.number, time.monotonic()))
+
+    callback = async_runtime.handler(handle, "STATE")
+    context = FakeContext()
+    # Первое обновление пользователя 1 выполняется дольше остальных
+    updates = [FakeUpdate(1001, 1, 0.2), FakeUpdate(1001, 2, 0.01), FakeUpdate(1002, 3, 0.05)]
+    assert [callback(update, context) for update in updates] == ["STATE"] * 3
+    async_runtime.drain(timeout=5)
+
+    at = {(kind, number): moment for kind, number, moment in events}
+    # Обновления одного пользователя - по очереди и в порядке получения
+    assert at[("start", 2)] >= at[("end", 1)]
+    # Другой пользователь не ждёт, пока обработается первый
+    assert at[("start", 3)] < at[("end", 1)]
+    assert at[("end", 3)] < at[("end", 1)]
+    assert async_runtime._handler_queues == {}
+
+def test_handler_error_does_not_block_user_queue():
+    handled = []
+
+    async def handle(update, context):
+        await asyncio.sleep(update.delay)
+        if update.number == 1:
+            raise ValueError("сбой обработчика")
+        handled.append(update.number)
+
+    callback = async_runtime.handler(handle)
+    context = FakeContext()
+    for update in (FakeUpdate(1003, 1, 0.05), FakeUpdate(1003, 2, 0.0)):
+        assert callback(update, context) is None
+    async_runtime.join(1003, timeout=5)
+
+    assert handled == [2]
+    assert [(number, str(error)) for number, error in context.dispatcher.errors] == [(1, "сбой обработчика")]
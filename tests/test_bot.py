@@ -0,0 +1,227 @@
+import html
+import asyncio
+import pytest
+import async_runtime
+import bot
+import perplexity_api
+from session_store import Place
+
+CENTER = (55.7539, 37.6208)
+
+def make_record(i, offset):
+    return {
+        "place_id": str(i),
+        "name": f"Место {i}",
+        "geometry": {"location": {"lat": CENTER[0] + offset, "lng": CENTER[1]}},
+        "distance": offset * 111000,
+    }
+
+class FakeSearch:
+    """Подменяет get_nearby_places_async: отдаёт первые limit мест из records"""
+
+    def __init__(self, records):
+        self.records = records
+        self.limits = []
+
+    async def search(self, latitude, longitude, radius, types=None, limit=20, fetch_more=False, expand_radii=()):
+        assert fetch_more
+        self.limits.append(limit)
+        return self.records[:limit]
+
+@pytest.fixture
+def nearby(monkeypatch):
+    fake = FakeSearch([])
+    monkeypatch.setattr(bot, "get_nearby_places_async", fake.search)
+    return fake
+
+def make_user_data(places):
+    return {
+        "location": {"latitude": CENTER[0], "longitude": CENTER[1]},
+        "radius": 1000,
+        "interests": [],
+        "places": places,
+    }
+
+def load_more(user_data):
+    return async_runtime.run(bot._load_more_places(user_data), timeout=5)
+
+def test_load_more_places_pages_until_results_run_out(nearby, monkeypatch):
+    monkeypatch.setattr(bot, "PLACES_BATCH_SIZE", 3)
+    nearby.records = [make_record(i, 0.0001 * i) for i in range(7)]
+    user_data = make_user_data([Place.from_record(record) for record in nearby.records[:2]])
+
+    assert [place.place_id for place in load_more(user_data)] == ["2", "3", "4"]
+    assert user_data["places_complete"] is False
+    assert [place.place_id for place in load_more(user_data)] == ["5", "6"]
+    assert user_data["places_complete"] is True
+    assert [place.place_id for place in user_data["places"]] == [str(i) for i in range(7)]
+    assert nearby.limits == [5, 8]
+
+def test_load_more_places_skips_shown_places(nearby):
+    shown = [make_record(1, 0.002), make_record(2, 0.003)]
+    # В догруженной выдаче новое место оказалось ближе уже показанных
+    nearby.records = [make_record(3, 0.001)] + shown + [make_record(4, 0.004)]
+    user_data = make_user_data([Place.from_record(record) for record in shown])
+
+    assert [place.place_id for place in load_more(user_data)] == ["3", "4"]
+    assert [place.place_id for place in user_data["places"]] == ["1", "2", "3", "4"]
+    assert user_data["places_complete"] is True
+
+def test_load_more_places_stops_without_new_places(nearby):
+    nearby.records = [make_record(i, 0.0001 * i) for i in range(3)]
+    user_data = make_user_data([Place.from_record(record) for record in nearby.records])
+
+    assert load_more(user_data) == []
+    assert user_data["places_complete"] is True
+
+def make_place(i, lat_offset, lng_offset=0.0):
+    return Place(str(i), f"Место {i}", CENTER[0] + lat_offset, CENTER[1] + lng_offset)
+
+def test_rank_live_places_orders_by_current_distance():
+    # Места загруженной области в произвольном порядке, часть - за пределами радиуса
+    candidates = [make_place(1, 0.004), make_place(2, -0.001), make_place(3, 0.02), make_place(4, 0.0, 0.002)]
+    user_data = {
+        "live_candidates": candidates,
+        "location": {"latitude": CENTER[0], "longitude": CENTER[1]},
+        "radius": 500,
+    }
+    places = bot._rank_live_places(user_data)
+    assert [place.place_id for place in places] == ["2", "4", "1"]
+    assert places[0].distance == pytest.approx(111, rel=0.01)
+    assert places[0].distance < places[1].distance < places[2].distance <= 500
+    # Кандидаты области не изменяются
+    assert all(place.distance == 0.0 for place in candidates)
+
+    # Пользователь переместился на север - порядок пересчитывается от новой точки
+    user_data["location"] = {"latitude": CENTER[0] + 0.004, "longitude": CENTER[1]}
+    assert [place.place_id for place in bot._rank_live_places(user_data)] == ["1", "4"]
+
+def test_rank_live_places_without_candidates():
+    user_data = {"live_candidates": [], "location": {"latitude": CENTER[0], "longitude": CENTER[1]}, "radius": 500}
+    assert bot._rank_live_places(user_data) == []
+
+class FakeQuery:
+    def __init__(self, user_id):
+        self.from_user = type("User", (), {"id": user_id})()
+        self.message = type("Message", (), {"chat_id": user_id, "message_id": 7})()
+
+def test_live_search_without_places_keeps_list_open(monkeypatch):
+    user_id = 424242
+    user_data = dict(make_user_data([]), live=True)
+    del user_data["places"]
+    edits = []
+
+    async def get_session(query):
+        return user_data
+
+    async def edit_message(query, text, **kwargs):
+        edits.append(text)
+
+    async def search(*args, **kwargs):
+        return []
+
+    monkeypatch.setattr(bot, "_get_session", get_session)
+    monkeypatch.setattr(bot, "_edit_message", edit_message)
+    monkeypatch.setattr(bot, "_show_progress", lambda query, text: None)
+    monkeypatch.setattr(bot, "get_nearby_places_async", search)
+    update = type("Update", (), {"callback_query": FakeQuery(user_id)})()
+
+    async_runtime.run(bot.search_places(update, None), timeout=5)
+    assert edits == [bot.LIVE_EMPTY_TEXT]
+    # Следующее обновление геопозиции найдёт сообщение со списком и заполнит его
+    assert user_data["places"] == []
+    assert user_data["list_message"] == (user_id, 7)
+    assert "live_candidates" in user_data
+
+def test_prefetched_text_survives_session_save(monkeypatch):
+    user_id = 434343
+    place = Place("42", "ГУМ", *CENTER, "Красная площадь, 3")
+
+    async def generate(name, address, coordinates):
+        return f"Экскурсия по {name}"
+
+    async def failed(name, address, coordinates):
+        return perplexity_api.UNAVAILABLE_TEXT
+
+    monkeypatch.setattr(bot, "PREFETCH_ENABLED", True)
+    monkeypatch.setattr(bot, "PREFETCH_KINDS", {"excursion": generate, "reviews": failed})
+    monkeypatch.setattr(bot, "prefetcher", bot.PrefetchScheduler(workers=1))
+    monkeypatch.setattr(bot, "_prefetched", bot.TTLCache(maxsize=10, ttl=60))
+
+    async def scenario():
+        # Обработчик сохраняет свою копию сессии, пока идёт фоновая генерация
+        user_data = {"selected_place": place}
+        bot._schedule_prefetch(user_id, place)
+        await bot.sessions.save_async(user_id, user_data)
+        for kind in bot.PREFETCH_KINDS:
+            future = bot.prefetcher.get(user_id, kind)
+            if future is not None:
+                await asyncio.wrap_future(future)
+        await bot.sessions.save_async(user_id, dict(user_data))
+
+    async_runtime.run(scenario(), timeout=5)
+    assert bot._get_prefetched(user_id, place, "excursion") == "Экскурсия по ГУМ"
+    # Ошибка генерации не сохраняется, а другое место не получает чужой текст
+    assert bot._get_prefetched(user_id, place, "reviews") is None
+    assert bot._get_prefetched(user_id, Place("43", "ЦУМ", *CENTER), "excursion") is None
+
+class FakeTourQuery(FakeQuery):
+    def __init__(self, user_id, data):
+        super().__init__(user_id)
+        self.data = data
+
+    def answer(self, text=None):
+        pass
+
+def open_tour(monkeypatch, places, page):
+    user_data = dict(make_user_data(places), places_page=page)
+    keyboards = []
+
+    async def get_session(query):
+        return user_data
+
+    async def edit_message(query, text, reply_markup=None, **kwargs):
+        keyboards.append(reply_markup.inline_keyboard)
+
+    monkeypatch.setattr(bot, "_get_session", get_session)
+    monkeypatch.setattr(bot, "_edit_message", edit_message)
+    update = type("Update", (), {"callback_query": FakeTourQuery(454545, "tour")})()
+    async_runtime.run(bot.tour_handler(update, None), timeout=5)
+    return user_data, keyboards[-1]
+
+def test_tour_defaults_to_shown_page(monkeypatch):
+    monkeypatch.setattr(bot, "PLACES_PAGE_SIZE", 5)
+    places = [make_place(i, 0.0001 * i) for i in range(12)]
+
+    user_data, keyboard = open_tour(monkeypatch, places, page=2)
+    assert user_data["tour"] == [10, 11]
+    # Выбор доступен для всех мест в пределах TOUR_MAX_STOPS, отмечены места открытой страницы
+    assert [row[0].text.startswith("✅") for row in keyboard[:12]] == [False] * 10 + [True] * 2
+
+    user_data, _ = open_tour(monkeypatch, places, page=0)
+    assert user_data["tour"] == [0, 1, 2, 3, 4]
+
+def test_tour_page_beyond_stop_limit_falls_back_to_first_page(monkeypatch):
+    monkeypatch.setattr(bot, "PLACES_PAGE_SIZE", 5)
+    monkeypatch.setattr(bot, "TOUR_MAX_STOPS", 8)
+    places = [make_place(i, 0.0001 * i) for i in range(12)]
+
+    user_data, keyboard = open_tour(monkeypatch, places, page=2)
+    assert user_data["tour"] == [0, 1, 2, 3, 4]
+    assert len(keyboard) == 8 + 2
+
+@pytest.mark.parametrize("text", [
+    "Башни & стены <Кремля> — \"красные\"",
+    "<<<&&&>>>",
+    "ГУМ",
+])
+def test_truncate_html_text_never_splits_entity(text):
+    escaped = html.escape(text, quote=False)
+    assert bot._truncate_html_text(text, len(escaped)) == escaped
+    for limit in range(1, len(escaped)):
+        truncated = bot._truncate_html_text(text, limit)
+        assert len(truncated) <= limit
+        assert truncated.endswith("…")
+        # Обрезанный текст - экранированное начало исходного, без разрезанных сущностей
+        body = truncated[:-1]
+        assert body in (html.escape(text[:i], quote=False) for i in range(len(text) + 1))
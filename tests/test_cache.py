@@ -0,0 +1,106 @@
+import asyncio
+import pytest
+import async_runtime
+import cache
+from cache import TTLCache, SQLiteCache, Revalidator
+
+class FakeClock:
+    """Подменяет модуль time в cache: время идёт только по вызову advance"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(cache, "time", fake)
+    return fake
+
+def test_ttl_cache_serves_stale_value_within_stale_ttl(clock):
+    store = TTLCache(maxsize=10, ttl=60, stale_ttl=30)
+    store.set("tile", [1, 2])
+    assert store.get_stale("tile") == ([1, 2], False)
+    clock.advance(70)
+    # Обычное чтение считает запись устаревшей, но не удаляет её
+    assert store.get("tile") is None
+    assert store.get_stale("tile") == ([1, 2], True)
+    assert store.stale_hits == 1
+    clock.advance(20)
+    assert store.get_stale("tile") == (None, False)
+    assert len(store) == 0
+
+def test_ttl_cache_get_drops_entry_after_stale_ttl(clock):
+    store = TTLCache(maxsize=10, ttl=60, stale_ttl=30)
+    store.set("tile", 1)
+    clock.advance(90)
+    store.get("tile")
+    assert len(store) == 0
+
+def test_sqlite_cache_serves_stale_value_within_stale_ttl(clock, tmp_path):
+    store = SQLiteCache(str(tmp_path / "cache.sqlite3"), ttl=60, stale_ttl=30)
+    store.set("section", "текст")
+    clock.advance(70)
+    assert store.get("section") is None
+    assert store.get_stale("section") == ("текст", True)
+    clock.advance(20)
+    assert store.get_stale("section") == (None, False)
+
+def test_sqlite_cache_purges_only_unusable_entries(clock, tmp_path):
+    store = SQLiteCache(str(tmp_path / "cache.sqlite3"), ttl=60, stale_ttl=30)
+    store.set("old", 1)
+    clock.advance(50)
+    store.set("stale", 2)
+    store.set("fresh", 3, ttl=3600)
+    clock.advance(70)
+    assert store.purge_expired() == 1
+    assert store.get_stale("old") == (None, False)
+    assert store.get_stale("stale") == (2, True)
+    assert store.get("fresh") == 3
+
+def test_revalidator_runs_one_refresh_per_key():
+    revalidator = Revalidator(workers=1)
+    calls = []
+
+    async def refresh(key):
+        calls.append(key)
+        await asyncio.sleep(0.05)
+
+    async def scenario():
+        submitted = [
+            revalidator.submit("a", refresh, "a"),
+            revalidator.submit("a", refresh, "a"),
+            revalidator.submit("b", refresh, "b"),
+        ]
+        while revalidator._pending:
+            await asyncio.sleep(0.01)
+        # После завершения обновления ключ можно обновить снова
+        submitted.append(revalidator.submit("a", refresh, "a"))
+        while revalidator._pending:
+            await asyncio.sleep(0.01)
+        return submitted
+
+    assert async_runtime.run(scenario(), timeout=5) == [True, False, True, True]
+    assert calls == ["a", "b", "a"]
+
+def test_revalidator_survives_failed_refresh():
+    revalidator = Revalidator(workers=1)
+
+    async def refresh():
+        raise ValueError("API недоступен")
+
+    async def scenario():
+        revalidator.submit("a", refresh)
+        while revalidator._pending:
+            await asyncio.sleep(0.01)
+        return revalidator.submit("a", refresh)
+
+    assert async_runtime.run(scenario(), timeout=5) is True
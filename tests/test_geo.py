@@ -0,0 +1,64 @@
+import math
+import numpy as np
+import pytest
+from geo import (
+    EARTH_RADIUS, haversine, distances_from, distance_matrix, meters_to_degrees,
+    geohash_encode, geohash_bounds, geohash_center
+)
+
+def test_haversine_zero_for_same_point():
+    assert haversine(55.7539, 37.6208, 55.7539, 37.6208) == 0.0
+
+def test_haversine_one_degree_of_latitude():
+    # Дуга в один градус на сфере среднего радиуса
+    assert haversine(0.0, 0.0, 1.0, 0.0) == pytest.approx(EARTH_RADIUS * math.pi / 180)
+
+def test_haversine_moscow_to_saint_petersburg():
+    # Красная площадь - Дворцовая площадь: около 634 км
+    assert haversine(55.7539, 37.6208, 59.9390, 30.3158) == pytest.approx(634_000, rel=0.01)
+
+def test_haversine_is_symmetric():
+    assert haversine(10.0, 20.0, -30.0, 40.0) == pytest.approx(haversine(-30.0, 40.0, 10.0, 20.0))
+
+def test_haversine_antipodes_do_not_fail():
+    assert haversine(0.0, 0.0, 0.0, 180.0) == pytest.approx(EARTH_RADIUS * math.pi)
+
+def test_distances_from_matches_haversine():
+    latitudes = [55.75, 55.76, 55.70, 59.94]
+    longitudes = [37.62, 37.60, 37.50, 30.32]
+    expected = [haversine(55.75, 37.62, lat, lng) for lat, lng in zip(latitudes, longitudes)]
+    assert np.allclose(distances_from(55.75, 37.62, latitudes, longitudes), expected)
+
+def test_distance_matrix_is_symmetric_with_zero_diagonal():
+    latitudes = [55.75, 55.76, 55.70]
+    longitudes = [37.62, 37.60, 37.50]
+    matrix = distance_matrix(latitudes, longitudes)
+    assert matrix.shape == (3, 3)
+    assert np.allclose(matrix, matrix.T)
+    assert np.allclose(np.diag(matrix), 0.0)
+    assert matrix[0, 2] == pytest.approx(haversine(55.75, 37.62, 55.70, 37.50))
+
+def test_meters_to_degrees_widens_longitude_away_from_equator():
+    lat_degrees, lng_degrees = meters_to_degrees(1000, 60.0)
+    assert lat_degrees == pytest.approx(1000 / 111320.0)
+    # cos(60°) = 0.5: градус долготы вдвое короче градуса широты
+    assert lng_degrees == pytest.approx(2 * lat_degrees)
+
+def test_geohash_encode_known_value():
+    # Пример из описания формата geohash
+    assert geohash_encode(57.64911, 10.40744, 11) == "u4pruydqqvj"
+
+def test_geohash_prefix_is_coarser_cell():
+    assert geohash_encode(55.7539, 37.6208, 5) == geohash_encode(55.7539, 37.6208, 7)[:5]
+
+@pytest.mark.parametrize("latitude, longitude", [(55.7539, 37.6208), (-33.8568, 151.2153), (0.0, 0.0), (40.7, -74.0)])
+def test_geohash_bounds_contain_point(latitude, longitude):
+    min_lat, min_lng, max_lat, max_lng = geohash_bounds(geohash_encode(latitude, longitude, 7))
+    assert min_lat <= latitude <= max_lat
+    assert min_lng <= longitude <= max_lng
+    # Ячейка точности 7 - около 150 x 150 метров
+    assert haversine(min_lat, min_lng, max_lat, min_lng) < 200
+
+def test_geohash_center_encodes_to_same_cell():
+    geohash = geohash_encode(55.7539, 37.6208, 6)
+    assert geohash_encode(*geohash_center(geohash), 6) == geohash
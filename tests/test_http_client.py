@@ -0,0 +1,130 @@
+import random
+import pytest
+import requests
+import async_runtime
+import http_client
+import upstream
+
+class FakeResponse:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+class FakeServer:
+    """Подменяет отправку запроса: возвращает ответы или бросает исключения по списку"""
+
+    def __init__(self, *results):
+        self.results = list(results)
+        self.calls = []
+
+    async def send(self, method, url, kwargs):
+        self.calls.append(method)
+        result = self.results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+@pytest.fixture
+def server(monkeypatch):
+    fake = FakeServer()
+    monkeypatch.setattr(http_client, "_send", fake.send)
+    # Повторы без заметных пауз и свой размыкатель цепи для каждого теста
+    monkeypatch.setattr(http_client, "HTTP_BACKOFF_BASE", 0.001)
+    monkeypatch.setattr(http_client, "HTTP_BACKOFF_MAX", 0.01)
+    monkeypatch.setitem(upstream._breakers, "default", upstream.CircuitBreaker("default", failure_threshold=10))
+    return fake
+
+def request(method, url="http://example.com/api", **kwargs):
+    return async_runtime.run(http_client.request_async(method, url, **kwargs), timeout=5)
+
+def test_retries_server_errors_until_success(server):
+    failed = [FakeResponse(503), FakeResponse(502)]
+    server.results = failed + [FakeResponse(200)]
+    assert request("GET").status_code == 200
+    assert len(server.calls) == 3
+    assert all(response.closed for response in failed)
+
+def test_returns_last_response_when_retries_exhausted(server):
+    server.results = [FakeResponse(500) for _ in range(3)]
+    response = request("GET", retries=2)
+    assert response.status_code == 500
+    assert not response.closed
+    assert len(server.calls) == 3
+
+def test_client_errors_are_not_retried(server):
+    server.results = [FakeResponse(404)]
+    assert request("GET").status_code == 404
+    assert len(server.calls) == 1
+
+def test_connection_error_is_retried(server):
+    server.results = [requests.exceptions.ConnectionError("reset"), FakeResponse(200)]
+    assert request("POST").status_code == 200
+    assert server.calls == ["POST", "POST"]
+
+def test_read_timeout_retried_only_for_get(server):
+    server.results = [requests.exceptions.ReadTimeout("slow"), FakeResponse(200)]
+    assert request("GET").status_code == 200
+
+    # POST мог дойти до сервера, поэтому не повторяется
+    server.results = [requests.exceptions.ReadTimeout("slow"), FakeResponse(200)]
+    server.calls.clear()
+    with pytest.raises(requests.exceptions.ReadTimeout):
+        request("POST")
+    assert server.calls == ["POST"]
+
+def test_too_many_requests_pauses_quota(server, monkeypatch):
+    penalties = []
+    monkeypatch.setattr(upstream, "penalize", lambda endpoint, delay: penalties.append((endpoint, delay)))
+    server.results = [FakeResponse(429, {"Retry-After": "0.005"}), FakeResponse(200)]
+    assert request("GET").status_code == 200
+    assert penalties == [("default", 0.005)]
+
+def test_open_breaker_skips_request(server, monkeypatch):
+    monkeypatch.setitem(upstream._breakers, "default", upstream.CircuitBreaker("default", failure_threshold=2))
+    server.results = [FakeResponse(503), FakeResponse(503)]
+    assert request("GET", retries=0).status_code == 503
+    assert request("GET", retries=0).status_code == 503
+    with pytest.raises(upstream.UpstreamUnavailable):
+        request("GET")
+    assert len(server.calls) == 2
+
+def test_retries_count_as_one_breaker_failure(server, monkeypatch):
+    breaker = upstream.CircuitBreaker("default", failure_threshold=2)
+    monkeypatch.setitem(upstream._breakers, "default", breaker)
+    server.results = [FakeResponse(503) for _ in range(4)] + [requests.exceptions.ConnectionError("reset")]
+    assert request("GET", retries=3).status_code == 503
+    assert breaker.state == upstream.CircuitBreaker.CLOSED
+    with pytest.raises(requests.exceptions.ConnectionError):
+        request("POST", retries=0)
+    assert breaker.state == upstream.CircuitBreaker.OPEN
+
+def test_probe_retries_then_closes_breaker(server, monkeypatch):
+    breaker = upstream.CircuitBreaker("default", failure_threshold=1, reset_timeout=0)
+    monkeypatch.setitem(upstream._breakers, "default", breaker)
+    breaker.record_failure()
+    # Повтор пробного запроса не отклоняется как второй пробный
+    server.results = [FakeResponse(503), FakeResponse(200)]
+    assert request("GET").status_code == 200
+    assert breaker.state == upstream.CircuitBreaker.CLOSED
+
+def test_backoff_is_bounded_full_jitter(monkeypatch):
+    monkeypatch.setattr(http_client, "HTTP_BACKOFF_BASE", 0.3)
+    monkeypatch.setattr(http_client, "HTTP_BACKOFF_MAX", 8)
+    random.seed(1)
+    for attempt in range(10):
+        delays = [http_client._get_backoff(attempt) for _ in range(200)]
+        limit = min(8, 0.3 * 2 ** attempt)
+        assert all(0 <= delay <= limit for delay in delays)
+        # Разброс на всём интервале, а не фиксированная задержка
+        assert max(delays) - min(delays) > limit / 2
+
+def test_retry_after_header(monkeypatch):
+    monkeypatch.setattr(http_client, "HTTP_BACKOFF_MAX", 8)
+    assert http_client._get_retry_after(FakeResponse(429, {"Retry-After": "2"})) == 2.0
+    assert http_client._get_retry_after(FakeResponse(429, {"Retry-After": "120"})) == 8
+    assert http_client._get_retry_after(FakeResponse(429, {"Retry-After": "Wed, 21 Oct 2026 07:28:00 GMT"})) is None
+    assert http_client._get_retry_after(FakeResponse(503)) is None
@@ -0,0 +1,122 @@
+import asyncio
+import itertools
+import pytest
+from telegram.error import BadRequest
+import async_runtime
+import media_cache
+import outbox
+from cache import SQLiteCache
+from media_cache import MapMediaCache
+
+CENTER = (55.7539, 37.6208)
+
+class FakePhoto:
+    def __init__(self, file_id):
+        self.file_id = file_id
+
+class FakeMessage:
+    def __init__(self, file_id):
+        # Telegram возвращает несколько размеров изображения, самый крупный - последний
+        self.photo = [FakePhoto(file_id + "-thumb"), FakePhoto(file_id)]
+        self.deleted = False
+
+    def delete(self):
+        self.deleted = True
+
+class FakeBot:
+    """Записывает отправленные фото; file_id из invalid отклоняются как устаревшие"""
+
+    def __init__(self):
+        self.sent = []
+        self.messages = []
+        self.invalid = set()
+        self._file_ids = itertools.count(1)
+
+    def send_photo(self, chat_id, photo, **kwargs):
+        self.sent.append((chat_id, photo))
+        if photo in self.invalid:
+            raise BadRequest("Wrong file identifier/http url specified")
+        message = FakeMessage(photo if isinstance(photo, str) else f"file-{next(self._file_ids)}")
+        self.messages.append(message)
+        return message
+
+@pytest.fixture
+def maps(monkeypatch):
+    downloads = []
+
+    def get_static_map(latitude, longitude, zoom=16):
+        downloads.append((latitude, longitude))
+        return b"png"
+
+    async def get_static_map_async(latitude, longitude, zoom=16):
+        return get_static_map(latitude, longitude, zoom)
+
+    monkeypatch.setattr(media_cache, "get_static_map", get_static_map)
+    monkeypatch.setattr(media_cache, "get_static_map_async", get_static_map_async)
+    # Служебный чат не ждёт лимита Telegram в одну секунду между сообщениями
+    monkeypatch.setattr(outbox, "TELEGRAM_CHAT_RATE", 50.0)
+    monkeypatch.setattr(outbox, "TELEGRAM_CHAT_BURST", 10.0)
+    return downloads
+
+@pytest.fixture
+def store(tmp_path):
+    return SQLiteCache(str(tmp_path / "media.sqlite3"), ttl=3600)
+
+def test_file_id_reused_after_first_upload(maps, store):
+    media = MapMediaCache(store)
+    bot = FakeBot()
+
+    media.send_photo(bot, 1, *CENTER)
+    media.send_photo(bot, 2, CENTER[0] + 0.000001, CENTER[1])
+    assert bot.sent == [(1, b"png"), (2, "file-1")]
+    assert len(maps) == 1
+    assert media.get_photo(*CENTER) == "file-1"
+
+def test_invalid_file_id_is_uploaded_again(maps, store):
+    media = MapMediaCache(store)
+    bot = FakeBot()
+    key = media._get_key(*CENTER, 16)
+    store.set(key, "expired")
+    bot.invalid.add("expired")
+
+    message = media.send_photo(bot, 1, *CENTER)
+    assert bot.sent == [(1, "expired"), (1, b"png")]
+    assert message.photo[-1].file_id == "file-1"
+    assert store.get(key) == "file-1"
+
+def test_bad_request_for_uploaded_image_is_raised(maps, store, monkeypatch):
+    media = MapMediaCache(store)
+    bot = FakeBot()
+    bot.invalid.add("https://static-maps.example/map.png")
+    monkeypatch.setattr(media_cache, "get_static_map", lambda latitude, longitude, zoom=16: None)
+    monkeypatch.setattr(media_cache, "get_static_map_url", lambda latitude, longitude, zoom=16: "https://static-maps.example/map.png")
+
+    with pytest.raises(BadRequest):
+        media.send_photo(bot, 1, *CENTER)
+    assert len(bot.sent) == 1
+
+def test_warm_up_queue_overflow(maps, store):
+    media = MapMediaCache(store, chat_id=-100, max_queued=2)
+    bot = FakeBot()
+    points = [(CENTER[0] + 0.001 * i, CENTER[1]) for i in range(3)]
+
+    async def scenario():
+        # Очередь заполняется раньше, чем загрузчик успевает начать работу
+        queued = [media.warm_up(bot, *point) for point in points]
+        queued.append(media.warm_up(bot, *points[0]))
+        assert media.pending() == 2
+        while media._worker is not None:
+            await asyncio.sleep(0.01)
+        return queued
+
+    assert async_runtime.run(scenario(), timeout=5) == [True, True, False, True]
+    assert [chat_id for chat_id, _ in bot.sent] == [-100, -100]
+    assert all(message.deleted for message in bot.messages)
+    assert media.get_photo(*points[0]) == "file-1"
+    assert media.get_photo(*points[1]) == "file-2"
+    assert store.get(media._get_key(*points[2], 16)) is None
+
+def test_warm_up_disabled_without_chat(maps, store):
+    media = MapMediaCache(store)
+    assert media.warm_up(FakeBot(), *CENTER) is False
+    assert media.pending() == 0
@@ -0,0 +1,106 @@
+import asyncio
+import pytest
+import async_runtime
+import metrics
+from metrics import Counter, Histogram, GaugeFunc
+
+@pytest.fixture(autouse=True)
+def registry(monkeypatch):
+    # Метрики регистрируются глобально - каждому тесту свой реестр
+    monkeypatch.setattr(metrics, "_registry", [])
+
+def test_render_snapshot():
+    requests = Counter("test_requests_total", "Количество запросов", ["endpoint", "status"])
+    requests.inc("yandex", "200")
+    requests.inc("yandex", "200")
+    requests.inc("perplexity", 'ошибка "timeout"', amount=3)
+    duration = Histogram("test_duration_seconds", "Время запроса", ["endpoint"], buckets=(0.1, 1))
+    for value in (0.05, 0.1, 0.5, 5):
+        duration.observe(value, "yandex")
+    GaugeFunc("test_queue_depth", "Длина очереди", lambda: 3)
+    GaugeFunc("test_cache_hits_total", "Попадания", lambda: {("tiles",): 10}, ["cache"], type="counter")
+
+    assert metrics.render() == (
+        "# HELP test_requests_total Количество запросов\n"
+        "# TYPE test_requests_total counter\n"
+        'test_requests_total{endpoint="yandex",status="200"} 2\n'
+        'test_requests_total{endpoint="perplexity",status="ошибка \\"timeout\\""} 3\n'
+        "# HELP test_duration_seconds Время запроса\n"
+        "# TYPE test_duration_seconds histogram\n"
+        'test_duration_seconds_bucket{endpoint="yandex",le="0.1"} 2\n'
+        'test_duration_seconds_bucket{endpoint="yandex",le="1"} 3\n'
+        'test_duration_seconds_bucket{endpoint="yandex",le="+Inf"} 4\n'
+        'test_duration_seconds_sum{endpoint="yandex"} 5.65\n'
+        'test_duration_seconds_count{endpoint="yandex"} 4\n'
+        "# HELP test_queue_depth Длина очереди\n"
+        "# TYPE test_queue_depth gauge\n"
+        "test_queue_depth 3\n"
+        "# HELP test_cache_hits_total Попадания\n"
+        "# TYPE test_cache_hits_total counter\n"
+        'test_cache_hits_total{cache="tiles"} 10\n'
+    )
+
+def test_histogram_without_labels_and_failing_gauge():
+    Histogram("test_wait_seconds", "Ожидание", buckets=(1,)).observe(2)
+
+    def broken():
+        raise RuntimeError("хранилище недоступно")
+
+    GaugeFunc("test_sessions", "Сессии", broken)
+    assert metrics.render().splitlines() == [
+        "# HELP test_wait_seconds Ожидание",
+        "# TYPE test_wait_seconds histogram",
+        'test_wait_seconds_bucket{le="1"} 0',
+        'test_wait_seconds_bucket{le="+Inf"} 1',
+        "test_wait_seconds_sum 2.0",
+        "test_wait_seconds_count 1",
+        # Ошибка одной метрики не мешает отдать остальные
+        "# HELP test_sessions Сессии",
+        "# TYPE test_sessions gauge",
+    ]
+
+@pytest.fixture
+def handler_metrics(monkeypatch):
+    duration = Histogram("test_handler_duration_seconds", "Время обработки", ["handler"])
+    errors = Counter("test_handler_errors_total", "Исключения", ["handler"])
+    monkeypatch.setattr(metrics, "HANDLER_DURATION", duration)
+    monkeypatch.setattr(metrics, "HANDLER_ERRORS", errors)
+    return duration, errors
+
+def test_track_async_handler(handler_metrics):
+    duration, errors = handler_metrics
+
+    @metrics.track_handler
+    async def excursion_handler(update, context):
+        await asyncio.sleep(0.01)
+        if update == "ошибка":
+            raise ValueError(update)
+        return "PLACE_SELECTION"
+
+    assert asyncio.iscoroutinefunction(excursion_handler)
+    assert excursion_handler.__name__ == "excursion_handler"
+    assert async_runtime.run(excursion_handler("update", None), timeout=5) == "PLACE_SELECTION"
+    with pytest.raises(ValueError):
+        async_runtime.run(excursion_handler("ошибка", None), timeout=5)
+
+    child = duration.labels("excursion_handler")
+    assert sum(child.counts) == 2
+    assert child.sum >= 0.02
+    assert errors.labels("excursion_handler").value == 1
+
+def test_track_sync_handler(handler_metrics):
+    duration, errors = handler_metrics
+
+    @metrics.track_handler
+    def help_command(update, context):
+        if update is None:
+            raise KeyError("update")
+        return None
+
+    assert not asyncio.iscoroutinefunction(help_command)
+    assert help_command("update", None) is None
+    with pytest.raises(KeyError):
+        help_command(None, None)
+    assert sum(duration.labels("help_command").counts) == 2
+    assert errors.labels("help_command").value == 1
+    assert 'test_handler_errors_total{handler="help_command"} 1' in metrics.render().splitlines()
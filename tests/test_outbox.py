@@ -0,0 +1,147 @@
+import time
+import asyncio
+import itertools
+import pytest
+from telegram.error import RetryAfter, BadRequest
+import async_runtime
+import metrics
+import outbox
+import upstream
+
+_chat_ids = itertools.count(1)
+
+class FakeBot:
+    """Записывает отправленные тексты и время отправки"""
+
+    def __init__(self):
+        self.sent = []
+
+    def send(self, text):
+        self.sent.append((text, time.monotonic()))
+        return text
+
+@pytest.fixture
+def chat_id(monkeypatch):
+    # Лимиты в 20 раз быстрее настоящих, чтобы тесты не ждали секундами
+    monkeypatch.setattr(outbox, "TELEGRAM_CHAT_RATE", 20.0)
+    monkeypatch.setattr(outbox, "TELEGRAM_CHAT_BURST", 3.0)
+    monkeypatch.setitem(upstream._buckets, "telegram", upstream.TokenBucket("telegram", rate=0, burst=1))
+    return next(_chat_ids)
+
+def gaps(sent):
+    return [later - earlier for (_, earlier), (_, later) in zip(sent, sent[1:])]
+
+def test_chat_limit_allows_burst_then_rate(chat_id):
+    bot = FakeBot()
+
+    async def scenario():
+        return await asyncio.gather(*(outbox.send_async(chat_id, bot.send, str(i)) for i in range(6)))
+
+    assert async_runtime.run(scenario(), timeout=5) == ["0", "1", "2", "3", "4", "5"]
+    assert [text for text, _ in bot.sent] == ["0", "1", "2", "3", "4", "5"]
+    started = bot.sent[0][1]
+    assert bot.sent[2][1] - started < 0.04
+    # После пачки - не чаще TELEGRAM_CHAT_RATE сообщений в секунду
+    assert all(gap >= 0.04 for gap in gaps(bot.sent)[2:])
+
+def test_chats_do_not_share_limit(chat_id):
+    bot = FakeBot()
+    other_chat_id = next(_chat_ids)
+
+    async def scenario():
+        await asyncio.gather(*(outbox.send_async(chat_id, bot.send, "a") for _ in range(3)))
+        started = time.monotonic()
+        await outbox.send_async(other_chat_id, bot.send, "b")
+        return time.monotonic() - started
+
+    assert async_runtime.run(scenario(), timeout=5) < 0.04
+
+def test_global_limit_spans_chats(chat_id, monkeypatch):
+    bot = FakeBot()
+    monkeypatch.setitem(upstream._buckets, "telegram", upstream.TokenBucket("telegram", rate=20, burst=2))
+    chat_ids = [chat_id] + [next(_chat_ids) for _ in range(3)]
+
+    async def scenario():
+        await asyncio.gather(*(outbox.send_async(chat, bot.send, str(chat)) for chat in chat_ids))
+
+    async_runtime.run(scenario(), timeout=5)
+    assert len(bot.sent) == 4
+    # Каждому чату хватает своего лимита, но общая квота - две пачкой и 20 в секунду
+    assert bot.sent[-1][1] - bot.sent[0][1] >= 0.08
+
+def test_interim_edit_dropped_by_newer_edit(chat_id):
+    bot = FakeBot()
+    dropped = metrics.TELEGRAM_MESSAGES.labels("dropped")
+    before = dropped.value
+
+    async def scenario():
+        outbox.send_interim(chat_id, bot.send, "Ищу места...", target=10, delay=0.2)
+        return await outbox.send_async(chat_id, bot.send, "Готово", target=10)
+
+    assert async_runtime.run(scenario(), timeout=5) == "Готово"
+    assert [text for text, _ in bot.sent] == ["Готово"]
+    assert dropped.value == before + 1
+
+def test_interim_edit_sent_after_delay(chat_id):
+    bot = FakeBot()
+
+    async def scenario():
+        started = time.monotonic()
+        outbox.send_interim(chat_id, bot.send, "Ищу места...", target=10, delay=0.1)
+        while not bot.sent:
+            await asyncio.sleep(0.01)
+        return bot.sent[0][1] - started
+
+    assert async_runtime.run(scenario(), timeout=5) >= 0.1
+
+def test_interim_of_other_message_sent_before_final(chat_id):
+    bot = FakeBot()
+
+    async def scenario():
+        started = time.monotonic()
+        outbox.send_interim(chat_id, bot.send, "Ищу места...", target=10, delay=5)
+        await outbox.send_async(chat_id, bot.send, "Новое сообщение")
+        return time.monotonic() - started
+
+    # Промежуточное сообщение не задерживает следующее и отправляется перед ним
+    assert async_runtime.run(scenario(), timeout=5) < 1
+    assert [text for text, _ in bot.sent] == ["Ищу места...", "Новое сообщение"]
+
+def test_retry_after_repeats_message(chat_id):
+    bot = FakeBot()
+    attempts = []
+
+    def send(text):
+        attempts.append(text)
+        if len(attempts) == 1:
+            raise RetryAfter(0.1)
+        return bot.send(text)
+
+    async def scenario():
+        started = time.monotonic()
+        result = await outbox.send_async(chat_id, send, "Маршрут")
+        return result, time.monotonic() - started
+
+    result, elapsed = async_runtime.run(scenario(), timeout=5)
+    assert result == "Маршрут"
+    assert attempts == ["Маршрут", "Маршрут"]
+    assert elapsed >= 0.1
+
+def test_error_is_raised_to_sender(chat_id):
+    def send(text):
+        raise BadRequest("Message is not modified")
+
+    with pytest.raises(BadRequest):
+        async_runtime.run(outbox.send_async(chat_id, send, "Маршрут"), timeout=5)
+
+def test_chat_state_released_when_limit_refills(chat_id):
+    bot = FakeBot()
+
+    async def scenario():
+        await outbox.send_async(chat_id, bot.send, "Маршрут")
+        assert chat_id in outbox._chats
+        # Один токен восстанавливается за 1 / TELEGRAM_CHAT_RATE секунд
+        await asyncio.sleep(0.1)
+        return chat_id in outbox._chats
+
+    assert async_runtime.run(scenario(), timeout=5) is False
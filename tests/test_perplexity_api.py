@@ -0,0 +1,144 @@
+import json
+import pytest
+import requests
+import async_runtime
+import perplexity_api
+import upstream
+from cache import SQLiteCache
+from upstream import Coalescer
+
+SECTIONS = {
+    "description": "Главный универсальный магазин",
+    "excursion": "Здание построено в 1893 году",
+    "reviews": "Посетители хвалят фонтан",
+}
+
+class FakeCompletion:
+    """Подменяет _request_completion: записывает типы запросов и отвечает по типу"""
+
+    def __init__(self):
+        self.operations = []
+
+    async def request(self, prompt, operation="completion", max_tokens=perplexity_api.MAX_TOKENS):
+        self.operations.append(operation)
+        if operation == "combined":
+            return json.dumps(SECTIONS, ensure_ascii=False)
+        return f"Текст раздела {operation}"
+
+@pytest.fixture
+def completion(monkeypatch, tmp_path):
+    fake = FakeCompletion()
+    monkeypatch.setattr(perplexity_api, "_request_completion", fake.request)
+    monkeypatch.setattr(perplexity_api, "_response_cache", SQLiteCache(str(tmp_path / "llm.sqlite3"), ttl=3600))
+    monkeypatch.setattr(perplexity_api, "_in_flight", Coalescer())
+    monkeypatch.setattr(perplexity_api, "LLM_COMBINED", True)
+    return fake
+
+def get_description(level):
+    async def scenario():
+        with upstream.priority(level):
+            return await perplexity_api.get_place_description_async("ГУМ", "Красная площадь, 3")
+
+    return async_runtime.run(scenario(), timeout=5)
+
+def test_parse_combined_clean_json():
+    assert perplexity_api._parse_combined(json.dumps(SECTIONS)) == SECTIONS
+
+def test_parse_combined_json_in_prose_and_fences():
+    body = json.dumps(SECTIONS, ensure_ascii=False, indent=2)
+    assert perplexity_api._parse_combined(f"```json\n{body}\n```") == SECTIONS
+    assert perplexity_api._parse_combined(f"Вот материалы о месте:\n{body}\nНадеюсь, это поможет!") == SECTIONS
+    # Фигурные скобки в тексте вокруг JSON
+    assert perplexity_api._parse_combined(f"Формат {{раздел: текст}}:\n{body}\nГотово {{}}") == SECTIONS
+
+def test_parse_combined_braces_inside_values():
+    sections = dict(SECTIONS, excursion="Над входом надпись {ГУМ} и вензель }{")
+    assert perplexity_api._parse_combined(json.dumps(sections, ensure_ascii=False)) == sections
+
+def test_parse_combined_strips_texts():
+    sections = {kind: f"  {text}\n" for kind, text in SECTIONS.items()}
+    assert perplexity_api._parse_combined(json.dumps(sections)) == SECTIONS
+
+@pytest.mark.parametrize("content", [
+    "",
+    "Не удалось найти информацию о месте",
+    json.dumps({"description": "Текст", "excursion": "Текст"}),
+    json.dumps(dict(SECTIONS, reviews=["плюсы", "минусы"])),
+    json.dumps(dict(SECTIONS, reviews=None)),
+    json.dumps(dict(SECTIONS, reviews="   ")),
+    "{\"description\": \"Обрыв ответа",
+], ids=["empty", "prose", "missing", "list", "null", "blank", "truncated"])
+def test_parse_combined_rejects_invalid_content(content):
+    assert perplexity_api._parse_combined(content) is None
+
+def test_interactive_request_does_not_start_combined_call(completion):
+    assert get_description(upstream.INTERACTIVE) == "Текст раздела description"
+    assert completion.operations == ["description"]
+
+def test_prefetch_request_fills_all_sections(completion):
+    assert get_description(upstream.PREFETCH) == SECTIONS["description"]
+    assert completion.operations == ["combined"]
+    # Остальные разделы уже в кэше
+    reviews = async_runtime.run(perplexity_api.get_place_reviews_async("ГУМ", "Красная площадь, 3"), timeout=5)
+    assert reviews == SECTIONS["reviews"]
+    assert completion.operations == ["combined"]
+
+def test_unparsable_combined_response_falls_back_to_section(completion, monkeypatch):
+    async def request(prompt, operation="completion", max_tokens=perplexity_api.MAX_TOKENS):
+        completion.operations.append(operation)
+        return "Извините, не могу ответить в формате JSON" if operation == "combined" else "Описание"
+
+    monkeypatch.setattr(perplexity_api, "_request_completion", request)
+    assert get_description(upstream.PREFETCH) == "Описание"
+    assert completion.operations == ["combined", "description"]
+
+def stream_excursion(monkeypatch, tmp_path, deltas, error=None):
+    """Собирает версии текста из потокового запроса, который отдаёт deltas и затем, возможно, обрывается"""
+    async def stream_completion(prompt, operation="completion_stream"):
+        for delta in deltas:
+            yield delta
+        if error is not None:
+            raise error
+
+    monkeypatch.setattr(perplexity_api, "_stream_completion", stream_completion)
+    monkeypatch.setattr(perplexity_api, "_response_cache", SQLiteCache(str(tmp_path / "llm.sqlite3"), ttl=3600))
+    monkeypatch.setattr(perplexity_api, "_in_flight", Coalescer())
+
+    async def scenario():
+        return [text async for text in perplexity_api.stream_excursion_info_async("ГУМ", "Красная площадь, 3")]
+
+    return async_runtime.run(scenario(), timeout=5)
+
+def cached_excursion():
+    return perplexity_api._response_cache.get(perplexity_api._get_cache_key("excursion", "ГУМ", "Красная площадь, 3"))
+
+def test_stream_caches_complete_text(monkeypatch, tmp_path):
+    assert stream_excursion(monkeypatch, tmp_path, ["Здание ", "построено"]) == ["Здание ", "Здание построено"]
+    assert cached_excursion() == "Здание построено"
+
+def test_interrupted_stream_is_marked_and_not_cached(monkeypatch, tmp_path):
+    versions = stream_excursion(monkeypatch, tmp_path, ["Здание ", "построено"], requests.exceptions.ConnectionError("reset"))
+    assert versions[-1] == "Здание построено" + perplexity_api.INTERRUPTED_TEXT
+    assert cached_excursion() is None
+
+def test_stream_failed_before_text(monkeypatch, tmp_path):
+    versions = stream_excursion(monkeypatch, tmp_path, [], requests.exceptions.ReadTimeout("slow"))
+    assert versions == [perplexity_api.CONNECTION_ERROR_TEXT]
+    assert cached_excursion() is None
+
+def test_cache_key_normalizes_place():
+    key = perplexity_api._get_cache_key("description", "  Большой   Театр ", "Театральная пл.,\t1", (55.760123456, 37.618678912))
+    assert key == "description|большой театр|театральная пл., 1|55.7601,37.6187"
+    # Регистр, пробелы и координаты в пределах точности не создают новую запись
+    assert perplexity_api._get_cache_key("description", "большой театр", "ТЕАТРАЛЬНАЯ ПЛ., 1", ("55.76008", "37.61871")) == key
+
+def test_cache_key_distinguishes_kind_and_place():
+    key = perplexity_api._get_cache_key("description", "ГУМ", "Красная площадь, 3", (55.7547, 37.6215))
+    assert perplexity_api._get_cache_key("reviews", "ГУМ", "Красная площадь, 3", (55.7547, 37.6215)) != key
+    # Одноимённые места в разных точках
+    assert perplexity_api._get_cache_key("description", "ГУМ", "Красная площадь, 3", (55.7557, 37.6215)) != key
+    assert perplexity_api._get_kind(key) == "description"
+
+def test_cache_key_without_coordinates():
+    assert perplexity_api._get_cache_key("excursion", None, None) == "excursion|||"
+    assert perplexity_api._get_cache_key("excursion", "ГУМ", "Москва") == "excursion|гум|москва|"
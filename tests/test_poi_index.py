@@ -0,0 +1,95 @@
+import json
+import pytest
+from poi_index import POIIndex, MAX_TYPE_BITS
+
+CENTER = (55.7539, 37.6208)
+
+def make_record(i, types, lat_offset=0.0, lng_offset=0.0):
+    return {
+        "id": str(i),
+        "name": f"Место {i}",
+        "lat": CENTER[0] + lat_offset,
+        "lng": CENTER[1] + lng_offset,
+        "address": "",
+        "types": types,
+    }
+
+def query_ids(index, types=None, radius=5000, limit=1000):
+    return {place["place_id"] for place in index.query(*CENTER, radius, types=types, limit=limit)}
+
+def test_query_filters_by_type():
+    index = POIIndex([
+        make_record(1, ["museum"], 0.001),
+        make_record(2, ["park"], 0.002),
+        make_record(3, ["museum", "gallery"], 0.003),
+    ])
+    assert query_ids(index, ["museum"]) == {"1", "3"}
+    assert query_ids(index, ["gallery", "park"]) == {"2", "3"}
+    assert query_ids(index, ["zoo"]) == set()
+    assert query_ids(index) == {"1", "2", "3"}
+
+def test_record_without_types_matches_any_query():
+    index = POIIndex([make_record(1, []), make_record(2, ["park"], 0.001)])
+    assert query_ids(index, ["museum"]) == {"1"}
+
+def test_query_with_more_types_than_mask_bits():
+    count = MAX_TYPE_BITS + 20
+    records = [make_record(i, [f"type_{i}"], 0.0001 * i) for i in range(count)]
+    # Частый тип получает собственный бит, даже если встречается у записи вместе с редкими
+    records.append(make_record(count, ["museum", f"type_{count - 1}"], 0.0001 * count))
+    records.append(make_record(count + 1, ["museum"], 0.0001 * (count + 1)))
+    index = POIIndex(records)
+
+    for i in range(count - 1):
+        assert query_ids(index, [f"type_{i}"]) == {str(i)}, f"type_{i}"
+    assert query_ids(index, [f"type_{count - 1}"]) == {str(count - 1), str(count)}
+    assert query_ids(index, ["museum"]) == {str(count), str(count + 1)}
+    # Смешанный запрос из частого и редких типов
+    assert query_ids(index, ["museum", "type_0", f"type_{count - 2}"]) == {
+        "0", str(count - 2), str(count), str(count + 1)
+    }
+    assert query_ids(index, ["unknown"]) == set()
+
+def test_query_orders_by_distance_and_limits():
+    index = POIIndex([
+        make_record(1, [], 0.003),
+        make_record(2, [], 0.001),
+        make_record(3, [], 0.002),
+        make_record(4, [], 0.5),
+    ])
+    places = index.query(*CENTER, 1000, limit=2)
+    assert [place["place_id"] for place in places] == ["2", "3"]
+    assert places[0]["distance"] < places[1]["distance"] <= 1000
+    assert places[0]["geometry"]["location"] == {"lat": pytest.approx(CENTER[0] + 0.001), "lng": CENTER[1]}
+
+def test_query_finds_places_across_cell_borders():
+    offsets = [(-0.01, -0.01), (-0.01, 0.01), (0.01, -0.01), (0.01, 0.01), (0.0, 0.0)]
+    index = POIIndex([make_record(i, [], lat, lng) for i, (lat, lng) in enumerate(offsets)])
+    assert query_ids(index, radius=2000) == {"0", "1", "2", "3", "4"}
+    assert query_ids(index, radius=100) == {"4"}
+
+def test_covers_only_indexed_cells():
+    index = POIIndex([make_record(1, [])])
+    assert index.covers(*CENTER, 100)
+    assert not index.covers(59.9390, 30.3158, 100)
+
+def test_load_jsonl_and_csv(tmp_path):
+    jsonl = tmp_path / "places.jsonl"
+    jsonl.write_text(
+        json.dumps({"id": 1, "name": "ГУМ", "lat": CENTER[0], "lon": CENTER[1], "types": ["mall"]}) + "\n"
+        + json.dumps({"id": 2, "name": "Без координат"}) + "\n",
+        encoding="utf-8"
+    )
+    index = POIIndex.load(str(jsonl))
+    assert len(index) == 1
+    assert query_ids(index, ["mall"]) == {"1"}
+
+    csv_path = tmp_path / "places.csv"
+    csv_path.write_text(
+        "id,name,lat,lng,address,types\n"
+        f"1,ГУМ,{CENTER[0]},{CENTER[1]},\"Красная площадь, 3\",mall; shop\n",
+        encoding="utf-8"
+    )
+    index = POIIndex.load(str(csv_path))
+    place, = index.query(*CENTER, 100, types=["shop"])
+    assert place["vicinity"] == "Красная площадь, 3"
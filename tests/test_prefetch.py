@@ -0,0 +1,101 @@
+import asyncio
+import pytest
+import async_runtime
+from prefetch import PrefetchScheduler
+
+def run(coro):
+    return async_runtime.run(coro, timeout=5)
+
+def wait_all(futures):
+    return asyncio.gather(*(asyncio.wrap_future(future) for future in futures), return_exceptions=True)
+
+def test_tasks_run_by_priority_then_submission_order():
+    scheduler = PrefetchScheduler(workers=1)
+    order = []
+
+    async def task(name):
+        order.append(name)
+        return name
+
+    async def scenario():
+        futures = [
+            scheduler.submit("user", "reviews", task, "reviews", priority=1),
+            scheduler.submit("user", "map", task, "map", priority=2),
+            scheduler.submit("user", "excursion", task, "excursion", priority=0),
+            scheduler.submit("other", "reviews", task, "other reviews", priority=1),
+        ]
+        return await wait_all(futures)
+
+    assert run(scenario()) == ["reviews", "map", "excursion", "other reviews"]
+    assert order == ["excursion", "reviews", "other reviews", "map"]
+    assert scheduler.pending() == 0
+
+def test_workers_limit_concurrent_tasks():
+    scheduler = PrefetchScheduler(workers=2)
+    running = []
+    peak = []
+
+    async def task(i):
+        running.append(i)
+        peak.append(len(running))
+        await asyncio.sleep(0.02)
+        running.remove(i)
+        return i
+
+    async def scenario():
+        futures = [scheduler.submit(i, "excursion", task, i) for i in range(5)]
+        assert scheduler.pending() == 5
+        return await wait_all(futures)
+
+    assert run(scenario()) == [0, 1, 2, 3, 4]
+    assert max(peak) == 2
+    assert scheduler._running == 0
+
+def test_cancel_drops_only_queued_tasks_of_group():
+    scheduler = PrefetchScheduler(workers=1)
+    started = []
+    release = None
+
+    async def task(name):
+        started.append(name)
+        if name == "excursion":
+            await release.wait()
+        return name
+
+    async def scenario():
+        nonlocal release
+        release = asyncio.Event()
+        running = scheduler.submit("user", "excursion", task, "excursion", priority=0)
+        queued = scheduler.submit("user", "reviews", task, "reviews", priority=1)
+        other = scheduler.submit("other", "reviews", task, "other", priority=2)
+        while not started:
+            await asyncio.sleep(0.01)
+
+        scheduler.cancel("user")
+        assert scheduler.get("user", "reviews") is None
+        release.set()
+        # Уже начатая задача доводится до конца
+        assert await asyncio.wrap_future(running) == "excursion"
+        assert await asyncio.wrap_future(other) == "other"
+        return queued
+
+    queued = run(scenario())
+    assert queued.cancelled()
+    assert started == ["excursion", "other"]
+
+def test_failed_task_does_not_stop_worker():
+    scheduler = PrefetchScheduler(workers=1)
+
+    async def fail():
+        raise ValueError("API недоступен")
+
+    async def succeed():
+        return "отзывы"
+
+    async def scenario():
+        return await wait_all([scheduler.submit("user", "excursion", fail), scheduler.submit("user", "reviews", succeed)])
+
+    error, result = run(scenario())
+    assert isinstance(error, ValueError)
+    assert result == "отзывы"
+    assert scheduler.get("user", "reviews") is None
@@ -0,0 +1,97 @@
+import pickle
+import pytest
+import session_store
+from session_store import MemoryBackend, SQLiteBackend, SessionStore, Place
+
+class FakeClock:
+    """Подменяет модуль time в session_store: время идёт только по вызову advance"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(session_store, "time", fake)
+    return fake
+
+def test_memory_session_expires_after_idle_ttl(clock):
+    backend = MemoryBackend()
+    backend.store(1, b"data", idle_ttl=60)
+    clock.advance(59)
+    assert backend.load(1, idle_ttl=60) == b"data"
+    clock.advance(60)
+    assert backend.load(1, idle_ttl=60) is None
+    assert backend.stats() == (0, 0)
+
+def test_memory_load_extends_session(clock):
+    backend = MemoryBackend()
+    backend.store(1, b"active", idle_ttl=60)
+    backend.store(2, b"idle", idle_ttl=60)
+    for _ in range(3):
+        clock.advance(40)
+        assert backend.load(1, idle_ttl=60) == b"active"
+    # Чтение сдвигает сессию в конец очереди: при следующей записи
+    # вытесняется только простаивающая сессия
+    backend.store(3, b"new", idle_ttl=60)
+    assert backend.load(1, idle_ttl=60) == b"active"
+    assert backend.load(2, idle_ttl=60) is None
+    assert backend.stats() == (2, len(b"active") + len(b"new"))
+
+def test_memory_evicts_least_recent_over_byte_limit(clock):
+    backend = MemoryBackend(max_bytes=10)
+    backend.store(1, b"aaaa", idle_ttl=60)
+    backend.store(2, b"bbbb", idle_ttl=60)
+    clock.advance(1)
+    backend.load(1, idle_ttl=60)
+    backend.store(3, b"cccc", idle_ttl=60)
+    assert backend.load(2, idle_ttl=60) is None
+    assert backend.load(1, idle_ttl=60) == b"aaaa"
+    assert backend.stats() == (2, 8)
+
+def test_memory_store_replaces_session_size(clock):
+    backend = MemoryBackend()
+    backend.store(1, b"long session", idle_ttl=60)
+    backend.store(1, b"short", idle_ttl=60)
+    assert backend.stats() == (1, len(b"short"))
+
+def test_sqlite_session_expires_after_idle_ttl(clock, tmp_path):
+    backend = SQLiteBackend(str(tmp_path / "sessions.sqlite3"))
+    backend.store(1, b"data", idle_ttl=60)
+    clock.advance(40)
+    assert backend.load(1, idle_ttl=60) == b"data"
+    clock.advance(40)
+    assert backend.load(1, idle_ttl=60) == b"data"
+    clock.advance(60)
+    assert backend.load(1, idle_ttl=60) is None
+
+def test_session_store_round_trip(clock):
+    store = SessionStore(MemoryBackend(), idle_ttl=60)
+    place = Place("1", "ГУМ", 55.7547, 37.6215, "Красная площадь, 3", 120.0)
+    store.save(7, {"places": [place], "radius": 1000})
+    session = store.get(7)
+    assert session["radius"] == 1000
+    assert session["places"][0].coordinates == (55.7547, 37.6215)
+    clock.advance(61)
+    assert store.get(7) is None
+
+def test_session_store_update(clock):
+    store = SessionStore(MemoryBackend(), idle_ttl=60)
+    assert store.update(7, lambda session: session.update(radius=500)) is False
+    store.save(7, {"radius": 1000})
+    assert store.update(7, lambda session: session.update(radius=500)) is True
+    assert store.get(7) == {"radius": 500}
+
+def test_place_pickles_compactly():
+    place = Place("1", "ГУМ", 55.7547, 37.6215)
+    restored = pickle.loads(pickle.dumps(place, pickle.HIGHEST_PROTOCOL))
+    assert (restored.place_id, restored.name, restored.coordinates) == ("1", "ГУМ", (55.7547, 37.6215))
@@ -0,0 +1,45 @@
+import random
+import pytest
+from geo import haversine
+from tour import plan_tour
+
+def _route_length(start, stops, order):
+    points = [start] + [stops[i] for i in order]
+    return sum(haversine(*a, *b) for a, b in zip(points, points[1:]))
+
+def test_empty_tour():
+    assert plan_tour((55.75, 37.62), []) == ([], 0.0)
+
+def test_single_stop():
+    order, length = plan_tour((55.75, 37.62), [(55.76, 37.62)])
+    assert order == [0]
+    assert length == pytest.approx(haversine(55.75, 37.62, 55.76, 37.62))
+
+def test_points_on_a_line_are_visited_in_order():
+    start = (55.75, 37.62)
+    stops = [(55.75 + 0.001 * i, 37.62) for i in (4, 1, 3, 5, 2)]
+    order, _ = plan_tour(start, stops)
+    assert [stops[i] for i in order] == sorted(stops)
+
+@pytest.mark.parametrize("seed", range(5))
+def test_tour_is_a_permutation_no_longer_than_input_order(seed):
+    rng = random.Random(seed)
+    start = (55.75, 37.62)
+    stops = [(55.75 + rng.uniform(-0.02, 0.02), 37.62 + rng.uniform(-0.03, 0.03)) for _ in range(30)]
+
+    order, length = plan_tour(start, stops)
+
+    assert sorted(order) == list(range(len(stops)))
+    assert length == pytest.approx(_route_length(start, stops, order))
+    # Для случайных точек порядок из результатов поиска заметно длиннее оптимизированного
+    assert length < 0.5 * _route_length(start, stops, range(len(stops)))
+
+def test_two_opt_removes_crossing():
+    # Обход углов квадрата "крест-накрест" длиннее обхода по периметру
+    start = (55.750, 37.620)
+    stops = [(55.760, 37.636), (55.760, 37.620), (55.750, 37.636)]
+    order, length = plan_tour(start, stops)
+    assert length == pytest.approx(min(
+        _route_length(start, stops, [1, 0, 2]),
+        _route_length(start, stops, [2, 0, 1]),
+    ))
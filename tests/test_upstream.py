@@ -0,0 +1,301 @@
+import time
+import asyncio
+import pytest
+import async_runtime
+import upstream
+from upstream import (
+    INTERACTIVE, PREFETCH, WARMUP, TokenBucket, CircuitBreaker, UpstreamOverloaded, UpstreamUnavailable, _Waiter
+)
+
+def make_waiter(level, deadline=10.0):
+    return _Waiter(level, time.monotonic() + deadline)
+
+def test_bucket_allows_burst_without_waiting():
+    bucket = TokenBucket("test", rate=1, burst=3)
+
+    async def scenario():
+        started = time.monotonic()
+        for _ in range(3):
+            await bucket.acquire(make_waiter(INTERACTIVE))
+        return time.monotonic() - started
+
+    assert async_runtime.run(scenario()) < 0.1
+    assert bucket.shed == 0
+
+def test_bucket_without_rate_is_unlimited():
+    bucket = TokenBucket("test", rate=0, burst=1)
+
+    async def scenario():
+        for _ in range(100):
+            await bucket.acquire(make_waiter(WARMUP))
+
+    async_runtime.run(scenario(), timeout=1)
+    assert bucket.queued() == 0
+
+def test_bucket_serves_waiters_by_priority():
+    bucket = TokenBucket("test", rate=20, burst=1)
+    order = []
+
+    async def request(name, level):
+        await bucket.acquire(make_waiter(level))
+        order.append(name)
+
+    async def scenario():
+        await bucket.acquire(make_waiter(INTERACTIVE))
+        # Фоновые запросы встали в очередь раньше, но пользователь обслуживается первым
+        tasks = []
+        for name, level in (("warmup", WARMUP), ("prefetch", PREFETCH), ("interactive", INTERACTIVE)):
+            tasks.append(asyncio.create_task(request(name, level)))
+            await asyncio.sleep(0)
+        assert bucket.queued() == 3
+        await asyncio.gather(*tasks)
+
+    async_runtime.run(scenario(), timeout=5)
+    assert order == ["interactive", "prefetch", "warmup"]
+
+def test_bucket_boost_moves_waiter_forward():
+    bucket = TokenBucket("test", rate=20, burst=1)
+    order = []
+
+    async def request(name, waiter):
+        await bucket.acquire(waiter)
+        order.append(name)
+
+    async def scenario():
+        await bucket.acquire(make_waiter(INTERACTIVE))
+        background = make_waiter(WARMUP)
+        tasks = [asyncio.create_task(request("background", background))]
+        await asyncio.sleep(0)
+        tasks.append(asyncio.create_task(request("prefetch", make_waiter(PREFETCH))))
+        await asyncio.sleep(0)
+        bucket.boost(background, INTERACTIVE)
+        await asyncio.gather(*tasks)
+
+    async_runtime.run(scenario(), timeout=5)
+    assert order == ["background", "prefetch"]
+
+def test_bucket_sheds_request_that_would_miss_deadline():
+    bucket = TokenBucket("test", rate=1, burst=1)
+
+    async def scenario():
+        await bucket.acquire(make_waiter(INTERACTIVE))
+        started = time.monotonic()
+        with pytest.raises(UpstreamOverloaded):
+            # Следующий токен будет только через секунду
+            await bucket.acquire(make_waiter(PREFETCH, deadline=0.2))
+        return time.monotonic() - started
+
+    # Отбрасывается сразу, а не по истечении срока
+    assert async_runtime.run(scenario(), timeout=5) < 0.1
+    assert bucket.shed == 1
+    assert bucket.queued() == 0
+
+def test_bucket_interactive_waits_past_deadline_alone():
+    bucket = TokenBucket("test", rate=10, burst=1)
+
+    async def scenario():
+        await bucket.acquire(make_waiter(INTERACTIVE))
+        started = time.monotonic()
+        # Токены для обоих запросов будут позже их крайнего срока, но других классов в очереди нет
+        await asyncio.gather(
+            bucket.acquire(make_waiter(INTERACTIVE, deadline=0.05)),
+            bucket.acquire(make_waiter(INTERACTIVE, deadline=0.05)),
+        )
+        return time.monotonic() - started
+
+    assert async_runtime.run(scenario(), timeout=5) >= 0.15
+    assert bucket.shed == 0
+
+def test_bucket_overdue_interactive_shed_when_background_waits():
+    bucket = TokenBucket("test", rate=5, burst=1)
+
+    async def scenario():
+        await bucket.acquire(make_waiter(INTERACTIVE))
+        user = asyncio.create_task(bucket.acquire(make_waiter(INTERACTIVE, deadline=0.05)))
+        await asyncio.sleep(0.1)
+        assert not user.done()
+        # Появился менее важный запрос - просроченный запрос пользователя уступает ему место
+        background = asyncio.create_task(bucket.acquire(make_waiter(PREFETCH)))
+        with pytest.raises(UpstreamOverloaded):
+            await user
+        await background
+
+    async_runtime.run(scenario(), timeout=5)
+    assert bucket.shed == 1
+    assert bucket.queued() == 0
+
+def test_bucket_full_queue_drops_least_important():
+    bucket = TokenBucket("test", rate=20, burst=1, max_queue=1)
+
+    async def scenario():
+        await bucket.acquire(make_waiter(INTERACTIVE))
+        background = asyncio.create_task(bucket.acquire(make_waiter(WARMUP)))
+        await asyncio.sleep(0)
+        # Запрос пользователя вытесняет фоновый
+        await bucket.acquire(make_waiter(INTERACTIVE))
+        with pytest.raises(UpstreamOverloaded):
+            await background
+
+        await bucket.acquire(make_waiter(INTERACTIVE))
+        queued = asyncio.create_task(bucket.acquire(make_waiter(INTERACTIVE)))
+        await asyncio.sleep(0)
+        # Менее важному запросу в заполненной очереди места нет
+        with pytest.raises(UpstreamOverloaded):
+            await bucket.acquire(make_waiter(WARMUP))
+        await queued
+
+    async_runtime.run(scenario(), timeout=5)
+    assert bucket.shed == 2
+
+def test_bucket_cancelled_waiter_leaves_queue():
+    bucket = TokenBucket("test", rate=1, burst=1)
+
+    async def scenario():
+        await bucket.acquire(make_waiter(INTERACTIVE))
+        task = asyncio.create_task(bucket.acquire(make_waiter(PREFETCH)))
+        await asyncio.sleep(0)
+        assert bucket.queued() == 1
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    async_runtime.run(scenario(), timeout=5)
+    assert bucket.queued() == 0
+
+def test_bucket_pause_delays_tokens():
+    bucket = TokenBucket("test", rate=100, burst=5)
+
+    async def scenario():
+        bucket.pause(0.2)
+        started = time.monotonic()
+        await bucket.acquire(make_waiter(INTERACTIVE))
+        return time.monotonic() - started
+
+    assert async_runtime.run(scenario(), timeout=5) >= 0.2
+
+def test_acquire_uses_task_priority(monkeypatch):
+    bucket = TokenBucket("test", rate=1, burst=1)
+    monkeypatch.setitem(upstream._buckets, "test", bucket)
+
+    async def scenario():
+        await upstream.acquire("test")
+        with upstream.priority(PREFETCH):
+            task = asyncio.create_task(upstream.acquire("test"))
+        await asyncio.sleep(0)
+        waiter = bucket._heap[0]
+        task.cancel()
+        return waiter.priority
+
+    assert async_runtime.run(scenario(), timeout=5) == PREFETCH
+
+def test_quota_is_split_between_processes(monkeypatch):
+    monkeypatch.setattr(upstream, "UPSTREAM_PROCESSES", 4)
+    monkeypatch.setenv("UPSTREAM_RATE_TEST", "20")
+    monkeypatch.setenv("UPSTREAM_BURST_TEST", "2")
+    assert upstream._quota_from_env("TEST", "0", "1") == (5.0, 1.0)
+
+class FakeClock:
+    """Подменяет модуль time в upstream: время идёт только по вызову advance"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(upstream, "time", fake)
+    return fake
+
+def test_breaker_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker("test", failure_threshold=3, reset_timeout=30)
+    for _ in range(2):
+        breaker.allow()
+        breaker.record_failure()
+    breaker.record_success()
+    # Успешный ответ сбрасывает счётчик ошибок
+    for _ in range(2):
+        breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(UpstreamUnavailable):
+        breaker.allow()
+    assert breaker.rejected == 1
+
+def test_breaker_half_open_lets_single_probe(clock):
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=30)
+    breaker.record_failure()
+    clock.advance(29)
+    with pytest.raises(UpstreamUnavailable):
+        breaker.allow()
+
+    clock.advance(1)
+    probe = breaker.allow()
+    assert probe is True
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    # Пока пробный запрос выполняется, остальные не отправляются
+    with pytest.raises(UpstreamUnavailable):
+        breaker.allow()
+
+    breaker.record_success(probe)
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow() is False
+
+def test_breaker_failed_probe_opens_again(clock):
+    breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=30)
+    breaker.record_failure()
+    breaker.record_failure()
+    clock.advance(30)
+    probe = breaker.allow()
+    breaker.record_failure(probe)
+    assert breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(UpstreamUnavailable):
+        breaker.allow()
+    clock.advance(30)
+    breaker.allow()
+
+def test_breaker_ignores_late_responses_while_open(clock):
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=30)
+    breaker.record_failure()
+    # Ответ на запрос, отправленный до размыкания, цепь не замыкает
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.OPEN
+    breaker.record_failure()
+    clock.advance(30)
+    assert breaker.allow() is True
+
+def test_breaker_closes_only_on_probe_success(clock):
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=30)
+    breaker.record_failure()
+    clock.advance(30)
+    probe = breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    breaker.record_success(probe)
+    assert breaker.state == CircuitBreaker.CLOSED
+
+def test_breaker_lost_probe_is_replaced(clock):
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=30)
+    breaker.record_failure()
+    clock.advance(30)
+    breaker.allow()
+    # Результат пробного запроса так и не пришёл
+    clock.advance(30)
+    breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+
+def test_breaker_without_threshold_never_opens(clock):
+    breaker = CircuitBreaker("test", failure_threshold=0, reset_timeout=30)
+    for _ in range(100):
+        breaker.record_failure()
+    breaker.allow()
+    assert breaker.state == CircuitBreaker.CLOSED
@@ -0,0 +1,35 @@
+import pytest
+from webhook import get_shard_key, get_shard
+
+USER = {"id": 123456789, "is_bot": False, "first_name": "Анна"}
+CHAT = {"id": 123456789, "type": "private"}
+
+def make_updates(user):
+    """Обновления разных типов от одного пользователя"""
+    message = {"message_id": 1, "from": user, "chat": CHAT, "date": 0, "text": "/start"}
+    return [
+        {"update_id": 1, "message": message},
+        {"update_id": 2, "edited_message": dict(message, location={"latitude": 55.75, "longitude": 37.62})},
+        {"update_id": 3, "callback_query": {"id": "7", "from": user, "message": message, "data": "radius_500"}},
+    ]
+
+def test_shard_key_is_sender_id():
+    assert [get_shard_key(update) for update in make_updates(USER)] == [USER["id"]] * 3
+    assert get_shard_key({"update_id": 4, "poll_answer": {"poll_id": "1", "user": USER, "option_ids": [0]}}) == USER["id"]
+
+def test_shard_key_without_sender_falls_back_to_update_id():
+    assert get_shard_key({"update_id": 42, "poll": {"id": "1", "question": "?"}}) == 42
+    assert get_shard_key({"update_id": 43, "message": {"message_id": 1, "chat": CHAT}}) == 43
+
+@pytest.mark.parametrize("workers, threads", [(1, 8), (4, 8), (3, 5)])
+def test_updates_of_one_user_share_process_and_thread(workers, threads):
+    for user_id in (USER["id"], 1, 987654321012):
+        user = dict(USER, id=user_id)
+        shards = {get_shard(get_shard_key(update), workers, threads) for update in make_updates(user)}
+        assert shards == {(user_id % workers, user_id // workers % threads)}
+
+def test_shard_uses_all_threads_of_process():
+    workers, threads = 4, 8
+    # Ключи одного процесса сравнимы по модулю workers, но распределяются по всем его потокам
+    used = {get_shard(key, workers, threads) for key in range(1, 1000, workers)}
+    assert used == {(1, thread) for thread in range(threads)}
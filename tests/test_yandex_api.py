@@ -0,0 +1,269 @@
+import pytest
+import async_runtime
+import http_client
+import yandex_api
+from cache import TTLCache
+from geo import geohash_encode, geohash_bounds
+
+CENTER = (55.7539, 37.6208)
+
+def make_feature(i, lat, lng, name=None):
+    """Объект GeoJSON в формате ответа поиска Яндекса"""
+    return {
+        "properties": {
+            "name": name or f"Место {i}",
+            "CompanyMetaData": {"id": str(i), "address": f"Улица {i}"},
+        },
+        "geometry": {"coordinates": [lng, lat]},
+    }
+
+class FakeResponse:
+    def __init__(self, data):
+        self.data = data
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.data
+
+class FakeSearch:
+    """
+    Подменяет http_client.request_async: отвечает на поиск страницей из features
+
+    Запросы записываются вместе с параметрами, чтобы проверять, сколько
+    обращений к API потребовалось.
+    """
+
+    def __init__(self):
+        self.features = []
+        self.requests = []
+
+    async def request_async(self, method, url, endpoint="default", retries=None, operation=None, **kwargs):
+        params = kwargs.get("params", {})
+        self.requests.append((operation, params))
+        skip = params.get("skip", 0)
+        return FakeResponse({"features": self.respond(params)[skip:skip + params["results"]]})
+
+    def respond(self, params):
+        return self.features
+
+@pytest.fixture
+def search(monkeypatch):
+    fake = FakeSearch()
+    monkeypatch.setattr(http_client, "request_async", fake.request_async)
+    # Пустые кэши и без локальной базы мест, чтобы каждый тест начинался с промаха
+    monkeypatch.setattr(yandex_api, "_tile_cache", TTLCache(maxsize=100, ttl=900, stale_ttl=3600))
+    monkeypatch.setattr(yandex_api, "_place_cache", TTLCache(maxsize=100, ttl=3600))
+    monkeypatch.setattr(yandex_api, "poi_index", None)
+    return fake
+
+def run(coro):
+    return async_runtime.run(coro, timeout=5)
+
+def test_place_details_served_from_remembered_places(search):
+    place = yandex_api._normalize_feature(make_feature(42, *CENTER, name="ГУМ"))
+    yandex_api.remember_places([dict(place, distance=120.0)])
+
+    details = run(yandex_api.get_place_details_async("42"))
+    assert details == place
+    assert "distance" not in details
+    assert search.requests == []
+
+def test_place_details_after_search_need_no_request(search):
+    search.features = [make_feature(i, CENTER[0] + 0.001 * i, CENTER[1]) for i in range(1, 4)]
+    places = run(yandex_api.get_nearby_places_async(*CENTER, 500))
+    requests_made = len(search.requests)
+
+    details = run(yandex_api.get_place_details_async(places[0]["place_id"]))
+    assert details["name"] == places[0]["name"]
+    assert details["formatted_address"] == "Улица 1"
+    assert len(search.requests) == requests_made
+
+def test_place_details_miss_fetches_and_caches(search):
+    search.features = [make_feature(7, *CENTER, name="Большой театр")]
+
+    details = run(yandex_api.get_place_details_async("7"))
+    assert details["place_id"] == "7"
+    assert details["name"] == "Большой театр"
+    assert [(operation, params["text"]) for operation, params in search.requests] == [("details", "7")]
+
+    # Повторное открытие карточки обслуживается из кэша
+    assert run(yandex_api.get_place_details_async("7")) == details
+    assert len(search.requests) == 1
+
+def test_place_details_unknown_place(search):
+    assert run(yandex_api.get_place_details_async("missing")) == {}
+    assert len(search.requests) == 1
+
+def tile_points(precision=6):
+    """Две точки одной ячейки geohash и точка соседней ячейки, все в нескольких метрах от границы"""
+    tile = geohash_encode(*CENTER, precision)
+    min_lat, min_lng, max_lat, max_lng = geohash_bounds(tile)
+    lat = (min_lat + max_lat) / 2
+    return (lat, max_lng - 0.0001), (lat, max_lng - 0.0002), (lat, max_lng + 0.0001)
+
+def test_neighbouring_points_get_tile_keys_by_cell():
+    inside, same_cell, neighbour = tile_points()
+    tile = geohash_encode(*inside, 6)
+    assert geohash_encode(*same_cell, 6) == tile
+    assert geohash_encode(*neighbour, 6) != tile
+    # Ячейки меньшего радиуса вложены в ячейки большего
+    assert geohash_encode(*inside, 7).startswith(tile)
+
+def test_tile_places_cached_per_tile_and_text(search):
+    search.features = [make_feature(i, CENTER[0] + 0.001 * i, CENTER[1]) for i in range(1, 4)]
+    tile = geohash_encode(*CENTER, 6)
+
+    first = run(yandex_api._get_tile_places(tile, "музей", 1000, 50))
+    assert run(yandex_api._get_tile_places(tile, "музей", 1000, 50)) == first
+    assert len(search.requests) == 1
+    # Другой текст запроса - отдельная запись кэша
+    run(yandex_api._get_tile_places(tile, "парк", 1000, 50))
+    assert len(search.requests) == 2
+
+def test_nearby_coordinates_reuse_tile(search):
+    inside, same_cell, neighbour = tile_points()
+    search.features = [make_feature(1, *inside)]
+
+    run(yandex_api.get_nearby_places_async(*inside, 500))
+    # Соседняя точка той же ячейки с другим радиусом обслуживается из кэша
+    run(yandex_api.get_nearby_places_async(*same_cell, 300))
+    assert len(search.requests) == 1
+
+    run(yandex_api.get_nearby_places_async(*neighbour, 500))
+    assert len(search.requests) == 2
+    assert search.requests[0][1]["ll"] != search.requests[1][1]["ll"]
+
+def test_filter_by_radius_trims_superset():
+    offsets = [0.004, 0.001, 0.02, 0.002, 0.008]
+    superset = [
+        yandex_api._normalize_feature(make_feature(i, CENTER[0] + offset, CENTER[1]))
+        for i, offset in enumerate(offsets)
+    ]
+    places = yandex_api.filter_by_radius(superset, *CENTER, 500)
+    assert [place["place_id"] for place in places] == ["1", "3", "0"]
+    assert all(place["distance"] <= 500 for place in places)
+    assert places[0]["distance"] < places[1]["distance"] < places[2]["distance"]
+    # Исходные записи не изменяются
+    assert all("distance" not in place for place in superset)
+
+    assert [place["place_id"] for place in yandex_api.filter_by_radius(superset, *CENTER, 5000, limit=2)] == ["1", "3"]
+    assert yandex_api.filter_by_radius([], *CENTER, 500) == []
+
+class FakeTiles:
+    """Подменяет _search_tile: отвечает местами по радиусу запроса"""
+
+    def __init__(self, superset, direct):
+        self.pages = {yandex_api.SEARCH_SUPERSET_RADIUS: superset}
+        self.direct = direct
+        self.radii = []
+
+    async def search(self, tile, text, radius, limit, skip=0):
+        self.radii.append(radius)
+        places = self.pages.get(radius, self.direct)
+        return [yandex_api._normalize_feature(feature) for feature in places[skip:skip + limit]]
+
+def far_features(count, start=100):
+    """Места в 1.5-2 км от центра - вне круга пользователя"""
+    return [make_feature(start + i, CENTER[0] + 0.014 + 0.00001 * i, CENTER[1]) for i in range(count)]
+
+@pytest.fixture
+def tiles(search, monkeypatch):
+    fake = FakeTiles([], [])
+    monkeypatch.setattr(yandex_api, "_search_tile", fake.search)
+    return fake
+
+def test_truncated_superset_falls_back_to_direct_query(tiles):
+    # Выдача с большим радиусом заполнена дальними местами, ближнее место в неё не попало
+    tiles.pages[yandex_api.SEARCH_SUPERSET_RADIUS] = far_features(yandex_api.SEARCH_SUPERSET_RESULTS)
+    tiles.direct = [make_feature(1, CENTER[0] + 0.001, CENTER[1])]
+
+    places = run(yandex_api.get_nearby_places_async(*CENTER, 300, expand_radii=[1000]))
+    assert [place["place_id"] for place in places] == ["1"]
+    assert places[0]["distance"] <= 300
+    assert tiles.radii == [yandex_api.SEARCH_SUPERSET_RADIUS, 300]
+
+def test_direct_query_without_places_still_expands(tiles):
+    near = [make_feature(1, CENTER[0] + 0.006, CENTER[1])]
+    tiles.pages[yandex_api.SEARCH_SUPERSET_RADIUS] = near + far_features(yandex_api.SEARCH_SUPERSET_RESULTS - 1)
+
+    places = run(yandex_api.get_nearby_places_async(*CENTER, 300, expand_radii=[1000, 5000]))
+    assert [place["place_id"] for place in places] == ["1"]
+    assert 300 < places[0]["distance"] <= 1000
+    assert tiles.radii == [yandex_api.SEARCH_SUPERSET_RADIUS, 300]
+
+def test_exhausted_superset_expands_without_direct_query(tiles):
+    near = [make_feature(1, CENTER[0] + 0.006, CENTER[1])]
+    tiles.pages[yandex_api.SEARCH_SUPERSET_RADIUS] = near + far_features(10)
+
+    places = run(yandex_api.get_nearby_places_async(*CENTER, 300, expand_radii=[1000]))
+    assert [place["place_id"] for place in places] == ["1"]
+    assert 300 < places[0]["distance"] <= 1000
+    assert tiles.radii == [yandex_api.SEARCH_SUPERSET_RADIUS]
+
+def test_full_circle_needs_no_direct_query(tiles):
+    near = [make_feature(i, CENTER[0] + 0.0001 * i, CENTER[1]) for i in range(1, 6)]
+    tiles.pages[yandex_api.SEARCH_SUPERSET_RADIUS] = near + far_features(yandex_api.SEARCH_SUPERSET_RESULTS)
+
+    places = run(yandex_api.get_nearby_places_async(*CENTER, 300, limit=5))
+    assert len(places) == 5
+    assert tiles.radii == [yandex_api.SEARCH_SUPERSET_RADIUS]
+
+def make_place(place_id, lat, lng, name=None):
+    return {"place_id": place_id, "name": name or f"Место {place_id}", "geometry": {"location": {"lat": lat, "lng": lng}}}
+
+def test_merge_places_dedupes_by_id_and_keeps_first():
+    first = make_place("1", 55.75, 37.62, "ГУМ")
+    moved = make_place("1", 55.76, 37.63, "ГУМ (другая точка)")
+    other = make_place("2", 55.77, 37.64)
+    merged = yandex_api._merge_places([[first, other], None, [moved]])
+    assert merged == [first, other]
+    assert merged[0]["name"] == "ГУМ"
+
+def test_merge_places_dedupes_by_rounded_coordinates():
+    first = make_place("1", 55.753901, 37.620801)
+    # Те же координаты с точностью до 5 знаков под другим идентификатором
+    same_point = make_place("2", 55.753904, 37.620799)
+    nearby = make_place("3", 55.75391, 37.62081)
+    assert [place["place_id"] for place in yandex_api._merge_places([[first], [same_point, nearby]])] == ["1", "3"]
+
+def test_merge_places_without_id_compares_coordinates_only():
+    places = [make_place("", 55.75, 37.62), make_place("", 55.76, 37.63), make_place("", 55.75, 37.62)]
+    assert yandex_api._merge_places([places]) == places[:2]
+    assert yandex_api._merge_places([None, []]) == []
+
+def test_query_texts_by_category():
+    assert yandex_api._get_query_texts(None) == ["достопримечательность"]
+    assert yandex_api._get_query_texts(["restaurant"]) == ["достопримечательность"]
+    assert yandex_api._get_query_texts(["zoo"]) == ["зоопарк|аквариум|парк развлечений"]
+    # Один текст на категорию, в порядке QUERY_TEXTS, сколько бы типов категории ни было выбрано
+    assert yandex_api._get_query_texts(["library", "park", "museum", "historic"]) == [
+        "музей|памятник|достопримечательность",
+        "парк|сад|природная достопримечательность",
+        "галерея|библиотека|выставка",
+    ]
+
+def test_fetch_more_pages_tile_with_skip(search):
+    radius = yandex_api.SEARCH_SUPERSET_RADIUS + 1000
+    search.features = [make_feature(i, CENTER[0] + 0.0001 * i, CENTER[1]) for i in range(70)]
+
+    assert len(run(yandex_api.get_nearby_places_async(*CENTER, radius, limit=20))) == 20
+    places = run(yandex_api.get_nearby_places_async(*CENTER, radius, limit=60, fetch_more=True))
+    assert [place["place_id"] for place in places] == [str(i) for i in range(60)]
+    # Выдача закончилась раньше limit - ячейка отмечена исчерпанной
+    assert len(run(yandex_api.get_nearby_places_async(*CENTER, radius, limit=100, fetch_more=True))) == 70
+    assert len(run(yandex_api.get_nearby_places_async(*CENTER, radius, limit=120, fetch_more=True))) == 70
+    assert [(params.get("skip", 0), params["results"]) for _, params in search.requests] == [(0, 50), (50, 10), (60, 40)]
+
+def test_fetch_more_pages_until_circle_filled(search):
+    radius = yandex_api.SEARCH_SUPERSET_RADIUS + 1000
+    # Первая страница выдачи целиком за пределами круга
+    far = [make_feature(i, CENTER[0] + 0.03, CENTER[1] + 0.0001 * i) for i in range(50)]
+    near = [make_feature(100 + i, CENTER[0] + 0.0001 * i, CENTER[1]) for i in range(30)]
+    search.features = far + near
+
+    assert run(yandex_api.get_nearby_places_async(*CENTER, radius, limit=20)) == []
+    places = run(yandex_api.get_nearby_places_async(*CENTER, radius, limit=20, fetch_more=True))
+    assert [place["place_id"] for place in places] == [str(100 + i) for i in range(20)]
+    assert len(search.requests) == 2
@@ -0,0 +1,115 @@
+import numpy as np
+from geo import distance_matrix
+
+# Минимальное улучшение маршрута (в метрах), ради которого выполняется перестановка
+IMPROVEMENT_EPS = 1e-6
+
+# Ограничение количества проходов улучшения (на практике хватает нескольких)
+MAX_PASSES = 100
+
+def plan_tour(start, stops):
+    """
+    Строит короткий пешеходный маршрут через все точки, начиная от пользователя
+
+    Решает задачу коммивояжёра без возврата в начало эвристиками:
+    ближайший сосед для начального маршрута, затем улучшения 2-opt
+    (разворот участка) и Or-opt (перенос цепочки из 1-3 точек).
+    Для нескольких десятков точек занимает единицы миллисекунд.
+
+    Args:
+        start (tuple): Начальная точка (широта, долгота)
+        stops (list): Точки маршрута [(широта, долгота), ...]
+
+    Returns:
+        tuple: (порядок обхода - индексы stops, длина маршрута в метрах по прямой)
+    """
+    if not stops:
+        return [], 0.0
+
+    points = [start] + list(stops)
+    dist = distance_matrix([point[0] for point in points], [point[1] for point in points])
+
+    route = _nearest_neighbour(dist)
+    for _ in range(MAX_PASSES):
+        if not (_two_opt(route, dist) or _or_opt(route, dist)):
+            break
+
+    order = [int(i) - 1 for i in route[1:]]
+    return order, float(dist[route[:-1], route[1:]].sum())
+
+def _nearest_neighbour(dist):
+    """Начальный маршрут: из каждой точки идём в ближайшую ещё не посещённую"""
+    n = len(dist)
+    visited = np.zeros(n, dtype=bool)
+    route = np.empty(n, dtype=np.int64)
+    route[0] = 0
+    visited[0] = True
+    for position in range(1, n):
+        distances = np.where(visited, np.inf, dist[route[position - 1]])
+        route[position] = int(np.argmin(distances))
+        visited[route[position]] = True
+    return route
+
+def _two_opt(route, dist):
+    """
+    Ищет и применяет лучший разворот участка route[i..j] для каждого i
+
+    Returns:
+        bool: True, если маршрут улучшен
+    """
+    n = len(route)
+    improved = False
+    for i in range(1, n - 1):
+        a, b = route[i - 1], route[i]
+        ends = route[i + 1:]
+        # Точка после участка; у последней точки маршрута её нет
+        after = np.append(route[i + 2:], -1)
+        has_after = after >= 0
+        after = np.where(has_after, after, 0)
+
+        delta = dist[a, ends] - dist[a, b]
+        delta += np.where(has_after, dist[b, after] - dist[ends, after], 0.0)
+
+        best = int(np.argmin(delta))
+        if delta[best] < -IMPROVEMENT_EPS:
+            j = i + 1 + best
+            route[i:j + 1] = route[i:j + 1][::-1].copy()
+            improved = True
+    return improved
+
+def _or_opt(route, dist):
+    """
+    Переносит цепочки из 1-3 точек (возможно, развернув их) в лучшее место маршрута
+
+    Returns:
+        bool: True, если маршрут улучшен
+    """
+    n = len(route)
+    improved = False
+    for length in (1, 2, 3):
+        for i in range(1, n - length + 1):
+            segment = route[i:i + length]
+            first, last = segment[0], segment[-1]
+            prev = route[i - 1]
+            rest = np.concatenate((route[:i], route[i + length:]))
+
+            # Выигрыш от удаления цепочки из текущего места
+            gain = dist[prev, first]
+            if i + length < n:
+                after = route[i + length]
+                gain += dist[last, after] - dist[prev, after]
+
+            # Стоимость вставки между соседними точками оставшегося маршрута и в конец
+            left, right = rest[:-1], rest[1:]
+            base = dist[left, right]
+            forward = np.append(dist[left, first] + dist[last, right] - base, dist[rest[-1], first])
+            backward = np.append(dist[left, last] + dist[first, right] - base, dist[rest[-1], last])
+
+            costs = np.minimum(forward, backward)
+            best = int(np.argmin(costs))
+            if costs[best] < gain - IMPROVEMENT_EPS:
+                if backward[best] < forward[best]:
+                    segment = segment[::-1]
+                route[:] = np.concatenate((rest[:best + 1], segment, rest[best + 1:]))
+                improved = True
+    return improved
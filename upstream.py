@@ -0,0 +1,538 @@
+import os
+import time
+import heapq
+import asyncio
+import logging
+import itertools
+import threading
+import contextvars
+from contextlib import contextmanager
+import requests
+from dotenv import load_dotenv
+import metrics
+
+# Загружаем переменные окружения
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Классы приоритета запросов к внешним API (меньше - важнее)
+INTERACTIVE, PREFETCH, WARMUP = range(3)
+
+PRIORITY_NAMES = {
+    INTERACTIVE: "interactive",
+    PREFETCH: "prefetch",
+    WARMUP: "warmup",
+}
+
+# Максимальное время ожидания своей очереди для каждого класса (в секундах)
+DEADLINES = {
+    INTERACTIVE: float(os.getenv("UPSTREAM_DEADLINE_INTERACTIVE", "10")),
+    PREFETCH: float(os.getenv("UPSTREAM_DEADLINE_PREFETCH", "30")),
+    WARMUP: float(os.getenv("UPSTREAM_DEADLINE_WARMUP", "300")),
+}
+
+# Максимальное количество запросов, ожидающих своей очереди к одному API
+UPSTREAM_QUEUE_SIZE = int(os.getenv("UPSTREAM_QUEUE_SIZE", "200"))
+
+# Размыкатель цепи: после стольких неудачных запросов подряд (каждый - со всеми повторами) запросы к API
+# сразу завершаются ошибкой, а через UPSTREAM_BREAKER_RESET секунд пропускается пробный запрос
+UPSTREAM_BREAKER_FAILURES = int(os.getenv("UPSTREAM_BREAKER_FAILURES", "5"))
+UPSTREAM_BREAKER_RESET = float(os.getenv("UPSTREAM_BREAKER_RESET", "30"))
+
+# Количество процессов бота, между которыми делятся квоты: у каждого процесса
+# свои ограничители частоты (в режиме webhook задаётся по числу рабочих процессов)
+UPSTREAM_PROCESSES = max(int(os.getenv("UPSTREAM_PROCESSES", "1")), 1)
+
+def _quota_from_env(name, rate, burst):
+    """
+    Читает квоту API из переменных окружения
+
+    Квота задаётся на всё приложение и делится поровну между
+    UPSTREAM_PROCESSES процессами.
+
+    Args:
+        name (str): Тип запросов в верхнем регистре (как в http_client.TIMEOUTS)
+        rate (str): Запросов в секунду по умолчанию (0 - без ограничения)
+        burst (str): Размер пачки запросов по умолчанию
+
+    Returns:
+        tuple: (запросов в секунду, размер пачки) для одного процесса
+    """
+    return (
+        float(os.getenv(f"UPSTREAM_RATE_{name}", rate)) / UPSTREAM_PROCESSES,
+        max(float(os.getenv(f"UPSTREAM_BURST_{name}", burst)) / UPSTREAM_PROCESSES, 1.0),
+    )
+
+# Квоты (запросов в секунду, размер пачки) для каждого типа запросов
+QUOTAS = {
+    "default": _quota_from_env("DEFAULT", "0", "1"),
+    "yandex_search": _quota_from_env("YANDEX_SEARCH", "20", "20"),
+    "yandex_static": _quota_from_env("YANDEX_STATIC", "20", "20"),
+    # 50 запросов в минуту - базовый лимит Perplexity API
+    "perplexity": _quota_from_env("PERPLEXITY", "0.8", "5"),
+    # Около 30 сообщений в секунду - общий лимит Telegram Bot API (см. outbox)
+    "telegram": _quota_from_env("TELEGRAM", "30", "30"),
+}
+
+# Класс приоритета и объединённый вызов (Coalescer) текущего потока или задачи asyncio
+_priority = contextvars.ContextVar("upstream_priority", default=INTERACTIVE)
+_call = contextvars.ContextVar("upstream_call", default=None)
+
+class UpstreamOverloaded(requests.exceptions.RequestException):
+    """Запрос отброшен: квота API исчерпана и он не дождался бы своей очереди"""
+
+class UpstreamUnavailable(requests.exceptions.RequestException):
+    """Запрос не отправлен: API недавно перестал отвечать и цепь разомкнута"""
+
+def get_priority():
+    """Возвращает класс приоритета запросов текущего потока или задачи asyncio"""
+    return _priority.get()
+
+@contextmanager
+def priority(level):
+    """
+    Задаёт класс приоритета для запросов к API внутри блока
+
+    Приоритет хранится в контексте (contextvars), поэтому его наследуют
+    задачи asyncio, созданные внутри блока, и корутины, запущенные из
+    него через async_runtime.
+
+    Args:
+        level (int): INTERACTIVE, PREFETCH или WARMUP
+    """
+    token = _priority.set(level)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+class TokenBucket:
+    """
+    Ограничитель частоты запросов к одному API
+
+    Токены выдаются ожидающим в порядке приоритета. Запрос, который
+    заведомо не дождётся токена до своего крайнего срока, или не поместился
+    в очередь, отбрасывается сразу с исключением UpstreamOverloaded.
+    Запрос пользователя ждёт и после крайнего срока, пока в очереди нет
+    менее важных запросов: отбрасывание ничего не освободило бы для других
+    классов, а пользователь получил бы ошибку вместо ответа.
+    Все методы, кроме queued, вызываются из общего цикла событий
+    (async_runtime), поэтому ожидание токена не занимает поток.
+    """
+
+    def __init__(self, name, rate, burst, max_queue=UPSTREAM_QUEUE_SIZE):
+        """
+        Args:
+            name (str): Тип запросов
+            rate (float): Запросов в секунду (0 - без ограничения)
+            burst (float): Максимальное количество накопленных токенов
+            max_queue (int): Максимальное количество ожидающих запросов
+        """
+        self.name = name
+        self.rate = rate
+        self.burst = max(burst, 1.0)
+        self.max_queue = max_queue
+        self.shed = 0
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._heap = []
+
+    async def acquire(self, waiter):
+        """
+        Ждёт токен для запроса
+
+        Args:
+            waiter (_Waiter): Ожидающий запрос с приоритетом и крайним сроком
+
+        Raises:
+            UpstreamOverloaded: Если запрос отброшен
+        """
+        if self.rate <= 0:
+            return
+
+        now = time.monotonic()
+        self._refill(now)
+        if not self._heap and self._tokens >= 1 and now >= self._paused_until:
+            self._tokens -= 1
+            return
+
+        self._enqueue(waiter, now)
+        try:
+            while True:
+                if waiter.rejected:
+                    raise self._reject("очередь переполнена")
+
+                now = time.monotonic()
+                overdue = now >= waiter.deadline
+                if overdue and not self._may_wait_past_deadline(waiter):
+                    self._remove(waiter)
+                    raise self._reject("истёк срок ожидания")
+
+                self._refill(now)
+                # Просроченный запрос ждёт своей очереди или появления менее важного запроса
+                timeout = None if overdue else waiter.deadline - now
+                if self._heap[0] is waiter:
+                    if self._tokens >= 1 and now >= self._paused_until:
+                        heapq.heappop(self._heap)
+                        self._tokens -= 1
+                        self._notify()
+                        return
+                    refill = max((1 - self._tokens) / self.rate, self._paused_until - now)
+                    timeout = refill if timeout is None else min(timeout, refill)
+
+                waiter.event.clear()
+                try:
+                    await asyncio.wait_for(waiter.event.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+        except asyncio.CancelledError:
+            # Запрос больше не нужен (например, выиграл дублирующий запрос) - освобождаем место в очереди
+            if waiter in self._heap:
+                self._remove(waiter)
+            raise
+
+    def boost(self, waiter, level):
+        """
+        Повышает приоритет ожидающего запроса
+
+        Args:
+            waiter (_Waiter): Ожидающий запрос
+            level (int): Новый класс приоритета
+        """
+        if level >= waiter.priority:
+            return
+        waiter.priority = level
+        waiter.deadline = min(waiter.deadline, time.monotonic() + DEADLINES[level])
+        if waiter in self._heap:
+            heapq.heapify(self._heap)
+            self._notify()
+
+    def pause(self, delay):
+        """
+        Приостанавливает выдачу токенов после ответа 429 от API
+
+        Args:
+            delay (float): Пауза в секундах
+        """
+        self._tokens = 0.0
+        self._paused_until = max(self._paused_until, time.monotonic() + delay)
+
+    def queued(self):
+        """Возвращает количество ожидающих запросов"""
+        return len(self._heap)
+
+    def _enqueue(self, waiter, now):
+        """Ставит запрос в очередь или отбрасывает его, если он не успеет получить токен"""
+        ahead = sum(1 for other in self._heap if other < waiter)
+        eta = max((ahead + 1 - self._tokens) / self.rate, self._paused_until - now)
+        if now + eta > waiter.deadline and not self._may_wait_past_deadline(waiter):
+            raise self._reject("квота не позволит выполнить запрос вовремя")
+
+        if len(self._heap) >= self.max_queue:
+            # Вытесняем наименее важный запрос, если новый важнее него
+            worst = max(self._heap)
+            if not waiter < worst:
+                raise self._reject("очередь переполнена")
+            self._heap.remove(worst)
+            heapq.heapify(self._heap)
+            worst.rejected = True
+            worst.event.set()
+
+        heapq.heappush(self._heap, waiter)
+        self._notify()
+
+    def _may_wait_past_deadline(self, waiter):
+        """Проверяет, может ли запрос ждать после крайнего срока: это запрос пользователя и менее важных в очереди нет"""
+        return waiter.priority == INTERACTIVE and all(other.priority == INTERACTIVE for other in self._heap)
+
+    def _remove(self, waiter):
+        """Удаляет запрос из очереди"""
+        self._heap.remove(waiter)
+        heapq.heapify(self._heap)
+        self._notify()
+
+    def _notify(self):
+        """Будит ожидающие запросы, чтобы они проверили, не подошла ли их очередь"""
+        for waiter in self._heap:
+            waiter.event.set()
+
+    def _refill(self, now):
+        """Начисляет токены за прошедшее время"""
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _reject(self, reason):
+        """Создаёт исключение для отброшенного запроса"""
+        self.shed += 1
+        logger.warning("Запрос к %s отброшен: %s", self.name, reason)
+        return UpstreamOverloaded(f"Превышена квота {self.name}: {reason}")
+
+class CircuitBreaker:
+    """
+    Размыкатель цепи для одного API
+
+    После failure_threshold неудачных запросов подряд цепь размыкается, и
+    запросы сразу завершаются UpstreamUnavailable, не занимая потоки
+    ожиданием таймаутов. Через reset_timeout секунд пропускается один
+    пробный запрос: успех замыкает цепь, неудача снова размыкает её.
+    Ответы на запросы, отправленные до размыкания, состояние разомкнутой
+    цепи не меняют.
+    """
+
+    CLOSED, HALF_OPEN, OPEN = range(3)
+
+    def __init__(self, name, failure_threshold=UPSTREAM_BREAKER_FAILURES, reset_timeout=UPSTREAM_BREAKER_RESET):
+        """
+        Args:
+            name (str): Тип запросов
+            failure_threshold (int): Количество неудач подряд, после которого цепь размыкается (0 - никогда)
+            reset_timeout (float): Время до пробного запроса в секундах
+        """
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.rejected = 0
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_started = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """
+        Проверяет, можно ли отправить запрос
+
+        Returns:
+            bool: True, если это пробный запрос после размыкания цепи
+
+        Raises:
+            UpstreamUnavailable: Если цепь разомкнута или пробный запрос уже выполняется
+        """
+        with self._lock:
+            if self.state == self.CLOSED:
+                return False
+
+            now = time.monotonic()
+            if self.state == self.OPEN and now >= self._opened_at + self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self._probe_started = None
+            # Пробный запрос, результат которого не пришёл за reset_timeout, считаем потерянным
+            if self.state == self.HALF_OPEN and (
+                self._probe_started is None or now >= self._probe_started + self.reset_timeout
+            ):
+                self._probe_started = now
+                return True
+
+            self.rejected += 1
+        raise UpstreamUnavailable(f"{self.name} временно недоступен")
+
+    def record_success(self, probe=False):
+        """
+        Отмечает успешный ответ API
+
+        Args:
+            probe (bool): Ответ на пробный запрос (результат allow)
+        """
+        with self._lock:
+            if self.state == self.CLOSED:
+                self._failures = 0
+            elif self.state == self.HALF_OPEN and probe:
+                logger.info("Цепь %s замкнута: API снова отвечает", self.name)
+                self.state = self.CLOSED
+                self._failures = 0
+
+    def record_failure(self, probe=False):
+        """
+        Отмечает неудачный запрос: ошибку соединения, таймаут или ответ 5xx после всех повторов
+
+        Args:
+            probe (bool): Неудача пробного запроса (результат allow)
+        """
+        with self._lock:
+            if self.state == self.HALF_OPEN and probe:
+                self._open()
+            elif self.state == self.CLOSED:
+                self._failures += 1
+                if self.failure_threshold and self._failures >= self.failure_threshold:
+                    self._open()
+
+    def _open(self):
+        """Размыкает цепь (вызывается под замком)"""
+        logger.warning(
+            "Цепь %s разомкнута после %d неудачных запросов подряд, пробный запрос через %.0f с",
+            self.name, self._failures, self.reset_timeout
+        )
+        self.state = self.OPEN
+        self._opened_at = time.monotonic()
+
+class _Waiter:
+    """Запрос, ожидающий токен"""
+
+    __slots__ = ("priority", "sequence", "deadline", "rejected", "event")
+
+    _counter = itertools.count()
+
+    def __init__(self, priority, deadline):
+        self.priority = priority
+        self.sequence = next(self._counter)
+        self.deadline = deadline
+        self.rejected = False
+        self.event = asyncio.Event()
+
+    def __lt__(self, other):
+        return (self.priority, self.sequence) < (other.priority, other.sequence)
+
+class Coalescer:
+    """
+    Объединяет одновременные одинаковые запросы в один
+
+    Работает с корутинами в общем цикле событий и учитывает приоритет:
+    если к запросу фоновой задачи присоединяется пользователь, ожидание
+    токена для этого запроса продолжается с приоритетом пользователя.
+    """
+
+    def __init__(self):
+        self._calls = {}
+
+    async def do(self, key, func, *args, **kwargs):
+        """
+        Выполняет корутину не более одного раза для всех одновременных вызовов с ключом
+
+        Args:
+            key: Ключ, по которому объединяются вызовы
+            func (callable): Корутинная функция
+
+        Returns:
+            Результат корутины (исключение пробрасывается всем ожидающим)
+        """
+        level = get_priority()
+        call = self._calls.get(key)
+        if call is not None:
+            call.boost(level)
+            await call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        call = self._calls[key] = _CoalescedCall(level)
+        parent = _call.get()
+        if parent is not None:
+            call.priority = min(call.priority, parent.priority)
+        token = _call.set(call)
+        try:
+            call.result = await func(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            _call.reset(token)
+            del self._calls[key]
+            call.done.set()
+
+    def in_flight(self, key):
+        """Проверяет, выполняется ли сейчас вызов с указанным ключом"""
+        return key in self._calls
+
+class _CoalescedCall:
+    """Состояние выполняющегося объединённого вызова"""
+
+    def __init__(self, priority):
+        self.done = asyncio.Event()
+        self.result = None
+        self.error = None
+        self.priority = priority
+        self.bucket = None
+        self.waiter = None
+
+    def boost(self, level):
+        """Повышает приоритет вызова и его ожидания токена"""
+        if level >= self.priority:
+            return
+        self.priority = level
+        if self.waiter is not None:
+            self.bucket.boost(self.waiter, level)
+
+    def attach(self, bucket, waiter):
+        """Запоминает ожидание токена, чтобы его приоритет можно было повысить"""
+        self.bucket = bucket
+        self.waiter = waiter
+        if waiter is not None:
+            waiter.priority = min(waiter.priority, self.priority)
+
+_buckets = {name: TokenBucket(name, rate, burst) for name, (rate, burst) in QUOTAS.items()}
+_breakers = {name: CircuitBreaker(name) for name in QUOTAS}
+
+def get_bucket(endpoint):
+    """Возвращает ограничитель частоты для типа запросов"""
+    return _buckets.get(endpoint, _buckets["default"])
+
+def get_breaker(endpoint):
+    """Возвращает размыкатель цепи для типа запросов"""
+    return _breakers.get(endpoint, _breakers["default"])
+
+async def acquire(endpoint):
+    """
+    Ждёт разрешения на запрос к API с приоритетом текущей задачи
+
+    Args:
+        endpoint (str): Тип запросов
+
+    Raises:
+        UpstreamOverloaded: Если запрос отброшен
+    """
+    bucket = get_bucket(endpoint)
+    call = _call.get()
+    level = get_priority() if call is None else min(get_priority(), call.priority)
+    waiter = _Waiter(level, time.monotonic() + DEADLINES[level])
+    if call is None:
+        await bucket.acquire(waiter)
+        return
+
+    call.attach(bucket, waiter)
+    try:
+        await bucket.acquire(waiter)
+    finally:
+        call.attach(None, None)
+
+def penalize(endpoint, delay):
+    """
+    Сообщает, что API ответил 429, и приостанавливает запросы к нему
+
+    Args:
+        endpoint (str): Тип запросов
+        delay (float): Пауза в секундах
+    """
+    get_bucket(endpoint).pause(delay)
+
+def stats():
+    """
+    Возвращает состояние очередей к API
+
+    Returns:
+        dict: Для каждого типа запросов - количество ожидающих и отброшенных запросов
+        и запросов, не отправленных из-за разомкнутой цепи
+    """
+    return {
+        name: {"queued": bucket.queued(), "shed": bucket.shed, "rejected": _breakers[name].rejected}
+        for name, bucket in _buckets.items()
+    }
+
+metrics.GaugeFunc(
+    "upstream_queue_depth", "Количество запросов, ожидающих квоты API",
+    lambda: {(name,): bucket.queued() for name, bucket in _buckets.items()}, ["endpoint"]
+)
+metrics.GaugeFunc(
+    "upstream_shed_total", "Количество запросов, отброшенных планировщиком квот",
+    lambda: {(name,): bucket.shed for name, bucket in _buckets.items()}, ["endpoint"], type="counter"
+)
+metrics.GaugeFunc(
+    "upstream_circuit_state", "Состояние цепи API: 0 - замкнута, 1 - пробный запрос, 2 - разомкнута",
+    lambda: {(name,): breaker.state for name, breaker in _breakers.items()}, ["endpoint"]
+)
+metrics.GaugeFunc(
+    "upstream_circuit_rejected_total", "Количество запросов, не отправленных из-за разомкнутой цепи",
+    lambda: {(name,): breaker.rejected for name, breaker in _breakers.items()}, ["endpoint"], type="counter"
+)
@@ -0,0 +1,219 @@
+import os
+import json
+import queue
+import signal
+import logging
+import threading
+import multiprocessing
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from dotenv import load_dotenv
+
+# Загружаем переменные окружения
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Настройки режима webhook
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", str(os.cpu_count() or 1)))
+WEBHOOK_WORKER_THREADS = int(os.getenv("WEBHOOK_WORKER_THREADS", "8"))
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "10000"))
+
+# Поля обновления, в которых Telegram передаёт отправителя
+_UPDATE_FIELDS = (
+    "message", "edited_message", "callback_query", "inline_query",
+    "chosen_inline_result", "shipping_query", "pre_checkout_query",
+    "poll_answer", "my_chat_member", "chat_member", "chat_join_request",
+)
+
+def get_shard_key(update):
+    """
+    Возвращает ключ распределения обновления по обработчикам
+
+    Ключ - идентификатор пользователя, поэтому все обновления одного
+    пользователя попадают в один процесс и один поток, а состояние беседы
+    и сессия остаются локальными.
+
+    Args:
+        update (dict): Обновление Telegram в виде JSON
+
+    Returns:
+        int: Ключ распределения
+    """
+    for field in _UPDATE_FIELDS:
+        payload = update.get(field) or {}
+        sender = payload.get("from") or payload.get("user")
+        if sender:
+            return sender["id"]
+
+    return update.get("update_id", 0)
+
+def get_shard(key, workers, threads):
+    """
+    Выбирает рабочий процесс и поток для ключа распределения
+
+    Процесс выбирается по остатку от деления на workers. Ключи одного
+    процесса сравнимы по модулю workers, поэтому поток выбирается по
+    частному, иначе процесс использовал бы только часть своих потоков.
+
+    Args:
+        key (int): Ключ распределения (см. get_shard_key)
+        workers (int): Количество рабочих процессов
+        threads (int): Количество потоков в процессе
+
+    Returns:
+        tuple: (номер процесса, номер потока)
+    """
+    return key % workers, key // workers % threads
+
+def run(token, setup_dispatcher, workers=WEBHOOK_WORKERS):
+    """
+    Запускает бота в режиме webhook с несколькими рабочими процессами
+
+    Основной процесс принимает обновления по HTTP и раскладывает их по
+    очередям рабочих процессов. При SIGTERM/SIGINT приём прекращается,
+    рабочие процессы дообрабатывают свои очереди и завершаются.
+
+    Args:
+        token (str): Токен бота
+        setup_dispatcher (callable): Функция регистрации обработчиков в диспетчере;
+            должна импортироваться по имени модуля, так как процессы запускаются заново
+        workers (int): Количество рабочих процессов
+    """
+    # Квоты внешних API общие для приложения: каждый процесс получает свою долю
+    os.environ["UPSTREAM_PROCESSES"] = str(workers)
+    context = multiprocessing.get_context("spawn")
+    queues = [context.Queue(WEBHOOK_QUEUE_SIZE) for _ in range(workers)]
+    processes = [
+        context.Process(
+            target=_worker_main,
+            args=(token, setup_dispatcher, queues[i], i, workers),
+            name=f"bot-worker-{i}"
+        )
+        for i in range(workers)
+    ]
+    for process in processes:
+        process.start()
+
+    server = ThreadingHTTPServer((WEBHOOK_HOST, WEBHOOK_PORT), _make_request_handler(queues))
+    server.daemon_threads = True
+
+    def drain(signum, frame):
+        # shutdown() ждёт завершения serve_forever, поэтому вызываем его из другого потока
+        logger.info("Получен сигнал %s, завершаю приём обновлений", signum)
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, drain)
+    signal.signal(signal.SIGINT, drain)
+
+    if WEBHOOK_URL:
+        from telegram import Bot
+        Bot(token).set_webhook(url=WEBHOOK_URL + WEBHOOK_PATH, secret_token=WEBHOOK_SECRET)
+
+    logger.info("Бот запущен в режиме webhook: %d рабочих процессов, порт %d", workers, WEBHOOK_PORT)
+    server.serve_forever()
+    server.server_close()
+
+    # Сообщаем рабочим процессам, что новых обновлений не будет, и ждём, пока они дообработают очереди
+    for update_queue in queues:
+        update_queue.put(None)
+    for process in processes:
+        process.join()
+    logger.info("Все рабочие процессы завершены")
+
+def _make_request_handler(queues):
+    """Создаёт обработчик HTTP-запросов, раскладывающий обновления по очередям"""
+
+    class WebhookRequestHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            if self.path != WEBHOOK_PATH:
+                self.send_response(404)
+                self.end_headers()
+                return
+
+            if WEBHOOK_SECRET and self.headers.get("X-Telegram-Bot-Api-Secret-Token") != WEBHOOK_SECRET:
+                self.send_response(403)
+                self.end_headers()
+                return
+
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            try:
+                update = json.loads(body)
+                process, _ = get_shard(get_shard_key(update), len(queues), 1)
+                queues[process].put_nowait(body)
+            except ValueError:
+                self.send_response(400)
+            except queue.Full:
+                # Telegram повторит доставку обновления позже
+                self.send_response(503)
+            else:
+                self.send_response(200)
+            self.end_headers()
+
+        def log_message(self, format, *args):
+            logger.debug(format, *args)
+
+    return WebhookRequestHandler
+
+def _worker_main(token, setup_dispatcher, update_queue, index, workers):
+    """
+    Точка входа рабочего процесса
+
+    Обновления одного пользователя обрабатываются последовательно: внутри
+    процесса они раскладываются по потокам по тому же ключу.
+    """
+    # Сигналы обрабатывает основной процесс, рабочий завершается по пустому обновлению
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+    from telegram import Bot, Update
+    from telegram.ext import Dispatcher, JobQueue
+
+    bot = Bot(token)
+    job_queue = JobQueue()
+    dispatcher = Dispatcher(bot, None, job_queue=job_queue)
+    job_queue.set_dispatcher(dispatcher)
+    setup_dispatcher(dispatcher)
+    job_queue.start()
+
+    # У каждого рабочего процесса свои метрики, поэтому и свой порт: METRICS_PORT + номер процесса
+    import metrics
+    if metrics.METRICS_PORT:
+        metrics.start_server(metrics.METRICS_PORT + index)
+
+    def process(thread_queue):
+        while True:
+            body = thread_queue.get()
+            if body is None:
+                return
+            try:
+                dispatcher.process_update(Update.de_json(json.loads(body), bot))
+            except Exception:
+                logger.exception("Ошибка обработки обновления")
+
+    thread_queues = [queue.Queue() for _ in range(WEBHOOK_WORKER_THREADS)]
+    threads = [threading.Thread(target=process, args=(thread_queue,)) for thread_queue in thread_queues]
+    for thread in threads:
+        thread.start()
+
+    while True:
+        body = update_queue.get()
+        if body is None:
+            break
+        _, thread = get_shard(get_shard_key(json.loads(body)), workers, len(thread_queues))
+        thread_queues[thread].put(body)
+
+    # Дообрабатываем уже полученные обновления и останавливаем фоновые задачи
+    for thread_queue in thread_queues:
+        thread_queue.put(None)
+    for thread in threads:
+        thread.join()
+    import async_runtime
+    async_runtime.drain()
+    job_queue.stop()
+    dispatcher.stop()
+    logger.info("Рабочий процесс %d завершён", index)
@@ -1,6 +1,15 @@
 import os
+import asyncio
+import numpy as np
 import requests
+import async_runtime
+import http_client
+import upstream
+import metrics
 from dotenv import load_dotenv
+from cache import TTLCache, Revalidator
+from poi_index import POIIndex
+from geo import geohash_encode, geohash_bounds, geohash_center, distances_from, meters_to_degrees
 
 # Загружаем переменные окружения
 load_dotenv()
@@ -8,97 +17,453 @@ load_dotenv()
 # API-ключ
 API_KEY = os.getenv("YANDEX_API_KEY")
 
-# Базовые URL для API-запросов
+# Базовые URL для API-запросов (переопределяются, например, для нагрузочного тестирования)
 GEOCODE_URL = "https://geocode-maps.yandex.ru/1.x/"
-SEARCH_URL = "https://search-maps.yandex.ru/v1/"
-STATIC_MAPS_URL = "https://static-maps.yandex.ru/1.x/"
+SEARCH_URL = os.getenv("YANDEX_SEARCH_URL", "https://search-maps.yandex.ru/v1/")
+STATIC_MAPS_URL = os.getenv("YANDEX_STATIC_MAPS_URL", "https://static-maps.yandex.ru/1.x/")
 
-def get_nearby_places(latitude, longitude, radius, types=None, limit=20):
+# Настройки кэша результатов поиска по ячейкам geohash
+SEARCH_CACHE_TTL = int(os.getenv("SEARCH_CACHE_TTL", "900"))
+SEARCH_CACHE_SIZE = int(os.getenv("SEARCH_CACHE_SIZE", "2048"))
+# Сколько секунд после истечения срока показывать устаревшие результаты, пока они обновляются
+SEARCH_CACHE_STALE_TTL = int(os.getenv("SEARCH_CACHE_STALE_TTL", "3600"))
+SEARCH_TILE_RESULTS = int(os.getenv("SEARCH_TILE_RESULTS", "50"))
+# Сколько мест ячейки можно догрузить при листании списка
+SEARCH_MAX_RESULTS = int(os.getenv("SEARCH_MAX_RESULTS", "500"))
+
+# Радиус, с которым ячейка запрашивается один раз для всех меньших радиусов
+# (0 - каждый радиус запрашивается отдельно), и количество мест в таком запросе
+SEARCH_SUPERSET_RADIUS = int(os.getenv("SEARCH_SUPERSET_RADIUS", "1000"))
+SEARCH_SUPERSET_RESULTS = int(os.getenv("SEARCH_SUPERSET_RESULTS", "200"))
+
+_tile_cache = TTLCache(maxsize=SEARCH_CACHE_SIZE, ttl=SEARCH_CACHE_TTL, stale_ttl=SEARCH_CACHE_STALE_TTL)
+_tile_revalidator = Revalidator(workers=int(os.getenv("SEARCH_REVALIDATE_WORKERS", "4")))
+metrics.register_cache("search_tiles", _tile_cache)
+
+# Кэш полных записей о местах по идентификатору
+PLACE_CACHE_TTL = int(os.getenv("PLACE_CACHE_TTL", "3600"))
+PLACE_CACHE_SIZE = int(os.getenv("PLACE_CACHE_SIZE", "20000"))
+
+_place_cache = TTLCache(maxsize=PLACE_CACHE_SIZE, ttl=PLACE_CACHE_TTL)
+metrics.register_cache("places", _place_cache)
+
+# Тексты запросов для категорий мест
+QUERY_TEXTS = [
+    ({"museum", "historic", "landmark"}, "музей|памятник|достопримечательность"),
+    ({"park", "natural_feature"}, "парк|сад|природная достопримечательность"),
+    ({"church", "mosque", "hindu_temple", "synagogue"}, "храм|церковь|мечеть|синагога"),
+    ({"art_gallery", "library"}, "галерея|библиотека|выставка"),
+    ({"amusement_park", "zoo", "aquarium"}, "зоопарк|аквариум|парк развлечений"),
+]
+
+# Общий бюджет времени на параллельные запросы по нескольким категориям
+SEARCH_BUDGET = float(os.getenv("SEARCH_BUDGET", "6"))
+
+# Локальная выгрузка достопримечательностей (JSONL или CSV), из которой
+# запросы обслуживаются без обращения к API там, где она покрывает область поиска
+POI_DATASET_PATH = os.getenv("POI_DATASET_PATH")
+
+poi_index = POIIndex.load(POI_DATASET_PATH) if POI_DATASET_PATH else None
+
+async def get_nearby_places_async(latitude, longitude, radius, types=None, limit=20, fetch_more=False, expand_radii=()):
     """
     Получает список ближайших достопримечательностей через Яндекс API
     
+    Сначала запрос обслуживается из локального индекса мест, если он
+    покрывает область поиска. Иначе результаты поиска кэшируются по ячейке
+    geohash и тексту запроса. Радиусы до SEARCH_SUPERSET_RADIUS используют
+    одни и те же результаты, запрошенные с этим радиусом, поэтому пользователи,
+    стоящие рядом, обслуживаются из одного кэша при любом радиусе, а выдача
+    фильтруется локально по точному кругу каждого пользователя.
+    
+    Выдача с радиусом SEARCH_SUPERSET_RADIUS ограничена по количеству и
+    упорядочена по релевантности, поэтому, если она заполнена целиком, а в
+    круге пользователя мест меньше limit, круг запрашивается отдельно.
+    
+    Если в круге ничего нет, поиск расширяется до следующего радиуса из
+    expand_radii - по тем же результатам, без новых запросов к API.
+    
+    При fetch_more, если в круге меньше limit мест, следующие страницы
+    выдачи догружаются к закэшированным результатам ячейки (параметр skip),
+    а не запрашиваются заново.
+    
     Args:
         latitude (float): Широта местоположения пользователя
         longitude (float): Долгота местоположения пользователя
         radius (int): Радиус поиска в метрах
         types (list): Список типов мест для поиска
         limit (int): Максимальное количество результатов
+        fetch_more (bool): Догружать выдачу, если в круге не хватает мест
+        expand_radii (list): Радиусы, до которых расширяется поиск, если в круге ничего нет
         
+    Returns:
+        list: Список найденных мест; при расширении поиска все они дальше radius
+    """
+    radii = [radius] + sorted(r for r in expand_radii if r > radius)
+    
+    if poi_index is not None and poi_index.covers(latitude, longitude, radius):
+        for search_radius in radii:
+            if not poi_index.covers(latitude, longitude, search_radius):
+                break
+            places = poi_index.query(latitude, longitude, search_radius, types, limit)
+            if places:
+                break
+        remember_places(places)
+        return places
+    
+    texts = _get_query_texts(types)
+    if radius <= SEARCH_SUPERSET_RADIUS:
+        search_radius = SEARCH_SUPERSET_RADIUS
+        tile_limit = max(limit, SEARCH_SUPERSET_RESULTS)
+    else:
+        search_radius = radius
+        tile_limit = max(limit, SEARCH_TILE_RESULTS)
+    tile = geohash_encode(latitude, longitude, _get_tile_precision(search_radius))
+    
+    results = await _search_texts(tile, texts, search_radius, tile_limit)
+    candidates = _merge_places(results)
+    places = filter_by_radius(candidates, latitude, longitude, radius, limit)
+    
+    while fetch_more and len(places) < limit and tile_limit < SEARCH_MAX_RESULTS and _is_truncated(results, tile_limit):
+        tile_limit = min(tile_limit + SEARCH_TILE_RESULTS, SEARCH_MAX_RESULTS)
+        results = await _search_texts(tile, texts, search_radius, tile_limit)
+        candidates = _merge_places(results)
+        places = filter_by_radius(candidates, latitude, longitude, radius, limit)
+    
+    # Выдача с большим радиусом обрезается по релевантности, и ближние места могли в неё
+    # не попасть - тогда круг пользователя запрашивается напрямую, а не расширяется
+    if search_radius > radius and len(places) < limit and _is_truncated(results, tile_limit):
+        direct_tile = geohash_encode(latitude, longitude, _get_tile_precision(radius))
+        direct = await _search_texts(direct_tile, texts, radius, max(limit, SEARCH_TILE_RESULTS))
+        candidates = _merge_places([candidates] + direct)
+        places = filter_by_radius(candidates, latitude, longitude, radius, limit)
+    
+    # В круге пусто - расширяем его, пока он не выходит за область уже полученных результатов
+    for expanded_radius in radii[1:]:
+        if places or expanded_radius > search_radius:
+            break
+        places = filter_by_radius(candidates, latitude, longitude, expanded_radius, limit)
+    
+    # Записи могли быть вытеснены из кэша мест раньше, чем ячейка из кэша поиска
+    remember_places(places)
+    return places
+
+def get_nearby_places(latitude, longitude, radius, types=None, limit=20, fetch_more=False, expand_radii=()):
+    """
+    Синхронная версия get_nearby_places_async для вызова из потоков
+    
     Returns:
         list: Список найденных мест
     """
-    # Формируем текст запроса на основе типов
-    text = "достопримечательность"
-    if types:
-        if "museum" in types or "historic" in types or "landmark" in types:
-            text = "музей|памятник|достопримечательность"
-        elif "park" in types or "natural_feature" in types:
-            text = "парк|сад|природная достопримечательность"
-        elif "church" in types or "mosque" in types or "hindu_temple" in types or "synagogue" in types:
-            text = "храм|церковь|мечеть|синагога"
-        elif "art_gallery" in types or "library" in types:
-            text = "галерея|библиотека|выставка"
-        elif "amusement_park" in types or "zoo" in types or "aquarium" in types:
-            text = "зоопарк|аквариум|парк развлечений"
+    return async_runtime.run(get_nearby_places_async(latitude, longitude, radius, types, limit, fetch_more, expand_radii))
+
+async def _search_texts(tile, texts, radius, limit):
+    """
+    Возвращает места ячейки для каждого текста запроса
+    
+    Args:
+        tile (str): Geohash ячейки
+        texts (list): Тексты запросов
+        radius (int): Радиус поиска в метрах
+        limit (int): Количество мест, которое нужно получить для каждого текста
+        
+    Returns:
+        list: Списки мест; None означает неудавшийся запрос
+    """
+    if len(texts) == 1:
+        return [await _get_tile_places(tile, texts[0], radius, limit)]
+    
+    # Запросы по категориям выполняются параллельно в пределах общего бюджета времени;
+    # не успевшие запросы пропускаются, но их результаты всё равно попадут в кэш
+    tasks = [async_runtime.spawn(_get_tile_places(tile, text, radius, limit)) for text in texts]
+    done, _ = await asyncio.wait(tasks, timeout=SEARCH_BUDGET)
+    return [task.result() for task in tasks if task in done]
+
+async def _get_tile_places(tile, text, radius, limit):
+    """
+    Возвращает места ячейки из кэша или запрашивает их у API
+    
+    Если в кэше меньше limit мест и выдача API ещё не исчерпана,
+    запрашивается только недостающая часть выдачи. Устаревшие результаты
+    возвращаются сразу, а ячейка запрашивается заново в фоне.
+    
+    Args:
+        tile (str): Geohash ячейки
+        text (str): Текст запроса
+        radius (int): Радиус поиска в метрах
+        limit (int): Количество мест, которое нужно получить
+        
+    Returns:
+        list: Список мест или None при ошибке запроса
+    """
+    cache_key = (tile, text, radius)
+    # В кэше хранятся места ячейки и признак того, что выдача API закончилась
+    cached, stale = _tile_cache.get_stale(cache_key)
+    tile_places, exhausted = cached if cached is not None else ([], False)
+    if stale:
+        _tile_revalidator.submit(cache_key, _refresh_tile, tile, text, radius, max(len(tile_places), limit))
+        return tile_places
+    if exhausted or len(tile_places) >= limit:
+        return tile_places
+    
+    page = await _search_tile(tile, text, radius, limit - len(tile_places), skip=len(tile_places))
+    if page is None:
+        return tile_places if cached is not None else None
+    
+    exhausted = len(page) < limit - len(tile_places)
+    tile_places = _merge_places([tile_places, page])
+    _tile_cache.set(cache_key, (tile_places, exhausted))
+    
+    return tile_places
+
+async def _refresh_tile(tile, text, radius, limit):
+    """Запрашивает места ячейки заново и заменяет ими устаревшую запись кэша (через Revalidator)"""
+    with upstream.priority(upstream.PREFETCH):
+        tile_places = await _search_tile(tile, text, radius, limit)
+    if tile_places is not None:
+        _tile_cache.set((tile, text, radius), (tile_places, len(tile_places) < limit))
+
+def _is_truncated(results, limit):
+    """
+    Проверяет, могут ли у API быть ещё места сверх полученных
+    
+    Ячейка, вернувшая меньше запрошенного, исчерпана.
+    
+    Args:
+        results (list): Списки мест; None означает неудавшийся запрос
+        limit (int): Количество мест, запрошенное для каждого текста
+        
+    Returns:
+        bool: True, если хотя бы одна выдача заполнена до limit
+    """
+    return any(result is not None and len(result) >= limit for result in results)
+
+def _merge_places(results):
+    """
+    Объединяет результаты нескольких запросов без дубликатов
+    
+    Дубликатами считаются места с одинаковым идентификатором или
+    совпадающими (с точностью около метра) координатами.
+    
+    Args:
+        results (list): Списки мест; None означает неудавшийся запрос
+        
+    Returns:
+        list: Объединённый список мест
+    """
+    places = []
+    seen_ids = set()
+    seen_coordinates = set()
+    for result in results:
+        for place in result or []:
+            location = place["geometry"]["location"]
+            coordinates = (round(location["lat"], 5), round(location["lng"], 5))
+            if (place["place_id"] and place["place_id"] in seen_ids) or coordinates in seen_coordinates:
+                continue
+            seen_ids.add(place["place_id"])
+            seen_coordinates.add(coordinates)
+            places.append(place)
+    
+    return places
+
+def filter_by_radius(places, latitude, longitude, radius, limit=None):
+    """
+    Оставляет места внутри круга и сортирует их по расстоянию
+    
+    Расстояния для всех мест вычисляются одной векторной операцией и
+    сохраняются в поле "distance" копий записей.
+    
+    Args:
+        places (list): Список мест
+        latitude (float): Широта центра круга
+        longitude (float): Долгота центра круга
+        radius (int): Радиус круга в метрах
+        limit (int): Максимальное количество результатов
+        
+    Returns:
+        list: Места внутри круга, от ближайшего к дальнему
+    """
+    if not places:
+        return []
+    
+    distances = distances_from(
+        latitude,
+        longitude,
+        [place["geometry"]["location"]["lat"] for place in places],
+        [place["geometry"]["location"]["lng"] for place in places]
+    )
+    
+    result = []
+    for i in np.argsort(distances, kind="stable"):
+        if distances[i] > radius or (limit is not None and len(result) >= limit):
+            break
+        place = dict(places[i])
+        place["distance"] = float(distances[i])
+        result.append(place)
+    
+    return result
+
+def _get_query_texts(types):
+    """
+    Формирует тексты поисковых запросов - по одному на каждую выбранную категорию
+    
+    Args:
+        types (list): Список типов мест для поиска
+        
+    Returns:
+        list: Тексты запросов
+    """
+    texts = [text for category_types, text in QUERY_TEXTS if types and set(types) & category_types]
+    return texts or ["достопримечательность"]
+
+def _get_tile_precision(radius):
+    """
+    Подбирает размер ячейки geohash под радиус поиска
+    
+    Args:
+        radius (int): Радиус поиска в метрах
+        
+    Returns:
+        int: Точность geohash (7 - ячейка ~150м, 6 - ячейка ~1.2x0.6км)
+    """
+    return 7 if radius <= 300 else 6
+
+async def _search_tile(tile, text, radius, limit, skip=0):
+    """
+    Выполняет поиск мест, покрывающий всю ячейку geohash с запасом на радиус
+    
+    Args:
+        tile (str): Geohash ячейки
+        text (str): Текст запроса
+        radius (int): Радиус поиска в метрах
+        limit (int): Максимальное количество результатов
+        skip (int): Сколько первых результатов выдачи пропустить
+        
+    Returns:
+        list: Список найденных мест или None при ошибке запроса
+    """
+    min_lat, min_lng, max_lat, max_lng = geohash_bounds(tile)
+    center_lat, center_lng = geohash_center(tile)
+    
+    # Область поиска - ячейка, расширенная на радиус в каждую сторону
+    lat_margin, lng_margin = meters_to_degrees(radius, center_lat)
+    lat_span = (max_lat - min_lat) + 2 * lat_margin
+    lng_span = (max_lng - min_lng) + 2 * lng_margin
     
     params = {
         "apikey": API_KEY,
         "text": text,
         "lang": "ru_RU",
-        "ll": f"{longitude},{latitude}",
-        "spn": f"{radius/100000},{radius/100000}",
+        "ll": f"{center_lng},{center_lat}",
+        "spn": f"{lng_span:.6f},{lat_span:.6f}",
+        "rspn": 1,
         "results": limit,
         "type": "biz",
     }
+    if skip:
+        params["skip"] = skip
     
     try:
-        response = requests.get(SEARCH_URL, params=params)
+        response = await http_client.get_async(SEARCH_URL, endpoint="yandex_search", operation="search", params=params)
         response.raise_for_status()
         data = response.json()
         
         if "features" not in data:
             print("Ошибка API: Нет результатов")
-            return []
-        
-        # Преобразуем формат данных для совместимости с существующим кодом
-        places = []
-        for feature in data["features"]:
-            properties = feature["properties"]
-            geometry = feature["geometry"]
-            
-            place = {
-                "place_id": properties["CompanyMetaData"].get("id", ""),
-                "name": properties["name"],
-                "geometry": {
-                    "location": {
-                        "lat": geometry["coordinates"][1],
-                        "lng": geometry["coordinates"][0]
-                    }
-                }
-            }
-            
-            # Добавляем адрес, если есть
-            if "address" in properties["CompanyMetaData"]:
-                place["vicinity"] = properties["CompanyMetaData"]["address"]
-            
-            places.append(place)
-            
+            return None
+        
+        # Сохраняем полные записи о местах, чтобы открытие карточки не требовало повторного запроса
+        places = [_normalize_feature(feature) for feature in data["features"]]
+        remember_places(places)
+        
         return places
     
     except requests.exceptions.RequestException as e:
         print(f"Ошибка при запросе к API: {e}")
-        return []
+        return None
 
-def get_place_details(place_id):
+def remember_places(places):
+    """
+    Сохраняет записи о местах в кэш для последующего получения деталей
+    
+    Args:
+        places (list): Список мест
+    """
+    for place in places:
+        if place.get("place_id"):
+            record = dict(place)
+            record.pop("distance", None)
+            _place_cache.set(place["place_id"], record)
+
+def _normalize_feature(feature, place_id=None):
+    """
+    Преобразует объект из ответа поиска в запись о месте со всеми метаданными
+    
+    Args:
+        feature (dict): Объект GeoJSON из ответа API
+        place_id (str): Идентификатор места (по умолчанию - из метаданных организации)
+        
+    Returns:
+        dict: Запись о месте в формате, совместимом с текущим кодом
+    """
+    properties = feature["properties"]
+    geometry = feature["geometry"]
+    metadata = properties.get("CompanyMetaData", {})
+    
+    result = {
+        "place_id": place_id or metadata.get("id", ""),
+        "name": properties["name"],
+        "geometry": {
+            "location": {
+                "lat": geometry["coordinates"][1],
+                "lng": geometry["coordinates"][0]
+            }
+        }
+    }
+    
+    # Добавляем адрес
+    if "address" in metadata:
+        result["vicinity"] = metadata["address"]
+        result["formatted_address"] = metadata["address"]
+    
+    # Добавляем телефон
+    if "Phones" in metadata and metadata["Phones"]:
+        result["formatted_phone_number"] = metadata["Phones"][0].get("formatted", "")
+    
+    # Добавляем URL
+    if "url" in metadata:
+        result["website"] = metadata["url"]
+    
+    # Добавляем время работы
+    if "Hours" in metadata:
+        result["opening_hours"] = {
+            "weekday_text": metadata["Hours"].get("text", "")
+        }
+    
+    # Добавляем фото (используем статическую карту как превью)
+    result["photos"] = [{
+        "photo_reference": f"{geometry['coordinates'][1]},{geometry['coordinates'][0]}"
+    }]
+    
+    return result
+
+async def get_place_details_async(place_id):
     """
     Получает подробную информацию о месте через Яндекс API
     
+    Полные записи о местах сохраняются при поиске, поэтому запрос к API
+    выполняется только если места нет в кэше.
+    
     Args:
         place_id (str): Идентификатор места
         
     Returns:
         dict: Подробная информация о месте
     """
+    cached = _place_cache.get(place_id)
+    if cached is not None:
+        return dict(cached)
+    
     # В Яндекс API нет отдельного метода для получения детальной информации по ID объекта
     # Поэтому используем поиск по ID
     params = {
@@ -110,7 +475,7 @@ def get_place_details(place_id):
     }
     
     try:
-        response = requests.get(SEARCH_URL, params=params)
+        response = await http_client.get_async(SEARCH_URL, endpoint="yandex_search", operation="details", params=params)
         response.raise_for_status()
         data = response.json()
         
@@ -118,45 +483,8 @@ def get_place_details(place_id):
             print(f"Ошибка API: Место с ID {place_id} не найдено")
             return {}
         
-        feature = data["features"][0]
-        properties = feature["properties"]
-        geometry = feature["geometry"]
-        metadata = properties.get("CompanyMetaData", {})
-        
-        # Формируем результат в формате, совместимом с текущим кодом
-        result = {
-            "place_id": place_id,
-            "name": properties["name"],
-            "geometry": {
-                "location": {
-                    "lat": geometry["coordinates"][1],
-                    "lng": geometry["coordinates"][0]
-                }
-            }
-        }
-        
-        # Добавляем адрес
-        if "address" in metadata:
-            result["formatted_address"] = metadata["address"]
-        
-        # Добавляем телефон
-        if "Phones" in metadata and metadata["Phones"]:
-            result["formatted_phone_number"] = metadata["Phones"][0].get("formatted", "")
-        
-        # Добавляем URL
-        if "url" in metadata:
-            result["website"] = metadata["url"]
-        
-        # Добавляем время работы
-        if "Hours" in metadata:
-            result["opening_hours"] = {
-                "weekday_text": metadata["Hours"].get("text", "")
-            }
-        
-        # Добавляем фото (используем статическую карту как превью)
-        result["photos"] = [{
-            "photo_reference": f"{geometry['coordinates'][1]},{geometry['coordinates'][0]}"
-        }]
+        result = _normalize_feature(data["features"][0], place_id)
+        _place_cache.set(place_id, result)
         
         return result
     
@@ -164,6 +492,45 @@ def get_place_details(place_id):
         print(f"Ошибка при запросе к API: {e}")
         return {}
 
+def get_place_details(place_id):
+    """
+    Синхронная версия get_place_details_async для вызова из потоков
+    
+    Returns:
+        dict: Подробная информация о месте
+    """
+    return async_runtime.run(get_place_details_async(place_id))
+
+async def get_static_map_async(latitude, longitude, zoom=16):
+    """
+    Загружает изображение статической карты Яндекса
+    
+    Args:
+        latitude (float): Широта
+        longitude (float): Долгота
+        zoom (int): Уровень приближения
+        
+    Returns:
+        bytes: Изображение карты или None при ошибке запроса
+    """
+    try:
+        response = await http_client.get_async(get_static_map_url(latitude, longitude, zoom), endpoint="yandex_static", operation="static_map")
+        response.raise_for_status()
+        return response.content
+    
+    except requests.exceptions.RequestException as e:
+        print(f"Ошибка при загрузке карты: {e}")
+        return None
+
+def get_static_map(latitude, longitude, zoom=16):
+    """
+    Синхронная версия get_static_map_async для вызова из потоков
+    
+    Returns:
+        bytes: Изображение карты или None при ошибке запроса
+    """
+    return async_runtime.run(get_static_map_async(latitude, longitude, zoom))
+
 def get_static_map_url(latitude, longitude, zoom=16):
     """
     Возвращает URL статической карты Яндекса
@@ -191,4 +558,17 @@ def get_route_url(from_lat, from_lng, to_lat, to_lng):
     Returns:
         str: URL маршрута
     """
-    return f"https://yandex.ru/maps/?rtext={from_lat},{from_lng}~{to_lat},{to_lng}&rtt=pd" 
\ No newline at end of file
+    return f"https://yandex.ru/maps/?rtext={from_lat},{from_lng}~{to_lat},{to_lng}&rtt=pd"
+
+def get_tour_url(waypoints):
+    """
+    Создает URL пешеходного маршрута через несколько точек в Яндекс Картах
+    
+    Args:
+        waypoints (list): Точки маршрута по порядку [(широта, долгота), ...]
+        
+    Returns:
+        str: URL маршрута
+    """
+    rtext = "~".join(f"{lat},{lng}" for lat, lng in waypoints)
+    return f"https://yandex.ru/maps/?rtext={rtext}&rtt=pd"